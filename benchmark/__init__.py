@@ -0,0 +1,12 @@
+import os
+import shutil
+import sys
+
+# The handlers import sampling_core from the shared Lambda layer
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'lambda', 'shared', 'python'))
+
+# ffmpeg from the PATH instead of the Lambda layer, boto3 clients created by the handlers need a region
+if 'FFMPEG_PATH' not in os.environ and shutil.which('ffmpeg') is not None:
+    os.environ['FFMPEG_PATH'] = shutil.which('ffmpeg')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
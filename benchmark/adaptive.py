@@ -0,0 +1,89 @@
+import argparse
+import json
+import sys
+from sampling_core.adaptive import dense_windows
+from benchmark.pipelines import PIPELINES
+from benchmark.run import run_cases
+from benchmark.videos import FRAME_RATE, VIDEO_DIR, flagged_windows, generate_video
+
+def is_red(t, windows):
+    return any(start <= t <= end for start, end in windows)
+
+def expected_timestamps(duration, windows, sample_frequency, dense_sample_frequency, dense_window):
+    # Seconds the red boxes are sampled at: the sparse frames inside a red window, and the dense
+    # frames of the windows densified around them
+    sparse = [k / sample_frequency for k in range(int(duration * sample_frequency) + 1) if k / sample_frequency < duration]
+    flagged = [{"Timestamp": t * 1000, "ModerationLabel": [{}]} for t in sparse if is_red(t, windows)]
+    expected = set(t for t in sparse if is_red(t, windows))
+    for start, end in dense_windows(flagged, dense_window):
+        j = 0
+        while start + j / dense_sample_frequency < min(end, duration):
+            t = start + j / dense_sample_frequency
+            if is_red(t, windows):
+                expected.add(round(t, 3))
+            j += 1
+    return sorted(expected)
+
+def check(report, expected, frame_rate):
+    # A sampled time is found when a flagged frame is the first frame of the video at or after it.
+    # A flagged frame outside the red windows has a wrong timestamp.
+    timestamps = sorted(l["Timestamp"] / 1000 for l in report["labels"] or [])
+    frame = 1 / frame_rate + 0.001
+    found = [t for t in expected if any(t - 0.001 <= s <= t + frame for s in timestamps)]
+    return {
+        "pipeline": report["pipeline"],
+        "expected_frames": len(expected),
+        "found_frames": len(found),
+        "dense_recall": round(len(found) / len(expected), 3) if len(expected) > 0 else None,
+        "misplaced": [s for s in timestamps if not is_red(s, report["flagged_windows"])],
+        "missed": [t for t in expected if t not in found]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that adaptive sampling moderates the frames around the flagged frames at the dense rate, with their real timestamps.')
+    parser.add_argument('--pipeline', choices=PIPELINES + ['all'], default='all')
+    parser.add_argument('--duration', type=int, default=30, help='video length in seconds')
+    parser.add_argument('--resolution', default='320x180', help='video size WIDTHxHEIGHT')
+    parser.add_argument('--frame-rate', type=int, default=FRAME_RATE)
+    parser.add_argument('--flagged-every', type=int, default=10, help='draw a red box, flagged by the fake Rekognition, every N seconds')
+    parser.add_argument('--sample-frequency', type=float, default=0.5)
+    parser.add_argument('--dense-sample-frequency', type=float, default=4)
+    parser.add_argument('--dense-window', type=float, default=2)
+    parser.add_argument('--min-recall', type=float, default=1, help='exit with an error below this dense recall')
+    parser.add_argument('--video-dir', default=VIDEO_DIR)
+    args = parser.parse_args()
+
+    video = generate_video(args.duration, args.resolution, flagged_every=args.flagged_every, frame_rate=args.frame_rate, video_dir=args.video_dir)
+    windows = flagged_windows(args.duration, args.flagged_every)
+    pipelines = PIPELINES if args.pipeline == 'all' else [args.pipeline]
+    cases = [{
+        "pipeline": pipeline,
+        "video": video,
+        "duration": args.duration,
+        "resolution": args.resolution,
+        "flagged_windows": windows,
+        "event": {"sample_frequency": args.sample_frequency, "dense_sample_frequency": args.dense_sample_frequency, "dense_window": args.dense_window},
+        "s3_latency": 0,
+        "rekognition_latency": 0,
+        "latency_jitter": 0,
+        "rekognition_quota": None,
+        "label_images": True,
+        "lambda_timeout": None,
+        "batch_size": 20,
+        "map_concurrency": 10
+    } for pipeline in pipelines]
+
+    expected = expected_timestamps(args.duration, windows, args.sample_frequency, args.dense_sample_frequency, args.dense_window)
+    failed = False
+    for report in run_cases(cases):
+        if "error" in report:
+            print(f'{report["pipeline"]}: failed: {report["error"]}')
+            failed = True
+            continue
+        result = check(report, expected, args.frame_rate)
+        print(json.dumps(result))
+        failed = failed or result["dense_recall"] is None or result["dense_recall"] < args.min_recall or len(result["misplaced"]) > 0
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, deque
+from botocore.exceptions import ClientError
+from sampling_core.frames import FFMPEG_PATH
+
+SNS_MAX_MESSAGE_BYTES = 256 * 1024
+RED_FRACTION_LABEL = 0.05 # fraction of red pixels above which an image is flagged
+LABEL_SAMPLE_SIZE = 32 # images are downscaled to this width/height before counting red pixels
+
+class ApiCounter:
+    # Calls made to a fake service, per operation
+    def __init__(self):
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+class Latency:
+    # Injected latency of a fake API call: seconds, plus a uniform random jitter
+    def __init__(self, seconds=0, jitter=0):
+        self.seconds = seconds
+        self.jitter = jitter
+
+    def wait(self):
+        delay = self.seconds + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+class Body:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.stream.read(chunk_size)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+def client_error(code, operation, message=''):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+class FakeS3:
+    # In memory S3. Objects also spill to local_dir for presigned URLs, which ffmpeg reads as local files.
+    def __init__(self, local_dir, latency=None):
+        self.objects = {}
+        self.local_dir = local_dir
+        self.latency = latency or Latency()
+        self.api = ApiCounter()
+        self.lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def call(self, operation):
+        self.api.count(operation)
+        self.latency.wait()
+
+    def add_file(self, bucket, key, path):
+        with open(path, 'rb') as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def get(self, bucket, key, operation='GetObject'):
+        with self.lock:
+            if (bucket, key) not in self.objects:
+                raise client_error('NoSuchKey', operation, key)
+            return self.objects[(bucket, key)]
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self.call('PutObject')
+        data = Body.encode() if isinstance(Body, str) else Body
+        with self.lock:
+            self.objects[(Bucket, Key)] = data
+            self.bytes_in += len(data)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.call('HeadObject')
+        data = self.get(Bucket, Key, 'HeadObject')
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"', "ContentLength": len(data)}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.call('GetObject')
+        data = self.get(Bucket, Key)
+        size = len(data)
+        response = {"ContentLength": size}
+        if Range is not None:
+            # bytes=start-end
+            start, end = [int(v) for v in Range.split('=')[1].split('-')]
+            data = data[start:end + 1]
+            response["ContentRange"] = f'bytes {start}-{start + len(data) - 1}/{size}'
+        with self.lock:
+            self.bytes_out += len(data)
+        response["Body"] = Body(data)
+        return response
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        self.call('GetObject')
+        data = self.get(Bucket, Key)
+        with open(Filename, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            self.bytes_out += len(data)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        # no HTTP server: ffmpeg reads a local copy of the object
+        path = os.path.join(self.local_dir, 'presigned-' + Params["Key"].replace('/', '_'))
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(self.get(Params["Bucket"], Params["Key"]))
+        return path
+
+    def list_keys(self, bucket, prefix):
+        with self.lock:
+            return sorted(k for b, k in self.objects if b == bucket and k.startswith(prefix))
+
+    def list_objects(self, Bucket, Prefix='', **kwargs):
+        self.call('ListObjects')
+        keys = self.list_keys(Bucket, Prefix)[0:1000]
+        return {"Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)])} for k in keys]}
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self, operation_name)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.call('DeleteObject')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.call('DeleteObjects')
+        if len(Delete["Objects"]) > 1000:
+            raise client_error('MalformedXML', 'DeleteObjects', 'more than 1000 keys')
+        with self.lock:
+            for o in Delete["Objects"]:
+                self.objects.pop((Bucket, o["Key"]), None)
+        return {"Errors": []}
+
+class FakePaginator:
+    def __init__(self, s3, operation_name):
+        self.s3 = s3
+        self.operation_name = operation_name
+
+    def paginate(self, Bucket, Prefix='', StartAfter='', **kwargs):
+        # one ListObjectsV2 call per page of 1000 keys
+        keys = [k for k in self.s3.list_keys(Bucket, Prefix) if k > StartAfter]
+        for i in range(0, max(len(keys), 1), 1000):
+            self.s3.call('ListObjectsV2')
+            yield {"Contents": [{"Key": k, "Size": len(self.s3.objects[(Bucket, k)])} for k in keys[i:i + 1000]]}
+
+def red_fraction(image):
+    # share of strongly red pixels, on a downscaled copy decoded by ffmpeg
+    result = subprocess.run([FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0', '-vf', f'scale={LABEL_SAMPLE_SIZE}:{LABEL_SAMPLE_SIZE}',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1'], input=image, capture_output=True)
+    pixels = result.stdout
+    count = len(pixels) // 3
+    if count == 0:
+        return 0
+    red = 0
+    for i in range(0, count * 3, 3):
+        if pixels[i] > 160 and pixels[i + 1] < 80 and pixels[i + 2] < 80:
+            red += 1
+    return red / count
+
+class FakeRekognition:
+    # DetectModerationLabels with injected latency and a TPS quota: calls over the quota
+    # in the last second fail with ThrottlingException.
+    # label_images: flag images with red areas (the synthetic videos draw red boxes), costs an ffmpeg run per call
+    def __init__(self, s3=None, latency=None, tps_quota=None, label_images=False):
+        self.s3 = s3
+        self.latency = latency or Latency()
+        self.tps_quota = tps_quota
+        self.label_images = label_images
+        self.api = ApiCounter()
+        self.throttled = 0
+        self.window = deque()
+        self.lock = threading.Lock()
+
+    def detect_moderation_labels(self, Image, MinConfidence=50, **kwargs):
+        self.api.count('DetectModerationLabels')
+        if self.tps_quota is not None:
+            with self.lock:
+                now = time.monotonic()
+                while len(self.window) > 0 and now - self.window[0] > 1:
+                    self.window.popleft()
+                if len(self.window) >= self.tps_quota:
+                    self.throttled += 1
+                    raise client_error('ThrottlingException', 'DetectModerationLabels', 'Rate exceeded')
+                self.window.append(now)
+        self.latency.wait()
+        if "Bytes" in Image:
+            image = Image["Bytes"]
+        else:
+            image = self.s3.get(Image["S3Object"]["Bucket"], Image["S3Object"]["Name"])
+        labels = []
+        if self.label_images:
+            # confidence falls with the red area below RED_FRACTION_LABEL, as for a downscaled frame in a contact sheet
+            fraction = red_fraction(image)
+            if fraction > 0:
+                confidence = 99.0 if fraction >= RED_FRACTION_LABEL else round(99.0 * fraction / RED_FRACTION_LABEL, 1)
+                labels.append({"Confidence": confidence, "Name": "Graphic Violence Or Gore", "ParentName": "Violence"})
+        return {"ModerationLabels": [l for l in labels if l["Confidence"] >= MinConfidence]}
+
+class FakeSNS:
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.api = ApiCounter()
+        self.messages = []
+
+    def publish(self, TopicArn, Message, **kwargs):
+        self.api.count('Publish')
+        if TopicArn is None:
+            raise client_error('InvalidParameter', 'Publish', 'TopicArn')
+        if len(Message.encode()) > SNS_MAX_MESSAGE_BYTES:
+            raise client_error('InvalidParameter', 'Publish', 'Message too long')
+        self.latency.wait()
+        self.messages.append(json.loads(Message))
+        return {"MessageId": str(len(self.messages))}
+
+class FakeLambda:
+    # Asynchronous invocations are queued, the pipeline runs them after the current one
+    def __init__(self):
+        self.api = ApiCounter()
+        self.invocations = deque()
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse', **kwargs):
+        self.api.count('Invoke')
+        self.invocations.append(json.loads(Payload))
+        return {"StatusCode": 202}
+
+class FakeContext:
+    # The Lambda context of one invocation, its remaining time counts down from timeout seconds
+    def __init__(self, timeout, function_arn='arn:aws:lambda:us-east-1:000000000000:function:benchmark'):
+        self.deadline = time.monotonic() + timeout
+        self.invoked_function_arn = function_arn
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.deadline - time.monotonic()) * 1000), 0)
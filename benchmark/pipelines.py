@@ -0,0 +1,135 @@
+import importlib.util
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmark import ROOT_DIR
+from benchmark.fakes import FakeContext
+
+HANDLER_FILES = {
+    'all-in-one': 'lambda/all-in-one/rek-video-image-sampling.py',
+    'plan-segments': 'lambda/plan-segments/rek-video-image-sampling-plan-segments.py',
+    'capture-frames': 'lambda/capture-frames/rek-video-image-sampling-capture-frames.py',
+    'merge-manifests': 'lambda/merge-manifests/rek-video-image-sampling-merge-manifests.py',
+    'moderate-image': 'lambda/moderate-image/rek-video-image-sampling-moderate-image.py',
+    'densify': 'lambda/densify/rek-video-image-sampling-densify.py',
+    'consolidation': 'lambda/consolidation/rek-video-image-sampling-consolidate.py',
+    'list-videos': 'lambda/list-videos/rek-video-image-sampling-list-videos.py',
+}
+PIPELINES = ['all-in-one', 'step-functions']
+MODERATE_BATCH_SIZE = 20 # StepFunctionsStack moderate_batch_size
+MAP_CONCURRENCY = 10 # MaxConcurrency of the "Iterate images" Map
+
+def load_handler(name, fakes, local_dir):
+    # Import a Lambda handler file and point its clients to the fakes
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(ROOT_DIR, HANDLER_FILES[name]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.get_client = lambda service_name, *args, **kwargs: fakes[service_name]
+    if hasattr(module, 'LOCAL_DIR'):
+        module.LOCAL_DIR = local_dir
+    return module
+
+class Invocations:
+    # Duration of each emulated Lambda invocation, per function
+    def __init__(self):
+        self.seconds = {}
+
+    def run(self, name, handler, event, context=None):
+        start = time.perf_counter()
+        try:
+            return handler.lambda_handler(event, context)
+        finally:
+            self.seconds.setdefault(name, []).append(time.perf_counter() - start)
+
+def run_all_in_one(event, fakes, local_dir, timeout=None):
+    # timeout: seconds per invocation, past it the handler continues in a new invocation
+    invocations = Invocations()
+    handler = load_handler('all-in-one', fakes, local_dir)
+    while True:
+        response = invocations.run('all-in-one', handler, event, None if timeout is None else FakeContext(timeout))
+        if response["statusCode"] != 202:
+            return response["body"], invocations
+        if len(fakes['lambda'].invocations) > 0:
+            # the handler invoked itself
+            event = fakes['lambda'].invocations.popleft()
+        else:
+            # continuation_mode return: the caller passes the token back
+            event = {**event, "continuation": response["body"]["Continuation"]}
+
+def run_step_functions(event, fakes, local_dir, batch_size=MODERATE_BATCH_SIZE, map_concurrency=MAP_CONCURRENCY):
+    # The state machine, state by state. Capture-frames segments run one after the other:
+    # they share local_dir, while each Lambda has its own /tmp.
+    invocations = Invocations()
+    handlers = {name: load_handler(name, fakes, local_dir) for name in HANDLER_FILES if name != 'all-in-one'}
+    # the MODERATE_CONCURRENCY environment variable of the deployed plan-segments Lambda
+    handlers['plan-segments'].MODERATE_CONCURRENCY = map_concurrency
+    s3 = fakes['s3']
+
+    plan = invocations.run('plan-segments', handlers['plan-segments'], dict(event))
+    if plan["cache_hit"]:
+        # Choice: the cached result goes straight to consolidation
+        response = invocations.run('consolidation', handlers['consolidation'], {"Payload": plan})
+        return response["body"], invocations
+    segments = []
+    for segment in plan["segments"]:
+        output = invocations.run('capture-frames', handlers['capture-frames'], segment)
+        segments.append({"s3_manifest_key": output["s3_manifest_key"], "extraction": output["extraction"]})
+
+    state = {"Payload": plan, "Segments": segments}
+    merged = invocations.run('merge-manifests', handlers['merge-manifests'], state)
+    state["Frames"] = merged
+    bucket = plan["s3_target_bucket"]
+    items = json.loads(s3.get(bucket, merged["s3_manifest_key"]))
+
+    # Distributed Map: ItemBatcher batches, MaxConcurrency child executions at once
+    batch_input = {key: plan[key] for key in ["min_confidence", "reject_labels", "reject_min_confidence", "progress", "borderline_confidence", "prescreen_grid", "prescreen_confidence"]}
+    batch_input["s3_bucket"] = bucket
+    batch_input["rekognition_tps"] = plan["batch_rekognition_tps"]
+    batches = [{"Items": items[i:i + batch_size], "BatchInput": batch_input} for i in range(0, len(items), batch_size)]
+    # ToleratedFailurePercentage 0: the first failed child execution stops the Map Run
+    map_failed = threading.Event()
+
+    def run_child(batch):
+        if map_failed.is_set():
+            return None
+        try:
+            return {"Output": json.dumps(invocations.run('moderate-image', handlers['moderate-image'], batch))}
+        except Exception as ex:
+            map_failed.set()
+            return {"Error": type(ex).__name__, "Cause": json.dumps({"errorMessage": str(ex), "errorType": type(ex).__name__})}
+
+    with ThreadPoolExecutor(max_workers=map_concurrency) as executor:
+        executions = [e for e in executor.map(run_child, batches) if e is not None]
+
+    # ResultWriter: the child execution results and a manifest in the temp folder, also when the Map Run fails
+    prefix = f'{plan["s3_target_temp_folder"]}/benchmark-map-run'
+    result_files = {}
+    for status, selected in [("SUCCEEDED", [e for e in executions if "Output" in e]), ("FAILED", [e for e in executions if "Error" in e])]:
+        result_files[status] = []
+        if len(selected) > 0:
+            s3.put_object(Body=json.dumps(selected), Bucket=bucket, Key=f'{prefix}/{status}_0.json')
+            result_files[status].append({"Key": f'{prefix}/{status}_0.json'})
+    manifest = {"DestinationBucket": bucket, "ResultFiles": result_files}
+    s3.put_object(Body=json.dumps(manifest), Bucket=bucket, Key=f'{prefix}/manifest.json')
+    if map_failed.is_set():
+        # the Map Catch
+        state["MapError"] = {"Error": "States.ExceedToleratedFailureThreshold", "Cause": "The specified tolerated failure threshold was exceeded"}
+    else:
+        state["MapRun"] = {"ResultWriterDetails": {"Bucket": bucket, "Key": f'{prefix}/manifest.json'}}
+        # Choice: adaptive sampling
+        if plan["dense_sample_frequency"] is not None:
+            state["Dense"] = invocations.run('densify', handlers['densify'], state)
+
+    response = invocations.run('consolidation', handlers['consolidation'], state)
+    return response["body"], invocations
+
+def critical_path_seconds(pipeline, invocations, map_concurrency=MAP_CONCURRENCY):
+    # Wall time on AWS: parallel segments wait for the slowest, the Map runs map_concurrency batches at once
+    seconds = invocations.seconds
+    if pipeline == 'all-in-one':
+        return sum(seconds['all-in-one'])
+    moderation = sum(seconds.get('moderate-image', [])) / map_concurrency
+    return (sum(seconds['plan-segments']) + max(seconds.get('capture-frames', [0])) + sum(seconds.get('merge-manifests', []))
+        + moderation + sum(seconds.get('densify', [])) + sum(seconds['consolidation']))
@@ -0,0 +1,104 @@
+import argparse
+import json
+import math
+from benchmark.pipelines import MAP_CONCURRENCY, MODERATE_BATCH_SIZE, PIPELINES
+from benchmark.run import run_cases
+from benchmark.videos import FRAME_RATE, VIDEO_DIR, flagged_windows, generate_video
+
+DEFAULT_GRIDS = '2,3,4'
+
+def flagged_timestamps(labels):
+    return set(l["Timestamp"] for l in labels or [])
+
+def window_recall(labels, windows):
+    # share of the red box windows with at least one flagged frame
+    if len(windows) == 0:
+        return None
+    timestamps = flagged_timestamps(labels)
+    found = [any(start * 1000 <= t <= end * 1000 for t in timestamps) for start, end in windows]
+    return round(sum(found) / len(windows), 3)
+
+def compare(baseline, report):
+    # Rekognition calls saved by the prescreen and the flagged frames it still finds
+    calls = sum(baseline["api_calls"]["rekognition"].values())
+    prescreen_calls = sum(report["api_calls"]["rekognition"].values())
+    expected = flagged_timestamps(baseline["labels"])
+    found = flagged_timestamps(report["labels"])
+    return {
+        "pipeline": report["pipeline"],
+        "grid": report["grid"],
+        "rekognition_calls": prescreen_calls,
+        "baseline_calls": calls,
+        "calls_saved": round(1 - prescreen_calls / calls, 3) if calls > 0 else None,
+        "frame_recall": round(len(expected & found) / len(expected), 3) if len(expected) > 0 else None,
+        "window_recall": window_recall(report["labels"], report["flagged_windows"]),
+        "baseline_window_recall": window_recall(baseline["labels"], baseline["flagged_windows"])
+    }
+
+def print_report(comparisons):
+    print(f'{"pipeline":<15}{"grid":>5}{"rek calls":>11}{"baseline":>10}{"saved":>8}{"frame recall":>14}{"window recall":>15}')
+    for c in comparisons:
+        if "error" in c:
+            print(f'{c["pipeline"]:<15}{c["grid"]:>5}  failed: {c["error"]}')
+            continue
+        print(f'{c["pipeline"]:<15}{c["grid"]:>5}{c["rekognition_calls"]:>11}{c["baseline_calls"]:>10}{str(c["calls_saved"]):>8}'
+            f'{str(c["frame_recall"]):>14}{str(c["window_recall"]):>15}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Rekognition calls and the recall of the contact sheet prescreen with moderating every frame.')
+    parser.add_argument('--pipeline', choices=PIPELINES + ['all'], default='all-in-one')
+    parser.add_argument('--grids', default=DEFAULT_GRIDS, help='prescreen_grid values, comma separated')
+    parser.add_argument('--duration', type=int, default=120, help='video length in seconds')
+    parser.add_argument('--resolution', default='1280x720', help='video size WIDTHxHEIGHT')
+    parser.add_argument('--frame-rate', type=int, default=FRAME_RATE)
+    parser.add_argument('--flagged-every', type=int, default=15, help='draw a red box, flagged by the fake Rekognition, every N seconds')
+    parser.add_argument('--event', default='{}', help='JSON merged into the handler event of every run, e.g. {"prescreen_confidence": 30}')
+    parser.add_argument('--rekognition-latency', type=float, default=0, help='seconds per Rekognition call')
+    parser.add_argument('--video-dir', default=VIDEO_DIR)
+    parser.add_argument('--json', help='write the comparisons to this file')
+    args = parser.parse_args()
+
+    video = generate_video(args.duration, args.resolution, flagged_every=args.flagged_every, frame_rate=args.frame_rate, video_dir=args.video_dir)
+    pipelines = PIPELINES if args.pipeline == 'all' else [args.pipeline]
+    cases = []
+    for pipeline in pipelines:
+        for grid in [None] + [int(g) for g in args.grids.split(',')]:
+            event = json.loads(args.event)
+            if grid is not None:
+                event["prescreen_grid"] = grid
+            cases.append({
+                "pipeline": pipeline,
+                "grid": grid,
+                "video": video,
+                "duration": args.duration,
+                "resolution": args.resolution,
+                "flagged_windows": flagged_windows(args.duration, args.flagged_every),
+                "event": event,
+                "s3_latency": 0,
+                "rekognition_latency": args.rekognition_latency,
+                "latency_jitter": 0,
+                "rekognition_quota": None,
+                "label_images": True,
+                "lambda_timeout": None,
+                # a moderate-image batch holds whole contact sheets
+                "batch_size": MODERATE_BATCH_SIZE if grid is None else math.ceil(MODERATE_BATCH_SIZE / grid ** 2) * grid ** 2,
+                "map_concurrency": MAP_CONCURRENCY
+            })
+
+    reports = run_cases(cases)
+    comparisons = []
+    for case, report in zip(cases, reports):
+        report["grid"] = case["grid"]
+        if case["grid"] is None:
+            baseline = report
+        elif "error" in report or "error" in baseline:
+            comparisons.append({"pipeline": case["pipeline"], "grid": case["grid"], "error": report.get("error", baseline.get("error"))})
+        else:
+            comparisons.append(compare(baseline, report))
+    print_report(comparisons)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(comparisons, f, indent=2)
+
+if __name__ == '__main__':
+    main()
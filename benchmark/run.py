@@ -0,0 +1,220 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from benchmark.fakes import FakeLambda, FakeRekognition, FakeS3, FakeSNS, Latency
+from benchmark.pipelines import MAP_CONCURRENCY, MODERATE_BATCH_SIZE, PIPELINES, critical_path_seconds, run_all_in_one, run_step_functions
+from benchmark.videos import FRAME_RATE, VIDEO_DIR, flagged_windows, generate_video
+
+DEFAULT_DURATIONS = '30,120'
+DEFAULT_RESOLUTIONS = '640x360,1920x1080'
+SOURCE_BUCKET = 'benchmark-bucket'
+SAMPLE_INTERVAL = 0.02 # seconds between two /tmp size and ffmpeg memory samples
+
+def children_rss():
+    # resident memory of the child processes (ffmpeg), from /proc: ru_maxrss of the
+    # children also counts the memory they shared with this process before exec
+    pid = str(os.getpid())
+    total = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        if status.get('PPid', '').strip() == pid and 'VmRSS' in status:
+            total += int(status['VmRSS'].split()[0]) * 1024
+    return total
+
+class ResourceMonitor(threading.Thread):
+    # High-water marks of the bytes stored under a directory (the Lambda /tmp usage)
+    # and of the memory used by the ffmpeg processes
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.peak_disk = 0
+        self.peak_children_rss = 0
+        self.stopped = threading.Event()
+
+    def disk_usage(self):
+        total = 0
+        for root, dirs, files in os.walk(self.path):
+            for f in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+        return total
+
+    def sample(self):
+        self.peak_disk = max(self.peak_disk, self.disk_usage())
+        self.peak_children_rss = max(self.peak_children_rss, children_rss())
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            time.sleep(SAMPLE_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+def run_case(case, results):
+    # One video through one pipeline, in its own process so peak RSS is per case
+    work_dir = tempfile.mkdtemp(prefix='rek-video-sampling-case-')
+    local_dir = os.path.join(work_dir, 'tmp')
+    presigned_dir = os.path.join(work_dir, 'presigned')
+    os.makedirs(local_dir)
+    os.makedirs(presigned_dir)
+    try:
+        s3_latency = Latency(case["s3_latency"], case["latency_jitter"])
+        s3 = FakeS3(presigned_dir, latency=s3_latency)
+        rekognition = FakeRekognition(s3, latency=Latency(case["rekognition_latency"], case["latency_jitter"]),
+            tps_quota=case["rekognition_quota"], label_images=case["label_images"])
+        sns = FakeSNS(latency=s3_latency)
+        fakes = {"s3": s3, "rekognition": rekognition, "sns": sns, "lambda": FakeLambda()}
+        s3_key = f'videos/{os.path.basename(case["video"])}'
+        s3.add_file(SOURCE_BUCKET, s3_key, case["video"])
+        event = {"s3_source_bucket": SOURCE_BUCKET, "s3_source_key": s3_key, "sns_topic_arn": "arn:aws:sns:us-east-1:000000000000:benchmark"}
+        event.update(case["event"])
+
+        monitor = ResourceMonitor(local_dir)
+        monitor.start()
+        start = time.perf_counter()
+        if case["pipeline"] == 'all-in-one':
+            result, invocations = run_all_in_one(event, fakes, local_dir, timeout=case["lambda_timeout"])
+        else:
+            result, invocations = run_step_functions(event, fakes, local_dir,
+                batch_size=case["batch_size"], map_concurrency=case["map_concurrency"])
+        wall_seconds = time.perf_counter() - start
+        monitor.stop()
+
+        video_minutes = case["duration"] / 60
+        moderated = rekognition.api.total() - rekognition.throttled
+        results.put({
+            "pipeline": case["pipeline"],
+            "duration": case["duration"],
+            "resolution": case["resolution"],
+            "wall_seconds": round(wall_seconds, 3),
+            "critical_path_seconds": round(critical_path_seconds(case["pipeline"], invocations, case["map_concurrency"]), 3),
+            "lambda_seconds": round(sum(sum(s) for s in invocations.seconds.values()), 3),
+            "frames_moderated": moderated,
+            "frames_per_second": round(moderated / wall_seconds, 2) if wall_seconds > 0 else None,
+            # ru_maxrss is in KB on Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_ffmpeg_rss_mb": round(monitor.peak_children_rss / 1024 / 1024, 1),
+            "tmp_high_water_mb": round(monitor.peak_disk / 1024 / 1024, 2),
+            "api_calls_per_video_minute": {
+                "s3": round(s3.api.total() / video_minutes, 1),
+                "rekognition": round(rekognition.api.total() / video_minutes, 1),
+                "sns": round(sns.api.total() / video_minutes, 2)
+            },
+            "api_calls": {
+                "s3": dict(s3.api.calls),
+                "rekognition": dict(rekognition.api.calls),
+                "sns": dict(sns.api.calls)
+            },
+            "throttled": rekognition.throttled,
+            "bytes_uploaded": s3.bytes_in,
+            "bytes_downloaded": s3.bytes_out,
+            "flagged_windows": case["flagged_windows"],
+            "labels": result.get("ModerationLabels", result.get("ModerationSegments")),
+        })
+    except Exception as ex:
+        results.put({"pipeline": case["pipeline"], "duration": case["duration"], "resolution": case["resolution"], "error": repr(ex)})
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_cases(cases):
+    context = multiprocessing.get_context('spawn')
+    reports = []
+    for case in cases:
+        results = context.Queue()
+        process = context.Process(target=run_case, args=(case, results))
+        process.start()
+        while True:
+            try:
+                reports.append(results.get(timeout=1))
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    reports.append({"pipeline": case["pipeline"], "duration": case["duration"], "resolution": case["resolution"],
+                        "error": f'exit code {process.exitcode}'})
+                    break
+        process.join()
+    return reports
+
+def print_report(reports):
+    header = f'{"pipeline":<15}{"video":>16}{"wall s":>9}{"path s":>9}{"frames":>8}{"fps":>8}{"rss MB":>9}{"ffmpeg MB":>11}{"/tmp MB":>9}{"s3/min":>9}{"rek/min":>9}{"throttled":>11}'
+    print(header)
+    for r in reports:
+        video = f'{r["duration"]}s {r["resolution"]}'
+        if "error" in r:
+            print(f'{r["pipeline"]:<15}{video:>16}  failed: {r["error"]}')
+            continue
+        calls = r["api_calls_per_video_minute"]
+        print(f'{r["pipeline"]:<15}{video:>16}{r["wall_seconds"]:>9}{r["critical_path_seconds"]:>9}{r["frames_moderated"]:>8}'
+            f'{r["frames_per_second"]:>8}{r["peak_rss_mb"]:>9}{r["peak_ffmpeg_rss_mb"]:>11}{r["tmp_high_water_mb"]:>9}'
+            f'{calls["s3"]:>9}{calls["rekognition"]:>9}{r["throttled"]:>11}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Lambda handlers locally against fake S3, Rekognition and SNS, on synthetic videos.')
+    parser.add_argument('--pipeline', choices=PIPELINES + ['all'], default='all-in-one')
+    parser.add_argument('--durations', default=DEFAULT_DURATIONS, help='video lengths in seconds, comma separated')
+    parser.add_argument('--resolutions', default=DEFAULT_RESOLUTIONS, help='video sizes WIDTHxHEIGHT, comma separated')
+    parser.add_argument('--frame-rate', type=int, default=FRAME_RATE)
+    parser.add_argument('--flagged-every', type=int, default=0, help='draw a red box, flagged by the fake Rekognition with --label-images, every N seconds')
+    parser.add_argument('--event', default='{}', help='JSON merged into the handler event, e.g. {"sample_frequency": 1}')
+    parser.add_argument('--s3-latency', type=float, default=0.01, help='seconds per S3 and SNS call')
+    parser.add_argument('--rekognition-latency', type=float, default=0.1, help='seconds per Rekognition call')
+    parser.add_argument('--latency-jitter', type=float, default=0, help='random extra seconds per call')
+    parser.add_argument('--rekognition-quota', type=int, default=None, help='Rekognition TPS above which calls are throttled')
+    parser.add_argument('--label-images', action='store_true', help='flag images with red boxes (one extra ffmpeg run per Rekognition call)')
+    parser.add_argument('--lambda-timeout', type=float, default=None, help='seconds per all-in-one invocation, it continues in new invocations past it (see time_margin)')
+    parser.add_argument('--batch-size', type=int, default=MODERATE_BATCH_SIZE)
+    parser.add_argument('--map-concurrency', type=int, default=MAP_CONCURRENCY)
+    parser.add_argument('--video-dir', default=VIDEO_DIR)
+    parser.add_argument('--json', help='write the full report to this file')
+    args = parser.parse_args()
+
+    pipelines = PIPELINES if args.pipeline == 'all' else [args.pipeline]
+    cases = []
+    for duration in [int(d) for d in args.durations.split(',')]:
+        for resolution in args.resolutions.split(','):
+            video = generate_video(duration, resolution, flagged_every=args.flagged_every, frame_rate=args.frame_rate, video_dir=args.video_dir)
+            for pipeline in pipelines:
+                cases.append({
+                    "pipeline": pipeline,
+                    "video": video,
+                    "duration": duration,
+                    "resolution": resolution,
+                    "flagged_windows": flagged_windows(duration, args.flagged_every),
+                    "event": json.loads(args.event),
+                    "s3_latency": args.s3_latency,
+                    "rekognition_latency": args.rekognition_latency,
+                    "latency_jitter": args.latency_jitter,
+                    "rekognition_quota": args.rekognition_quota,
+                    "label_images": args.label_images,
+                    "lambda_timeout": args.lambda_timeout,
+                    "batch_size": args.batch_size,
+                    "map_concurrency": args.map_concurrency
+                })
+
+    reports = run_cases(cases)
+    print_report(reports)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import tempfile
+from sampling_core.frames import FFMPEG_PATH
+
+VIDEO_DIR = os.path.join(tempfile.gettempdir(), 'rek-video-sampling-benchmark')
+FRAME_RATE = 30
+KEYFRAME_INTERVAL = 2 # seconds between two key frames
+FLAGGED_SECONDS = 2 # length of a red box window
+
+def flagged_windows(duration, flagged_every):
+    # (start, end) of the red boxes: one every flagged_every seconds, none when 0
+    if not flagged_every:
+        return []
+    return [(t, min(t + FLAGGED_SECONDS, duration)) for t in range(flagged_every // 2, int(duration), flagged_every)]
+
+def generate_video(duration, resolution, flagged_every=0, frame_rate=FRAME_RATE, video_dir=VIDEO_DIR):
+    # Grayscale test pattern (no red), with red boxes during the flagged windows.
+    # H.264 MP4 with faststart, so it can also be streamed to ffmpeg stdin. Cached by parameters.
+    os.makedirs(video_dir, exist_ok=True)
+    path = os.path.join(video_dir, f'synthetic-{duration}s-{resolution}-{frame_rate}fps-flagged{flagged_every}.mp4')
+    if os.path.exists(path):
+        return path
+    filters = ['hue=s=0']
+    for start, end in flagged_windows(duration, flagged_every):
+        filters.append(f"drawbox=x=iw/4:y=ih/4:w=iw/2:h=ih/2:color=red:t=fill:enable='between(t,{start},{end})'")
+    cmd = [FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={resolution}:rate={frame_rate}:duration={duration}',
+        '-vf', ','.join(filters),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        '-g', str(frame_rate * KEYFRAME_INTERVAL),
+        '-movflags', '+faststart', path + '.part.mp4']
+    subprocess.run(cmd, check=True)
+    os.rename(path + '.part.mp4', path)
+    return path
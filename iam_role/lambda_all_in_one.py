@@ -29,10 +29,10 @@ def create_role(self, region, account_id):
     new_role.add_to_policy(
         policy.create_policy_sns(self, region, account_id)
     )
-    # Invoke step function, lambda
+    # Invoke step function, lambda: the function invokes itself to continue a long video
     new_role.add_to_policy(
         _iam.PolicyStatement(
-            actions=["states:*", "lambda:GetFunctionConfiguration"],
+            actions=["states:*", "lambda:GetFunctionConfiguration", "lambda:InvokeFunction"],
             resources=["*"]
         )
     )
@@ -0,0 +1,22 @@
+from aws_cdk import (
+    Stack,
+    aws_iam as _iam,
+)
+from constructs import Construct
+from iam_role import policy
+
+
+def create_role(self, region, account_id):
+    # IAM role
+    new_role = _iam.Role(self, "lambda-merge-manifests",
+        assumed_by=_iam.ServicePrincipal("lambda.amazonaws.com"),
+    )
+    new_role.add_to_policy(
+        # S3 read access
+        policy.create_policy_s3(self, region, account_id)
+    )
+    new_role.add_to_policy(
+        # CloudWatch log
+        policy.create_policy_lambda_log(self, region, account_id)
+    )
+    return new_role
\ No newline at end of file
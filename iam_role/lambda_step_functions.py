@@ -54,6 +54,13 @@ def create_role(self, region, account_id):
             resources=["*"]
         )
     )   
+    # Batch state machine: startExecution.sync waits for each video execution with an EventBridge rule
+    new_role.add_to_policy(
+        _iam.PolicyStatement(
+            actions=["events:PutTargets", "events:PutRule", "events:DescribeRule"],
+            resources=[f"arn:aws:events:{region}:{account_id}:rule/StepFunctionsGetEventsForStepFunctionsExecutionRule"]
+        )
+    )
     # X-ray
     new_role.add_to_policy(
         # DynamoDB access
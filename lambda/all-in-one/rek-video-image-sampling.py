@@ -1,85 +1,388 @@
 import json
-import boto3
 import os
-import subprocess
+import shutil
+from contextlib import closing, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from sampling_core.adaptive import dense_frames, dense_windows
+from sampling_core.cache import cache_key, fingerprint, open_cache
+from sampling_core.clients import get_client
+from sampling_core.concurrency import bounded_map
+from sampling_core.continuation import CONTINUATION_MODES, DEFAULT_TIME_MARGIN, Deadline, checkpoint_key, load_checkpoint, save_checkpoint, skip_moderated
+from sampling_core.frames import image_extension, plan_extraction, probe_duration, stream_frames
+from sampling_core.metrics import Metrics
+from sampling_core.moderation import add_verdict, moderate_image, rejection
+from sampling_core.ordering import coarse_to_fine
+from sampling_core.output import format_result, offload, result_key
+from sampling_core.prescreen import groups, make_mosaic, screen_confidence
+from sampling_core.params import InvalidParameter, bad_request, batch_video, choice, get_or_default, parse_video_options
+from sampling_core.progress import Progress, expected_frames, partial_result, progress_key
+from sampling_core.ratelimit import LIMITED_CLIENT_RETRIES, RateLimiter
+from sampling_core.sources import VideoSource, list_videos
 
-IMAGE_NAME_EXTENSION = '.png'
 LOCAL_DIR = '/tmp'
 SAMPLE_FREQUENCY = 2 # 2 image every 1 seconds
+MAX_WORKERS = 32 # frames uploaded and moderated at the same time
+REKOGNITION_TPS = 50 # DetectModerationLabels calls per second, lower it when several videos are moderated at once
 API_NAME = 'cm_video_moderation_image_sampling'
-
-s3 = boto3.client('s3')
-rekognition = boto3.client('rekognition')
-sns = boto3.client('sns')
+VIDEO_CONCURRENCY = 4 # videos moderated at the same time in batch mode, each decoded by its own ffmpeg process
+# batch mode parameters, not passed on to each video
+BATCH_PARAMETERS = ["s3_source_keys", "s3_source_prefix", "video_concurrency", "continuation"]
 
 def lambda_handler(event, context):
+    # Batch mode: a list of keys or a prefix of the source bucket
+    if event is not None and ("s3_source_keys" in event or "s3_source_prefix" in event):
+        return moderate_videos(event, context)
+    return moderate_video(event, context)
+
+def moderate_video(event, context, executor=None, limiter=None, local_dir=None):
+    # One video. In batch mode, the videos share the moderation executor and the rate limiter
+    metrics = Metrics('all-in-one')
     # -- Validate input parameters start -- 
-    if event is None or "s3_source_bucket" not in event or "s3_source_key" not in event:
-        return {
-            'statusCode': 400,
-            'body': 'Require parameters: s3_source_bucket and s3_source_key.'
-        }
-        
-    s3_source_bucket = event["s3_source_bucket"]
-    s3_source_key = event["s3_source_key"]
-    sample_frequency = event.get("sample_frequency")
-    if sample_frequency is None:
-        sample_frequency = SAMPLE_FREQUENCY
-
-    file_name = s3_source_key.split('/')[-1]
-    local_file_path = f'{LOCAL_DIR}/{file_name}'
-
-    s3_target_folder = event.get("s3_target_folder")
-    if s3_target_folder is None:
-        s3_target_folder = s3_source_key.replace(file_name, '')
-    if s3_target_folder.endswith('/'):
-        s3_target_folder = s3_target_folder[0:len(s3_target_folder)-1]
-
-    s3_target_bucket = event.get("s3_target_bucket")
-    if s3_target_bucket is None:
-        s3_target_bucket = s3_source_bucket
-    
-    min_confidence = event.get("min_confidence")
-    sns_topic_arn = event.get("sns_topic_arn")
-    
-    job_id = event.get("job_id")
-    if job_id is None or len(job_id) == 0:
-        job_id = f'{s3_source_bucket}_{s3_source_key}'.replace('/','_').replace('.','_')
+    try:
+        options = parse_video_options(event, SAMPLE_FREQUENCY)
+        # near the timeout, the function invokes itself with a continuation token or returns it
+        continuation_mode = choice(event, "continuation_mode", CONTINUATION_MODES, "invoke", "modes")
+        if options["progress_checkpoints"] and options["sampling_mode"] == 'scene' and options["frame_order"] == 'timeline':
+            # the frames are moderated while ffmpeg decodes, the number of scene changes is only known at the end
+            raise InvalidParameter('progress_checkpoints require the fixed sampling_mode or the coarse_to_fine frame_order.')
+    except InvalidParameter as ex:
+        return bad_request(ex)
+    s3_source_bucket = options["s3_source_bucket"]
+    s3_source_key = options["s3_source_key"]
+    s3_target_bucket = options["s3_target_bucket"]
+    s3_target_folder = options["s3_target_folder"]
+    profile = options["profile"]
+    min_confidence = options["min_confidence"]
+    dedup_max_distance = options["dedup_max_distance"]
+    sns_topic_arn = options["sns_topic_arn"]
+    reject_labels = options["reject_labels"]
+    max_workers = get_or_default(event, "max_workers", MAX_WORKERS)
+    rekognition_tps = get_or_default(event, "rekognition_tps", REKOGNITION_TPS)
+    # keep every sampled frame in S3, not only the flagged ones
+    archive_frames = event.get("archive_frames", False)
+    # seconds kept before the Lambda timeout to save a checkpoint, token of the previous invocation
+    time_margin = get_or_default(event, "time_margin", DEFAULT_TIME_MARGIN)
+    continuation = event.get("continuation")
     # -- Validation end --
     
-    # Download video to local disk
-    s3.download_file(s3_source_bucket, s3_source_key, local_file_path)
-    
-    # Sample images based on given interval and store images to local disk
-    ffmpeg_cmd = f"/opt/bin/ffmpeg -i {local_file_path} -r {sample_frequency} {LOCAL_DIR}/%07d{IMAGE_NAME_EXTENSION}"
-    cmd = ffmpeg_cmd.split(' ')
-    p1 = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # one pooled connection per worker thread, throttled calls are retried by the rate limiter
+    s3 = get_client('s3', max_workers)
+    rekognition = get_client('rekognition', max_workers, retries=LIMITED_CLIENT_RETRIES)
+    # all the moderation calls share the TPS budget
+    shared_limiter = limiter is not None
+    if not shared_limiter:
+        limiter = RateLimiter(rekognition_tps)
+    if local_dir is None:
+        local_dir = LOCAL_DIR
+
+    def respond(result):
+        result = format_result(result, options["output_format"], options["segment_gap"])
+        # send result to SNS topic, through S3 when it is over the SNS message limit
+        try:
+            if sns_topic_arn is not None:
+                with metrics.timer("Publish"):
+                    message = offload(result, s3, s3_target_bucket, result_key(options["s3_target_folder"], options["job_id"]))
+                    if message is not result:
+                        print("Result written to S3:", message["ResultLocation"])
+                        metrics.count("ResultsOffloaded")
+                    result = message
+                    sns_response = get_client('sns').publish(
+                        TopicArn=sns_topic_arn,
+                        Message=json.dumps(result)
+                    )
+        except Exception as ex:
+            print("Failed to send message to the SNS topic:", ex)
+
+        metrics.emit()
+        if options["metrics_summary"]:
+            result["Metrics"] = metrics.summary()
+
+        return {
+            'statusCode': 200,
+            'body': result
+        }
+
+    # Result cache: the same video content was already moderated with the same options
+    cache = None
+    try:
+        cache = open_cache(options["result_cache"], s3)
+        if cache is not None:
+            with metrics.timer("Cache"):
+                key = cache_key(fingerprint(s3, s3_source_bucket, s3_source_key), options)
+                # a continued invocation already missed
+                cached = cache.get(key) if continuation is None else None
+            if cached is not None:
+                print("Result cache hit:", key)
+                metrics.count("CacheHits")
+                return respond({
+                    "JobId": options["job_id"],
+                    "API": API_NAME,
+                    "Video": {
+                        "S3Bucket": s3_source_bucket,
+                        "S3ObjectName": s3_source_key
+                    },
+                    **cached,
+                    "Cache": "HIT"
+                })
+            if continuation is None:
+                metrics.count("CacheMisses")
+    except Exception as ex:
+        print("Failed to read the result cache:", ex)
+        cache = None
+
+    # Download video to local disk, or get ready to stream it to ffmpeg
+    with metrics.timer("Download"):
+        source = VideoSource(s3, s3_source_bucket, s3_source_key, input_mode=options["input_mode"], local_dir=local_dir)
     
     # Target folder: using the video file name as a sub folder
-    s3_target_folder += "/" + file_name.lower()
+    s3_target_folder += "/" + options["file_name"].lower()
+
+    def process_frame(frame):
+        # moderate image: the encoding profile keeps images under the Rekognition size limit for bytes
+        with metrics.timer("Moderation"):
+            mr = moderate_image(rekognition, {'Bytes': frame.data}, frame.timestamp, min_confidence=min_confidence, limiter=limiter,
+                borderline_confidence=options["borderline_confidence"])
+        metrics.count("RekognitionCalls")
+
+        # Archive flagged images to s3, or all images if archive_frames is set
+        if archive_frames or len(mr["ModerationLabel"]) > 0:
+            upload_frame(frame)
+        return mr
+
+    def upload_frame(frame):
+        s3_key = f'{s3_target_folder}/{frame.timestamp}{image_extension(profile)}'
+        with metrics.timer("Upload"):
+            s3.put_object(Body=frame.data, Bucket=s3_target_bucket, Key=s3_key)
+        metrics.count("S3PutCalls")
+        metrics.add("BytesUploaded", len(frame.data), 'Bytes')
 
-    # Upload images to s3 and cleanup temp files on local disk
+    def process_group(frames):
+        # Contact sheet prescreen: one call for the mosaic of the frames, the frames are only
+        # moderated one by one when the mosaic has a label near the threshold
+        if len(frames) == 1:
+            return [process_frame(frames[0])]
+        with metrics.timer("Prescreen"):
+            mosaic = make_mosaic([frame.data for frame in frames], options["prescreen_grid"])
+            sheet = moderate_image(rekognition, {'Bytes': mosaic}, frames[0].timestamp, min_confidence=prescreen_confidence, limiter=limiter)
+        metrics.count("RekognitionCalls")
+        metrics.count("Mosaics")
+        if len(sheet["ModerationLabel"]) > 0:
+            metrics.count("MosaicsFlagged")
+            return [process_frame(frame) for frame in frames]
+        metrics.count("FramesPrescreened", len(frames))
+        if archive_frames:
+            for frame in frames:
+                upload_frame(frame)
+        return [{"Timestamp": frame.timestamp, "ModerationLabel": []} for frame in frames]
+
+    def publish_progress(labels, checkpoint):
+        # Partial results: the labels of the frames moderated so far, to the SNS topic or to S3
+        if deduplicator is not None:
+            labels = deduplicator.reuse_labels(labels)
+        message = partial_result(format_result({
+                "JobId": options["job_id"],
+                "API": API_NAME,
+                "Video": {
+                    "S3Bucket": s3_source_bucket,
+                    "S3ObjectName": s3_source_key
+                },
+                "ModerationLabels": sorted(labels, key=lambda x: x["Timestamp"])
+            }, options["output_format"], options["segment_gap"]), checkpoint)
+        try:
+            with metrics.timer("Progress"):
+                if sns_topic_arn is not None:
+                    get_client('sns').publish(TopicArn=sns_topic_arn, Message=json.dumps(message))
+                else:
+                    s3.put_object(Body=json.dumps(message), Bucket=s3_target_bucket, Key=progress_key(s3_target_folder, checkpoint))
+            print(f"Progress {checkpoint}: {progress.moderated} frames moderated")
+        except Exception as ex:
+            print("Failed to publish the partial results:", ex)
+
+    def moderate_frames(executor, frames, counter="Frames", prescreen=False):
+        # Moderates the frames while ffmpeg is still decoding, returns the rejection when one is found
+        if prescreen:
+            # grid x grid consecutive frames per contact sheet
+            items = groups(frames, options["prescreen_grid"] ** 2)
+            moderate = process_group
+        else:
+            items = frames
+            moderate = lambda frame: [process_frame(frame)]
+        with closing(frames), closing(bounded_map(executor, moderate, items, max_workers * 2)) as results:
+            for group in results:
+                for mr in group:
+                    metrics.count(counter)
+                    moderated_timestamps.append(mr["Timestamp"])
+                    checkpoint = progress.frame_moderated()
+                    if checkpoint is not None:
+                        publish_progress(labels, checkpoint)
+                    if mr.get("Borderline"):
+                        borderline.append(mr)
+                    if len(mr["ModerationLabel"]) > 0:
+                        labels.append(mr)
+                        rejected = rejection(mr, reject_labels, options["reject_min_confidence"])
+                        if rejected is not None:
+                            # reject fast: closing the results cancels the queued frames, closing the frames stops ffmpeg
+                            print("Video rejected:", rejected)
+                            metrics.count("Rejected")
+                            return rejected
+        return None
+
+    # Sample images based on given interval: ffmpeg streams the frames while it is still decoding,
+    # and up to max_workers frames are uploaded and moderated at the same time
     labels = []
-    for file in os.listdir(LOCAL_DIR):
-        if file.endswith(IMAGE_NAME_EXTENSION):
-            # convert file name from sequence to time position
-            seq = float(file.replace(IMAGE_NAME_EXTENSION,''))
-            ms_pos = 1/sample_frequency * (seq-1) * 1000
-            s3.upload_file(f'{LOCAL_DIR}/{file}', s3_target_bucket, f'{s3_target_folder}/{ms_pos}.png')
-            
-            # moderate image
-            mr = moderate_image(s3_target_bucket, f'{s3_target_folder}/{ms_pos}.png', min_confidence=min_confidence)
-            if mr is not None and len(mr["ModerationLabel"]) > 0:
-                labels.append(mr)
-            
-        # Delete local file: image or video
-        os.remove(f'{LOCAL_DIR}/{file}')
+    # frames with labels just under min_confidence and the timestamps moderated, for adaptive sampling
+    borderline = []
+    moderated_timestamps = []
+    rejected = None
+    # confidence of the contact sheet labels that sends its frames to individual moderation
+    prescreen_confidence = screen_confidence(min_confidence, options["prescreen_confidence"], options["borderline_confidence"])
+    progress = Progress(options["progress_checkpoints"])
+    deduplicator = None
+    thumbnail_size = None
+    if dedup_max_distance is not None:
+        # numpy is only imported when deduplication is used
+        from sampling_core import dedup
+        deduplicator = dedup.FrameDeduplicator(dedup_max_distance)
+        thumbnail_size = dedup.THUMBNAIL_SIZE
+    deadline = Deadline(context, time_margin)
+    # sparse: the sampling pass, dense: the dense pass of adaptive sampling
+    phase = 'sparse'
+    windows = None
+    continuations = 0
+    if continuation is not None:
+        # Resume from the checkpoint of the previous invocation
+        checkpoint = load_checkpoint(s3, continuation)
+        phase = checkpoint["phase"]
+        windows = checkpoint["windows"]
+        labels = checkpoint["labels"]
+        borderline = checkpoint["borderline"]
+        moderated_timestamps = checkpoint["moderated_timestamps"]
+        progress.restore(checkpoint["progress"])
+        if deduplicator is not None:
+            deduplicator.restore(checkpoint["deduplication"])
+        continuations = checkpoint["continuations"]
+        print(f"Continuation {continuations}: {len(moderated_timestamps)} frames moderated, {phase} pass")
+    moderated_before = len(moderated_timestamps)
+    try:
+        with metrics.timer("Plan"):
+            extraction = plan_extraction(source.input, options["sample_frequency"],
+                sampling_mode=options["sampling_mode"],
+                scene_threshold=options["scene_threshold"],
+                max_sample_gap=options["max_sample_gap"],
+                extraction_strategy=options["extraction_strategy"],
+                input_feeder=source.input_feeder)
+            if len(progress.checkpoints) > 0 and options["frame_order"] == 'timeline' and phase == 'sparse':
+                # the frames are moderated while ffmpeg decodes: the checkpoints count from the
+                # number of frames expected from the duration until the total is known
+                duration = probe_duration(source.input, input_feeder=source.input_feeder)
+                if duration is not None:
+                    progress.expected = expected_frames(duration, options["sample_frequency"])
+        # frames moderated, or skipped as duplicates of moderated frames, by the previous invocations
+        done = moderated_timestamps + ([] if deduplicator is None else list(deduplicator.duplicates))
+        resume = None
+        if len(done) > 0 and options["frame_order"] == 'timeline':
+            # the frames come in time order: seek to the last frame done
+            resume = max(done)
+        with ThreadPoolExecutor(max_workers=max_workers) if executor is None else nullcontext(executor) as executor:
+            if phase == 'sparse':
+                frames = stream_frames(source.input, extraction["video_filter"],
+                    profile=profile,
+                    thumbnail_size=thumbnail_size,
+                    keyframes_only=extraction["strategy"] == "keyframe",
+                    input_feeder=source.input_feeder,
+                    start=None if resume is None else resume / 1000)
+                # wall time of decoding, uploads and moderation, which overlap
+                with metrics.timer("Extraction"), closing(frames):
+                    if len(done) > 0:
+                        # skip the frames done, in coarse to fine order the whole video is extracted again
+                        frames = skip_moderated(frames, done, after=resume, tolerance=0 if resume is None else 500 / options["sample_frequency"])
+                    if deduplicator is not None:
+                        frames = deduplicator.unique_frames(frames)
+                    frames = progress.count(frames)
+                    if options["frame_order"] == 'coarse_to_fine':
+                        # a sparse pass over the whole video first, the finer frames wait in /tmp
+                        frames = coarse_to_fine(frames, os.path.join(local_dir, 'frames'), options["coarse_levels"])
+                    rejected = moderate_frames(executor, deadline.frames(frames), prescreen=options["prescreen_grid"] is not None)
+                metrics.throughput("FramesPerSecond", "Frames", "Extraction")
+                if not deadline.reached:
+                    phase = 'dense'
+
+            # Adaptive sampling: a dense pass around the flagged and borderline frames, seeking to each window
+            if phase == 'dense' and rejected is None and options["dense_sample_frequency"] is not None:
+                if windows is None:
+                    # around the frames of the sparse pass, the labels of the dense pass do not widen them
+                    windows = dense_windows(labels + borderline, options["dense_window"])
+                print(f"Dense pass: {len(windows)} window(s), {round(sum(end - start for start, end in windows), 3)}s of video")
+                metrics.count("DenseWindows", len(windows))
+                with metrics.timer("Densify"):
+                    frames = dense_frames(source.input, windows, options["dense_sample_frequency"], moderated_timestamps,
+                        profile=profile,
+                        thumbnail_size=thumbnail_size,
+                        input_feeder=source.input_feeder)
+                    if deduplicator is not None:
+                        frames = deduplicator.unique_frames(frames)
+                    rejected = moderate_frames(executor, deadline.frames(frames), counter="DenseFrames")
+    finally:
+        # Delete local video file
+        source.close()
+
+    if deadline.reached and rejected is None:
+        # Near the timeout: save what is done so far and continue in a new invocation
+        if len(moderated_timestamps) == moderated_before:
+            raise Exception(f'No frame moderated before the time margin ({time_margin}s): raise the Lambda timeout or lower time_margin')
+        checkpoint = {
+            "phase": phase,
+            "windows": windows,
+            "labels": labels,
+            "borderline": borderline,
+            "moderated_timestamps": moderated_timestamps,
+            "progress": progress.state(),
+            "deduplication": None if deduplicator is None else deduplicator.state(moderated_timestamps),
+            "continuations": continuations + 1
+        }
+        with metrics.timer("Checkpoint"):
+            token = save_checkpoint(s3, s3_target_bucket, checkpoint_key(s3_target_folder), checkpoint)
+        print(f"Checkpoint: {len(moderated_timestamps)} frames moderated, {phase} pass, continuing")
+        metrics.count("Continuations")
+        metrics.emit()
+        if continuation_mode == 'invoke':
+            get_client('lambda').invoke(
+                FunctionName=context.invoked_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps({**event, "continuation": token})
+            )
+        return {
+            'statusCode': 202,
+            'body': {
+                "JobId": options["job_id"],
+                "API": API_NAME,
+                "Video": {
+                    "S3Bucket": s3_source_bucket,
+                    "S3ObjectName": s3_source_key
+                },
+                "Continuation": token
+            }
+        }
+    if continuation is not None:
+        try:
+            s3.delete_object(Bucket=s3_target_bucket, Key=continuation["s3_key"])
+        except Exception as ex:
+            print("Failed to delete the checkpoint:", ex)
     
+    if deduplicator is not None:
+        labels = deduplicator.reuse_labels(labels)
+        print("Frame deduplication:", deduplicator.stats())
+    if not shared_limiter:
+        # in batch mode, the batch reports the rate limiting of all the videos
+        print("Rekognition rate limiting:", limiter.stats())
+        metrics.count("Throttles", limiter.throttles)
+        metrics.add("ThrottleWaitSeconds", limiter.wait_seconds, 'Seconds')
+
     # sort labels
     labels.sort(key=lambda x: x["Timestamp"], reverse=False)
     
     result = {
-            "JobId": job_id,
+            "JobId": options["job_id"],
             "API": API_NAME,
             "Video": {
                 "S3Bucket": s3_source_bucket,
@@ -87,41 +390,136 @@ def lambda_handler(event, context):
             },
             "ModerationLabels": labels
         }
-        
-    # send result to SNS topic
+    add_verdict(result, reject_labels, rejected)
+    if deduplicator is not None:
+        result["Deduplication"] = deduplicator.stats()
+    if not shared_limiter:
+        result["RateLimiting"] = limiter.stats()
+    if continuations > 0:
+        result["Continuations"] = continuations
+
+    if cache is not None:
+        try:
+            cache.put(key, result, options["cache_ttl"])
+            result["Cache"] = "MISS"
+        except Exception as ex:
+            print("Failed to write the result cache:", ex)
+
+    return respond(result)
+
+def moderate_videos(event, context):
+    # Batch mode: the videos of s3_source_keys, or the videos under s3_source_prefix, moderated
+    # video_concurrency at a time. Each video is decoded by its own ffmpeg process, the frames of
+    # all the videos share the max_workers moderation threads and the rekognition_tps budget.
+    # One result per video, published to the SNS topic like a single video.
+    metrics = Metrics('all-in-one')
+    s3_source_bucket = event.get("s3_source_bucket")
+    s3_source_keys = event.get("s3_source_keys")
+    s3_source_prefix = event.get("s3_source_prefix")
+    if s3_source_bucket is None or (s3_source_keys is None) == (s3_source_prefix is None):
+        return bad_request('Require parameters: s3_source_bucket and one of s3_source_keys, s3_source_prefix.')
+    if s3_source_keys is not None and not isinstance(s3_source_keys, list):
+        return bad_request('s3_source_keys must be a list of keys.')
     try:
-        if sns_topic_arn is not None:
-            sns_response = sns.publish(
-                TopicArn=sns_topic_arn,
-                Message=json.dumps(result)
-            )
-    except Exception as ex:
-        print("Failed to send message to the SNS topic:", ex)
-        
-    return {
-        'statusCode': 200,
-        'body': result
-    }
+        continuation_mode = choice(event, "continuation_mode", CONTINUATION_MODES, "invoke", "modes")
+    except InvalidParameter as ex:
+        return bad_request(ex)
+    max_workers = get_or_default(event, "max_workers", MAX_WORKERS)
+    rekognition_tps = get_or_default(event, "rekognition_tps", REKOGNITION_TPS)
+    video_concurrency = get_or_default(event, "video_concurrency", VIDEO_CONCURRENCY)
+    # the videos left by the previous invocation: the rest of the keys, or the keys after s3_start_after
+    continuation = event.get("continuation") or {}
+    s3 = get_client('s3', max_workers)
 
-def moderate_image(s3_bucket, s3_key, min_confidence=50):
-    ts = s3_key.split('/')[-1].replace(IMAGE_NAME_EXTENSION,'')
-    detectModerationLabelsResponse = rekognition.detect_moderation_labels(
-           Image={
-               'S3Object': {
-                   'Bucket': s3_bucket,
-                   'Name': s3_key,
-               }
-           },
-           MinConfidence=min_confidence,
-    
-        )
-    result = {"Timestamp": float(ts), "ModerationLabel": []}
-    for l in detectModerationLabelsResponse["ModerationLabels"]:
-        result["ModerationLabel"].append(
-            {
-                "Confidence": l["Confidence"],
-                "Name": l["Name"],
-                "ParentName": l["ParentName"]
+    if s3_source_prefix is not None:
+        s3_source_keys = list_videos(s3, s3_source_bucket, s3_source_prefix, continuation.get("s3_start_after", ''))
+    else:
+        s3_source_keys = continuation.get("s3_source_keys", s3_source_keys)
+    print(f"Batch: {len(s3_source_keys)} video(s)")
+
+    deadline = Deadline(context, get_or_default(event, "time_margin", DEFAULT_TIME_MARGIN))
+    limiter = RateLimiter(rekognition_tps)
+
+    def run(index, s3_source_key):
+        if deadline.near():
+            # not started: left to the next invocation
+            return None
+        video_event = {k: v for k, v in event.items() if k not in BATCH_PARAMETERS}
+        # its own job id and, with s3_target_folder, its own sub folder
+        video_event.update(batch_video(event, s3_source_key))
+        # each video downloads to and spills frames in its own folder
+        local_dir = os.path.join(LOCAL_DIR, f'video-{index}')
+        os.makedirs(local_dir, exist_ok=True)
+        try:
+            return moderate_video(video_event, context, executor, limiter, local_dir)
+        except Exception as ex:
+            print(f"Failed to moderate {s3_source_key}:", ex)
+            metrics.count("VideosFailed")
+            failure = {
+                "JobId": video_event["job_id"],
+                "API": API_NAME,
+                "Video": {
+                    "S3Bucket": s3_source_bucket,
+                    "S3ObjectName": s3_source_key
+                },
+                "Error": str(ex)
             }
+            # the subscribers learn about the failed videos too
+            try:
+                if event.get("sns_topic_arn") is not None:
+                    get_client('sns').publish(
+                        TopicArn=event["sns_topic_arn"],
+                        Message=json.dumps(failure)
+                    )
+            except Exception as ex:
+                print("Failed to send message to the SNS topic:", ex)
+            return {
+                'statusCode': 500,
+                'body': failure
+            }
+        finally:
+            shutil.rmtree(local_dir, ignore_errors=True)
+
+    with metrics.timer("Batch"):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, ThreadPoolExecutor(max_workers=video_concurrency) as videos:
+            responses = list(videos.map(run, range(len(s3_source_keys)), s3_source_keys))
+    # the videos start in key order: the ones not started are the last ones
+    started = len([r for r in responses if r is not None])
+    results = responses[0:started]
+    print("Rekognition rate limiting:", limiter.stats())
+    metrics.count("Videos", started)
+    metrics.count("Throttles", limiter.throttles)
+    metrics.add("ThrottleWaitSeconds", limiter.wait_seconds, 'Seconds')
+    metrics.throughput("VideosPerSecond", "Videos", "Batch")
+    metrics.emit()
+
+    body = {
+        "API": API_NAME,
+        "Results": results,
+        "RateLimiting": limiter.stats()
+    }
+    if started == len(s3_source_keys):
+        return {
+            'statusCode': 200,
+            'body': body
+        }
+
+    # Near the timeout: continue with the videos not started
+    if started == 0:
+        raise Exception('No video started before the time margin: raise the Lambda timeout or lower time_margin')
+    if s3_source_prefix is not None:
+        token = {"s3_start_after": s3_source_keys[started - 1]}
+    else:
+        token = {"s3_source_keys": s3_source_keys[started:]}
+    print(f"Batch: {len(s3_source_keys) - started} video(s) left, continuing")
+    if continuation_mode == 'invoke':
+        get_client('lambda').invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({**event, "continuation": token})
         )
-    return result
\ No newline at end of file
+    body["Continuation"] = token
+    return {
+        'statusCode': 202,
+        'body': body
+    }
@@ -1,71 +1,114 @@
 import json
-import boto3
-import os
-import subprocess
+from contextlib import closing
+from sampling_core.clients import get_client
+from sampling_core.frames import image_extension, plan_extraction, stream_frames
+from sampling_core.metrics import Metrics
+from sampling_core.params import InvalidParameter, bad_request, parse_video_options
+from sampling_core.sources import VideoSource, segment_input_mode
 
-IMAGE_NAME_EXTENSION = '.png'
+DUPLICATES_FILE_PREFIX = 'duplicates'
+FRAMES_FILE_PREFIX = 'frames' # manifest of the uploaded frames, read by the Step Functions Map
 DEFAULT_OUTPUT_FOLDER = 'screenshot'
 LOCAL_DIR = '/tmp'
 SAMPLE_FREQUENCY = 0.5 # 1 image every 2 seconds
-    
-s3 = boto3.client('s3')
-rekognition = boto3.client('rekognition')
-sns = boto3.client('sns')
 
 def lambda_handler(event, context):
+    metrics = Metrics('capture-frames')
     # -- Validate input parameters start -- 
-    if event is None or "s3_source_bucket" not in event or "s3_source_key" not in event:
-        return {
-            'statusCode': 400,
-            'body': 'Require parameters: s3_source_bucket and s3_source_key.'
-        }
-        
-    s3_source_bucket = event["s3_source_bucket"]
-    s3_source_key = event["s3_source_key"]
-    sample_frequency = event.get("sample_frequency")
-    if sample_frequency is None:
-        sample_frequency = SAMPLE_FREQUENCY
-
-    file_name = s3_source_key.split('/')[-1]
-    local_file_path = f'{LOCAL_DIR}/{file_name}'
-
-    s3_target_folder = event.get("s3_target_folder")
-    if s3_target_folder is None:
-        s3_source_path = s3_source_key.replace(file_name,'')
-        while s3_source_path.endswith('/'):
-            s3_source_path = s3_source_path[0:len(s3_source_path)-1]
-        s3_target_folder = f"{s3_source_path}/{DEFAULT_OUTPUT_FOLDER}"
-
-
-    s3_target_bucket = event.get("s3_target_bucket")
-    if s3_target_bucket is None:
-        s3_target_bucket = s3_source_bucket
-    
-    min_confidence = event.get("min_confidence")
-    sns_topic_arn = event.get("sns_topic_arn")
+    try:
+        options = parse_video_options(event, SAMPLE_FREQUENCY, output_folder=DEFAULT_OUTPUT_FOLDER)
+    except InvalidParameter as ex:
+        return bad_request(ex)
+    s3_target_bucket = options["s3_target_bucket"]
+    s3_target_folder = options["s3_target_folder"]
+    profile = options["profile"]
+    dedup_max_distance = options["dedup_max_distance"]
+    # time window (seconds) to extract, set when the video is split into segments by plan-segments
+    segment_start = event.get("segment_start")
+    segment_duration = event.get("segment_duration")
+    input_mode = options["input_mode"]
+    if segment_start is not None:
+        input_mode = segment_input_mode(input_mode)
     # -- Validation end --
     
-    # Download video to local disk
-    s3.download_file(s3_source_bucket, s3_source_key, local_file_path)
-    
-    # Sample images based on given interval and store images to local disk
-    ffmpeg_cmd = f"/opt/bin/ffmpeg -i {local_file_path} -r {sample_frequency} {LOCAL_DIR}/%06d{IMAGE_NAME_EXTENSION}"
-    cmd = ffmpeg_cmd.split(' ')
-    p1 = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    s3 = get_client('s3')
+    # Download video to local disk, or get ready to stream it to ffmpeg
+    with metrics.timer("Download"):
+        source = VideoSource(s3, options["s3_source_bucket"], options["s3_source_key"], input_mode=input_mode, local_dir=LOCAL_DIR)
     
     # Target folder: using the video file name as a sub folder
-    s3_target_folder += "/" + file_name.lower()
+    s3_target_folder += "/" + options["file_name"].lower()
+
+    # Sample images based on given interval and upload them to s3 while ffmpeg is still decoding
+    deduplicator = None
+    thumbnail_size = None
+    if dedup_max_distance is not None:
+        # numpy is only imported when deduplication is used
+        from sampling_core import dedup
+        deduplicator = dedup.FrameDeduplicator(dedup_max_distance)
+        thumbnail_size = dedup.THUMBNAIL_SIZE
+    try:
+        with metrics.timer("Plan"):
+            extraction = plan_extraction(source.input, options["sample_frequency"],
+                sampling_mode=options["sampling_mode"],
+                scene_threshold=options["scene_threshold"],
+                max_sample_gap=options["max_sample_gap"],
+                extraction_strategy=options["extraction_strategy"],
+                input_feeder=source.input_feeder)
+        frames = stream_frames(source.input, extraction["video_filter"],
+            profile=profile,
+            thumbnail_size=thumbnail_size,
+            keyframes_only=extraction["strategy"] == "keyframe",
+            input_feeder=source.input_feeder,
+            start=segment_start,
+            duration=segment_duration)
+        manifest = []
+        # wall time of the extraction, uploads included
+        with metrics.timer("Extraction"), closing(frames):
+            if deduplicator is not None:
+                frames = deduplicator.unique_frames(frames)
+            for frame in frames:
+                s3_key = f'{s3_target_folder}/{frame.timestamp}{image_extension(profile)}'
+                with metrics.timer("Upload"):
+                    s3.put_object(Body=frame.data, Bucket=s3_target_bucket, Key=s3_key)
+                metrics.count("S3PutCalls")
+                metrics.add("BytesUploaded", len(frame.data), 'Bytes')
+                item = {"Key": s3_key, "Timestamp": frame.timestamp, "Size": len(frame.data)}
+                if frame.thumbnail is not None:
+                    item["Hash"] = format(int(dedup.perceptual_hash(frame.thumbnail)), '016x')
+                manifest.append(item)
+        extraction["decode_seconds"] = round(metrics.get("ExtractionSeconds"), 3)
+        extraction["frames"] = len(manifest)
+        metrics.count("Frames", len(manifest))
+        metrics.throughput("FramesPerSecond", "Frames", "Extraction")
+        del extraction["video_filter"]
+        print("Frame extraction:", extraction)
+    finally:
+        # Delete local video file
+        source.close()
+
+    # The frames to moderate, so the Map iterates them without listing the temp folder
+    if segment_start is None:
+        s3_manifest_key = f'{s3_target_folder}/{FRAMES_FILE_PREFIX}.json'
+    else:
+        s3_manifest_key = f'{s3_target_folder}/{FRAMES_FILE_PREFIX}-{segment_start}.json'
+    s3.put_object(Body=json.dumps(manifest), Bucket=s3_target_bucket, Key=s3_manifest_key)
+    metrics.count("S3PutCalls")
 
-    # Upload images to s3 and cleanup temp files on local disk
-    for file in os.listdir(LOCAL_DIR):
-        if file.endswith(IMAGE_NAME_EXTENSION):
-            # convert file name from sequence to time position
-            seq = float(file.replace(IMAGE_NAME_EXTENSION,''))
-            ms_pos = 1/sample_frequency * (seq - 1) * 1000
-            s3.upload_file(f'{LOCAL_DIR}/{file}', s3_target_bucket, f'{s3_target_folder}/{ms_pos}.png')
-            
-        # Delete local file: image or video
-        os.remove(f'{LOCAL_DIR}/{file}')
+    if deduplicator is not None:
+        # Duplicated frames are not uploaded: consolidation copies the labels of the frame they duplicate
+        if segment_start is None:
+            s3_duplicates_key = f'{s3_target_folder}/{DUPLICATES_FILE_PREFIX}.json'
+        else:
+            s3_duplicates_key = f'{s3_target_folder}/{DUPLICATES_FILE_PREFIX}-{segment_start}.json'
+        s3.put_object(
+            Body=json.dumps([[timestamp, reference] for timestamp, reference in deduplicator.duplicates.items()]),
+            Bucket=s3_target_bucket,
+            Key=s3_duplicates_key
+        )
+        metrics.count("S3PutCalls")
+        print("Frame deduplication:", deduplicator.stats())
+    metrics.emit()
 
     output = event
     output["s3_target_temp_folder"] = s3_target_folder
@@ -73,4 +116,11 @@ def lambda_handler(event, context):
         output["s3_target_folder"] = '/'.join(s3_target_folder.split('/')[0:-1])
     if event.get("s3_target_bucket") is None:
         output["s3_target_bucket"] = s3_target_bucket
+    output["extraction"] = extraction
+    output["s3_manifest_key"] = s3_manifest_key
+    if deduplicator is not None:
+        output["s3_duplicates_key"] = s3_duplicates_key
+        output["deduplication"] = deduplicator.stats()
+    if options["metrics_summary"]:
+        output["metrics"] = metrics.summary()
     return output
\ No newline at end of file
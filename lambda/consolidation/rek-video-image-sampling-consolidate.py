@@ -1,10 +1,19 @@
 import json
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+from sampling_core.cache import DEFAULT_CACHE_TTL, open_cache
+from sampling_core.clients import get_client
+from sampling_core.metrics import Metrics
+from sampling_core.adaptive import DENSE_FILE_PREFIX
+from sampling_core.moderation import DEFAULT_MIN_CONFIDENCE, add_verdict, rejection
+from sampling_core.output import format_result, offload, result_key
+from sampling_core.params import get_or_default
 
 API_NAME = 'cm_video_moderation_image_sampling'
-
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
+DUPLICATES_FILE_PREFIX = 'duplicates' # frames skipped by the capture-frames deduplication
+MAX_WORKERS = 32 # JSON results downloaded at the same time
+DELETE_BATCH_SIZE = 1000 # max keys per DeleteObjects request
+REJECTED_ERROR = 'VideoRejected' # raised by moderate-image in reject fast mode
+RESULT_MANIFEST_FILE = 'manifest.json' # written by the Map ResultWriter
 
 def lambda_handler(event, context):
     s3_source_bucket = event["Payload"].get("s3_source_bucket")
@@ -13,30 +22,183 @@ def lambda_handler(event, context):
     s3_target_bucket = event["Payload"].get("s3_target_bucket")
     sns_topic_arn = event["Payload"].get("sns_topic_arn")
     job_id = event["Payload"].get("job_id")
+    reject_labels = event["Payload"].get("reject_labels")
+    reject_min_confidence = get_or_default(event["Payload"], "reject_min_confidence", get_or_default(event["Payload"], "min_confidence", DEFAULT_MIN_CONFIDENCE))
+    # add the stage durations and counters to the result
+    metrics_summary = event["Payload"].get("metrics_summary", False)
+    metrics = Metrics('consolidation')
+    s3 = get_client('s3', MAX_WORKERS)
     
     if job_id is None or len(job_id) == 0:
         job_id = f'{s3_source_bucket}_{s3_source_key}'.replace('/','_').replace('.','_')
         
+    def publish(result):
+        result = format_result(result, event["Payload"].get("output_format"), event["Payload"].get("segment_gap"))
+        # Over the SNS message limit, and the state limit of the execution: the full result goes to S3
+        try:
+            message = offload(result, s3, s3_target_bucket, result_key(event["Payload"]["s3_target_folder"], job_id))
+            if message is not result:
+                print("Result written to S3:", message["ResultLocation"])
+                metrics.count("ResultsOffloaded")
+            result = message
+        except Exception as ex:
+            print("Failed to write the result to S3:", ex)
+        # Send SNS message
+        try:
+            with metrics.timer("Publish"):
+                sns_response = get_client('sns').publish(
+                    TopicArn=sns_topic_arn,
+                    Message=json.dumps(result)
+                )
+        except Exception as ex:
+            print("Failed to send the SNS message:", ex)
+
+        metrics.emit()
+        if metrics_summary:
+            result["Metrics"] = metrics.summary()
+        return result
+
+    # Result cache hit, found by plan-segments: nothing was sampled, publish the cached result
+    result_cache_key = event["Payload"].get("cache_key")
+    if event["Payload"].get("cache_hit"):
+        cached = open_cache(event["Payload"]["result_cache"], s3).get(result_cache_key)
+        if cached is None:
+            raise Exception(f'Cached result expired: {result_cache_key}')
+        metrics.count("CacheHits")
+        return {
+            'statusCode': 200,
+            'body': publish({
+                "JobId": job_id,
+                "API": API_NAME,
+                "Video": {
+                    "S3Bucket": s3_source_bucket,
+                    "S3ObjectName": s3_source_key
+                },
+                **cached,
+                "Cache": "HIT"
+            })
+        }
+
     # get video file name from source key as sub folder
     file_name = s3_source_key.split('/')[-1]
     s3_target_folder += "/" + file_name.lower()
 
-    # List JSON files in target S3 folder
+    # List all the files in target S3 folder: a listing page holds at most 1000 keys
+    with metrics.timer("List"):
+        s3_keys = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=s3_target_bucket, Prefix=s3_target_folder):
+            for c in page.get("Contents", []):
+                s3_keys.append(c["Key"])
+    # Frames skipped by the deduplication in capture-frames
+    duplicates_keys = [k for k in s3_keys if k.split('/')[-1].startswith(DUPLICATES_FILE_PREFIX) and k.endswith('.json')]
+    # Frames moderated by the dense pass of adaptive sampling
+    dense_keys = [k for k in s3_keys if k.split('/')[-1].startswith(DENSE_FILE_PREFIX) and k.endswith('.json')]
+
+    # The moderation results are written by the Map ResultWriter: a manifest listing the result files
+    result_keys = []
+    failed_keys = []
+    result_writer_details = (event.get("MapRun") or {}).get("ResultWriterDetails")
+    if result_writer_details is None and "MapError" in event:
+        # The Map failed, on a rejected video in reject fast mode: its ResultWriter
+        # still writes the results and the manifest to the temp folder
+        manifest_keys = [k for k in s3_keys if k.split('/')[-1] == RESULT_MANIFEST_FILE]
+        if len(manifest_keys) == 0:
+            raise Exception(f'Image moderation failed: {event["MapError"]}')
+        result_writer_details = {"Bucket": s3_target_bucket, "Key": manifest_keys[0]}
+    if result_writer_details is not None:
+        manifest = read_json(result_writer_details["Bucket"], result_writer_details["Key"])
+        result_keys = [f["Key"] for f in manifest["ResultFiles"].get("SUCCEEDED", [])]
+        failed_keys = [f["Key"] for f in manifest["ResultFiles"].get("FAILED", [])]
+        result_bucket = manifest.get("DestinationBucket", result_writer_details["Bucket"])
+
     labels = []
-    s3_response = s3.list_objects(Bucket=s3_target_bucket, Prefix=s3_target_folder)
-    if s3_response is not None and "Contents" in s3_response:
-        for c in s3_response["Contents"]:
-            if c["Key"].endswith('.json'):
-                s3_get_response = s3.get_object(Bucket=s3_target_bucket, Key=c["Key"])
-                j = json.loads(s3_get_response["Body"].read().decode())
-                if j is not None and "ModerationLabel" in j and len(j["ModerationLabel"]) > 0:
-                    labels.append(j)
-    
-            # Delete file: image and json
-            s3.delete_object(Bucket=s3_target_bucket, Key=c["Key"])
-            
+    rejections = []
+    # Frames skipped by the deduplication in capture-frames: [timestamp, timestamp of the frame it duplicates]
+    duplicates = []
+    failures = []
+    moderated = 0
+    throttles = 0
+    with metrics.timer("Read"):
+        if len(duplicates_keys) + len(dense_keys) + len(result_keys) + len(failed_keys) > 0:
+            with ThreadPoolExecutor(max_workers=min(len(duplicates_keys) + len(dense_keys) + len(result_keys) + len(failed_keys), MAX_WORKERS)) as executor:
+                for j in executor.map(lambda k: read_json(s3_target_bucket, k), duplicates_keys):
+                    duplicates += j
+                for dense_results in executor.map(lambda k: read_json(s3_target_bucket, k), dense_keys):
+                    moderated += len(dense_results)
+                    for r in dense_results:
+                        if len(r["ModerationLabel"]) > 0:
+                            labels.append(r)
+                            rejected = rejection(r, reject_labels, reject_min_confidence)
+                            if rejected is not None:
+                                rejections.append(rejected)
+                # Failed child executions: rejected batches, or batches failed after the Lambda retries
+                for executions in executor.map(lambda k: read_json(result_bucket, k), failed_keys):
+                    for e in executions:
+                        if e.get("Error") == REJECTED_ERROR:
+                            # the Cause is the Lambda error, its message the rejection
+                            rejected = json.loads(json.loads(e["Cause"])["errorMessage"])
+                            rejections.append(rejected)
+                            labels.append({"Timestamp": rejected["Timestamp"], "ModerationLabel": [rejected["ModerationLabel"]]})
+                        else:
+                            print("Failed moderation batch:", e.get("Error"), e.get("Cause"))
+                # One entry per child execution, its Output is the JSON returned by moderate-image
+                for executions in executor.map(lambda k: read_json(result_bucket, k), result_keys):
+                    for e in executions:
+                        output = json.loads(e["Output"])
+                        moderated += len(output["Results"])
+                        throttles += output.get("RateLimiting", {}).get("Throttles", 0)
+                        failures += output["Failures"]
+                        for r in output["Results"]:
+                            if len(r["ModerationLabel"]) > 0:
+                                labels.append(r)
+    for f in failures:
+        print("Failed to moderate image:", f)
+    if "MapError" in event and len(rejections) == 0:
+        # not a rejection: keep the temp files to investigate
+        raise Exception(f'Image moderation failed: {event["MapError"]}')
+    rejected = None
+    if len(rejections) > 0:
+        rejected = min(rejections, key=lambda r: r["Timestamp"])
+        rejected.pop("Key", None)
+
+    # Delete files: images and json
+    deleted = 0
+    with metrics.timer("Delete"):
+        for i in range(0, len(s3_keys), DELETE_BATCH_SIZE):
+            s3_delete_response = s3.delete_objects(
+                Bucket=s3_target_bucket,
+                Delete={
+                    'Objects': [{'Key': k} for k in s3_keys[i:i + DELETE_BATCH_SIZE]],
+                    'Quiet': True
+                }
+            )
+            errors = s3_delete_response.get("Errors", [])
+            for e in errors:
+                print("Failed to delete the temp file:", e)
+            deleted += min(DELETE_BATCH_SIZE, len(s3_keys) - i) - len(errors)
+
+    # Reuse the labels of the moderated frames for their duplicates
+    labels_by_timestamp = {l["Timestamp"]: l for l in labels}
+    for timestamp, reference in duplicates:
+        if reference in labels_by_timestamp:
+            labels.append({"Timestamp": timestamp, "ModerationLabel": labels_by_timestamp[reference]["ModerationLabel"]})
+
     # sort labels
     labels.sort(key=lambda x: x["Timestamp"], reverse=False)
+
+    consolidation = {
+        "ObjectsListed": len(s3_keys),
+        "ResultFilesRead": len(result_keys) + len(failed_keys) + len(dense_keys),
+        "ImagesModerated": moderated,
+        "ImagesFailed": len(failures),
+        "Throttles": throttles,
+        "LabelsGathered": len(labels),
+        "ObjectsDeleted": deleted
+    }
+    print("Consolidation:", consolidation)
+    for name, value in consolidation.items():
+        metrics.count(name, value)
     
     result = {
             "JobId": job_id,
@@ -47,17 +209,27 @@ def lambda_handler(event, context):
             },
             "ModerationLabels": labels
         }
-        
-    # Send SNS message
-    try:
-        sns_response = sns.publish(
-            TopicArn=sns_topic_arn,
-            Message=json.dumps(result)
-        )
-    except Exception as ex:
-        print("Failed to send the SNS message:", ex)
-    
+    if len(failures) > 0:
+        # frames without moderation: the video is not known to be clean there
+        result["FailedFrames"] = sorted([{"Timestamp": f.get("Timestamp"), "Error": f["Error"]} for f in failures],
+            key=lambda f: f["Timestamp"] or 0)
+    add_verdict(result, reject_labels, rejected)
+
+    # Keep the result for the next videos with the same content and options, unless frames failed
+    if result_cache_key is not None and len(failures) == 0:
+        try:
+            open_cache(event["Payload"]["result_cache"], s3).put(result_cache_key, result,
+                get_or_default(event["Payload"], "cache_ttl", DEFAULT_CACHE_TTL))
+            result["Cache"] = "MISS"
+        except Exception as ex:
+            print("Failed to write the result cache:", ex)
+
     return {
         'statusCode': 200,
-        'body': result
+        'body': publish(result),
+        'consolidation': consolidation
     }
+
+def read_json(s3_bucket, s3_key):
+    s3_get_response = get_client('s3', MAX_WORKERS).get_object(Bucket=s3_bucket, Key=s3_key)
+    return json.loads(s3_get_response["Body"].read().decode())
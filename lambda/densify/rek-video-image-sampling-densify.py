@@ -0,0 +1,89 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from sampling_core.adaptive import DENSE_FILE_PREFIX, dense_frames, dense_windows
+from sampling_core.clients import get_client
+from sampling_core.concurrency import bounded_map
+from sampling_core.metrics import Metrics
+from sampling_core.moderation import moderate_image
+from sampling_core.params import InvalidParameter, bad_request, get_or_default, parse_video_options
+from sampling_core.ratelimit import LIMITED_CLIENT_RETRIES, RateLimiter
+from sampling_core.sources import VideoSource
+
+LOCAL_DIR = '/tmp'
+MAX_WORKERS = 32 # frames moderated at the same time
+REKOGNITION_TPS = 50 # default, the Map is done: the dense pass is the only moderation of the video
+
+def lambda_handler(event, context):
+    metrics = Metrics('densify')
+    # The planned video ("Payload") and the results of the sparse pass, written by the Map ResultWriter ("MapRun")
+    if event is None or "Payload" not in event or "MapRun" not in event:
+        return {
+            'statusCode': 400,
+            'body': 'Require parameters: Payload and MapRun.'
+        }
+    try:
+        options = parse_video_options(event["Payload"], event["Payload"].get("sample_frequency"))
+    except InvalidParameter as ex:
+        return bad_request(ex)
+    s3_target_bucket = options["s3_target_bucket"]
+    s3_target_temp_folder = event["Payload"]["s3_target_temp_folder"]
+    s3 = get_client('s3', MAX_WORKERS)
+    rekognition = get_client('rekognition', MAX_WORKERS, retries=LIMITED_CLIENT_RETRIES)
+    # rekognition_tps: the budget of the concurrent videos of a batch also holds for their dense passes
+    limiter = RateLimiter(get_or_default(event["Payload"], "rekognition_tps", REKOGNITION_TPS))
+
+    def read_json(s3_bucket, s3_key):
+        s3_get_response = s3.get_object(Bucket=s3_bucket, Key=s3_key)
+        return json.loads(s3_get_response["Body"].read().decode())
+
+    # Results of the sparse pass: one entry per child execution, its Output is the JSON returned by moderate-image
+    results = []
+    with metrics.timer("Read"):
+        result_writer_details = event["MapRun"]["ResultWriterDetails"]
+        manifest = read_json(result_writer_details["Bucket"], result_writer_details["Key"])
+        result_bucket = manifest.get("DestinationBucket", result_writer_details["Bucket"])
+        result_keys = [f["Key"] for f in manifest["ResultFiles"].get("SUCCEEDED", [])]
+        if len(result_keys) > 0:
+            with ThreadPoolExecutor(max_workers=min(len(result_keys), MAX_WORKERS)) as executor:
+                for executions in executor.map(lambda k: read_json(result_bucket, k), result_keys):
+                    for e in executions:
+                        results += json.loads(e["Output"])["Results"]
+
+    # Windows around the flagged and borderline frames, extracted with seeked ffmpeg runs
+    windows = dense_windows(results, options["dense_window"])
+    print(f"Dense pass: {len(windows)} window(s), {round(sum(end - start for start, end in windows), 3)}s of video")
+    dense_results = []
+    if len(windows) > 0:
+        source = VideoSource(s3, options["s3_source_bucket"], options["s3_source_key"],
+            input_mode='pipe' if options["input_mode"] == 'pipe' else 'url', local_dir=LOCAL_DIR)
+
+        def process_frame(frame):
+            with metrics.timer("Moderation"):
+                return moderate_image(rekognition, {'Bytes': frame.data}, frame.timestamp,
+                    min_confidence=options["min_confidence"], limiter=limiter)
+
+        try:
+            with metrics.timer("Densify"), ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                frames = dense_frames(source.input, windows, options["dense_sample_frequency"], [r["Timestamp"] for r in results],
+                    profile=options["profile"],
+                    input_feeder=source.input_feeder)
+                for mr in bounded_map(executor, process_frame, frames, MAX_WORKERS * 2):
+                    dense_results.append(mr)
+        finally:
+            source.close()
+
+    # Read by the consolidation Lambda with the other files of the temp folder
+    s3_dense_key = f'{s3_target_temp_folder}/{DENSE_FILE_PREFIX}.json'
+    s3.put_object(Body=json.dumps(dense_results), Bucket=s3_target_bucket, Key=s3_dense_key)
+    print("Rekognition rate limiting:", limiter.stats())
+    metrics.count("SparseFrames", len(results))
+    metrics.count("DenseWindows", len(windows))
+    metrics.count("DenseFrames", len(dense_results))
+    metrics.count("Throttles", limiter.throttles)
+    metrics.emit()
+
+    return {
+        "s3_dense_key": s3_dense_key,
+        "windows": len(windows),
+        "frames": len(dense_results)
+    }
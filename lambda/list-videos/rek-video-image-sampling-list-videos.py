@@ -0,0 +1,44 @@
+import json
+import uuid
+from sampling_core.clients import get_client
+from sampling_core.metrics import Metrics
+from sampling_core.params import batch_video
+from sampling_core.sources import is_video, list_videos
+
+BATCH_FOLDER = 'rek-video-sampling-batch' # the batch state machine writes its results there too
+
+def lambda_handler(event, context):
+    # The videos of a batch: s3_source_keys, or the videos under s3_source_prefix, with the per-video
+    # options ("options" of the batch) that differ per video
+    if event is None or "s3_source_bucket" not in event or ("s3_source_keys" in event) == ("s3_source_prefix" in event):
+        return {
+            'statusCode': 400,
+            'body': 'Require parameters: s3_source_bucket and one of s3_source_keys, s3_source_prefix.'
+        }
+    s3_source_bucket = event["s3_source_bucket"]
+    s3_source_keys = event.get("s3_source_keys")
+    s3_source_prefix = event.get("s3_source_prefix")
+    options = {**(event.get("options") or {}), "s3_source_bucket": s3_source_bucket}
+    metrics = Metrics('list-videos')
+    s3 = get_client('s3')
+
+    with metrics.timer("List"):
+        if s3_source_prefix is not None:
+            s3_source_keys = list_videos(s3, s3_source_bucket, s3_source_prefix)
+        else:
+            # the other objects are skipped, as under a prefix
+            s3_source_keys = [k for k in s3_source_keys if is_video(k)]
+    videos = [{"s3_source_bucket": s3_source_bucket, **batch_video(options, k)} for k in s3_source_keys]
+
+    # The Map ItemReader reads the videos from a single JSON file
+    s3_manifest_key = f'{BATCH_FOLDER}/videos-{uuid.uuid4()}.json'
+    with metrics.timer("Write"):
+        s3.put_object(Body=json.dumps(videos), Bucket=s3_source_bucket, Key=s3_manifest_key)
+    print(f"Batch: {len(videos)} video(s)")
+    metrics.count("Videos", len(videos))
+    metrics.emit()
+
+    return {
+        "s3_manifest_key": s3_manifest_key,
+        "videos": len(videos)
+    }
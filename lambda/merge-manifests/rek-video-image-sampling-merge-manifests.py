@@ -0,0 +1,57 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from sampling_core.clients import get_client
+from sampling_core.metrics import Metrics
+from sampling_core.ordering import DEFAULT_COARSE_LEVELS, coarse_to_fine_order
+from sampling_core.params import get_or_default
+from sampling_core.progress import checkpoint_ranks
+
+FRAMES_FILE_PREFIX = 'frames'
+MAX_WORKERS = 32 # segment manifests downloaded at the same time
+
+def lambda_handler(event, context):
+    # The planned video ("Payload") and the output of each capture-frames segment ("Segments")
+    if event is None or "Payload" not in event or "Segments" not in event:
+        return {
+            'statusCode': 400,
+            'body': 'Require parameters: Payload and Segments.'
+        }
+    s3_target_bucket = event["Payload"]["s3_target_bucket"]
+    s3_target_temp_folder = event["Payload"]["s3_target_temp_folder"]
+    s3_manifest_keys = [segment["s3_manifest_key"] for segment in event["Segments"]]
+    metrics = Metrics('merge-manifests')
+    s3 = get_client('s3', MAX_WORKERS)
+
+    def read_manifest(s3_key):
+        s3_get_response = s3.get_object(Bucket=s3_target_bucket, Key=s3_key)
+        return json.loads(s3_get_response["Body"].read().decode())
+
+    # One manifest for the whole video: the Map ItemReader reads a single JSON file
+    frames = []
+    with metrics.timer("Read"):
+        if len(s3_manifest_keys) > 0:
+            with ThreadPoolExecutor(max_workers=min(len(s3_manifest_keys), MAX_WORKERS)) as executor:
+                for manifest in executor.map(read_manifest, s3_manifest_keys):
+                    frames += manifest
+    frames.sort(key=lambda x: x["Timestamp"])
+    # The Map moderates the frames in the manifest order: coarse_to_fine puts a sparse pass over the whole video first
+    if event["Payload"].get("frame_order") == 'coarse_to_fine':
+        frames = coarse_to_fine_order(frames, get_or_default(event["Payload"], "coarse_levels", DEFAULT_COARSE_LEVELS))
+    # The batch with the frame completing a checkpoint publishes the partial results
+    progress = event["Payload"].get("progress")
+    if progress is not None and len(frames) > 0:
+        for rank, checkpoint in checkpoint_ranks(len(frames), progress["checkpoints"]).items():
+            frames[rank]["Checkpoint"] = checkpoint
+
+    s3_manifest_key = f'{s3_target_temp_folder}/{FRAMES_FILE_PREFIX}.json'
+    with metrics.timer("Write"):
+        s3.put_object(Body=json.dumps(frames), Bucket=s3_target_bucket, Key=s3_manifest_key)
+    print(f"Merged {len(s3_manifest_keys)} segment manifest(s): {len(frames)} frames")
+    metrics.count("Segments", len(s3_manifest_keys))
+    metrics.count("Frames", len(frames))
+    metrics.emit()
+
+    return {
+        "s3_manifest_key": s3_manifest_key,
+        "frames": len(frames)
+    }
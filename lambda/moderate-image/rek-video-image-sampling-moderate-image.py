@@ -1,55 +1,164 @@
 import json
-import boto3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sampling_core.clients import get_client
+from sampling_core.metrics import Metrics
+from sampling_core.moderation import DEFAULT_MIN_CONFIDENCE, moderate_image, rejection
+from sampling_core.output import format_result
+from sampling_core.params import get_or_default
+from sampling_core.prescreen import groups, make_mosaic
+from sampling_core.progress import partial_result, progress_key
+from sampling_core.ratelimit import LIMITED_CLIENT_RETRIES, RateLimiter
 
-IMAGE_NAME_EXTENSION = '.png'
-DEFAULT_MIN_CONFIDENCE = 50
+MAX_WORKERS = 10 # images of a batch moderated at the same time
+REKOGNITION_TPS = 5 # per invocation, default when plan-segments did not share out the video budget
+API_NAME = 'cm_video_moderation_image_sampling'
+LABELS_FOLDER = 'labels' # labeled frames of each batch, gathered at the progress checkpoints
 
-s3 = boto3.client('s3')
-rekognition = boto3.client('rekognition')
+class VideoRejected(Exception):
+    # Fails the child execution, and the Map with it, when an image matches the reject criteria
+    pass
 
 def lambda_handler(event, context):
-    s3_bucket = event.get("s3_bucket")
-    s3_key = event["s3_key"]["Key"]
-    if not s3_key.endswith(IMAGE_NAME_EXTENSION):
-        return "skip"
-    
-    min_confidence = event.get("min_confidence")
-    if min_confidence is None:
-        min_confidence = DEFAULT_MIN_CONFIDENCE
-    
-    if s3_bucket is None or s3_key is None:
+    metrics = Metrics('moderate-image')
+    # A batch of frames from the capture-frames manifest, batched by the Map ItemBatcher:
+    # {"Items": [{"Key": ..., "Timestamp": ...}, ...], "BatchInput": {...}}
+    batch_input = event.get("BatchInput", {})
+    items = event.get("Items")
+    s3_bucket = batch_input.get("s3_bucket")
+    if s3_bucket is None or items is None:
         return {
             'statusCode': 400,
-            'body': 'Required parameters: s3_bucket, s3_key'
+            'body': 'Required parameters: Items, BatchInput.s3_bucket'
         }
 
-    ts = s3_key.split('/')[-1].replace(IMAGE_NAME_EXTENSION,'')
-    detectModerationLabelsResponse = rekognition.detect_moderation_labels(
-           Image={
-               'S3Object': {
-                   'Bucket': s3_bucket,
-                   'Name': s3_key,
-               }
-           },
-           MinConfidence=min_confidence,
-    
-        )
-    result = {"Timestamp": float(ts), "ModerationLabel": []}
-    for l in detectModerationLabelsResponse["ModerationLabels"]:
-        result["ModerationLabel"].append(
-            {
-                "Confidence": l["Confidence"],
-                "Name": l["Name"],
-                "ParentName": l["ParentName"]
-            }
-        )
-    
-    if len(result["ModerationLabel"]) > 0:
-        # Upload the result to S3
-        s3.put_object(
-            Body=json.dumps(result),
-            Bucket=s3_bucket,
-            Key=s3_key.replace(IMAGE_NAME_EXTENSION,'.json')
-        )
-        
-    return result
\ No newline at end of file
+    min_confidence = get_or_default(batch_input, "min_confidence", DEFAULT_MIN_CONFIDENCE)
+    limiter = RateLimiter(get_or_default(batch_input, "rekognition_tps", REKOGNITION_TPS))
+    # reject fast mode: stop at the first label with one of these names or top level categories
+    reject_labels = batch_input.get("reject_labels")
+    reject_min_confidence = get_or_default(batch_input, "reject_min_confidence", min_confidence)
+    rejections = []
+    stopped = threading.Event()
+    # partial results at progress checkpoints, set by plan-segments
+    progress = batch_input.get("progress")
+    # contact sheet prescreen: grid x grid images moderated as one mosaic first, set by plan-segments
+    prescreen_grid = batch_input.get("prescreen_grid")
+    # throttled calls are retried by the rate limiter
+    rekognition = get_client('rekognition', MAX_WORKERS, retries=LIMITED_CLIENT_RETRIES)
+
+    def moderate(item):
+        if stopped.is_set():
+            # the video is already rejected: skip the rest of the batch
+            return None, None
+        try:
+            with metrics.timer("Moderation"):
+                image = {'S3Object': {'Bucket': s3_bucket, 'Name': item["Key"]}}
+                result = moderate_image(rekognition, image, item["Timestamp"], min_confidence, limiter,
+                    borderline_confidence=batch_input.get("borderline_confidence"))
+        except Exception as ex:
+            return None, {"Key": item["Key"], "Timestamp": item["Timestamp"], "Error": type(ex).__name__, "Cause": str(ex)}
+        rejected = rejection(result, reject_labels, reject_min_confidence)
+        if rejected is not None:
+            rejections.append({"Key": item["Key"], **rejected})
+            stopped.set()
+        return result, None
+
+    def moderate_group(group):
+        # Contact sheet prescreen: the images are only moderated one by one when the mosaic
+        # has a label near the threshold
+        if prescreen_grid is None or len(group) == 1 or stopped.is_set():
+            return [moderate(item) for item in group]
+        try:
+            with metrics.timer("Prescreen"):
+                s3 = get_client('s3', MAX_WORKERS)
+                images = [s3.get_object(Bucket=s3_bucket, Key=item["Key"])["Body"].read() for item in group]
+                sheet = moderate_image(rekognition, {'Bytes': make_mosaic(images, prescreen_grid)}, group[0]["Timestamp"],
+                    batch_input["prescreen_confidence"], limiter)
+        except Exception as ex:
+            print("Failed to prescreen the images, moderating them one by one:", ex)
+            return [moderate(item) for item in group]
+        metrics.count("Mosaics")
+        if len(sheet["ModerationLabel"]) > 0:
+            metrics.count("MosaicsFlagged")
+            return [moderate(item) for item in group]
+        metrics.count("ImagesPrescreened", len(group))
+        return [({"Timestamp": item["Timestamp"], "ModerationLabel": []}, None) for item in group]
+
+    # Moderate the images of the batch concurrently, one result or failure per image.
+    # Results are returned to the Map state, which writes them to S3 with its ResultWriter
+    results = []
+    failures = []
+    if len(items) > 0:
+        item_groups = list(groups(items, 1 if prescreen_grid is None else prescreen_grid ** 2))
+        with metrics.timer("Batch"), ThreadPoolExecutor(max_workers=min(len(item_groups), MAX_WORKERS)) as executor:
+            for group in executor.map(moderate_group, item_groups):
+                for result, failure in group:
+                    if failure is not None:
+                        print("Failed to moderate image:", failure)
+                        failures.append(failure)
+                    elif result is not None:
+                        results.append(result)
+
+    print("Rekognition rate limiting:", limiter.stats())
+    metrics.count("Images", len(results))
+    metrics.count("Failures", len(failures))
+    metrics.count("RekognitionCalls", limiter.calls)
+    metrics.count("Throttles", limiter.throttles)
+    metrics.add("ThrottleWaitSeconds", limiter.wait_seconds, 'Seconds')
+    metrics.throughput("ImagesPerSecond", "Images", "Batch")
+    if len(rejections) > 0:
+        metrics.count("Rejected")
+    if progress is not None:
+        try:
+            with metrics.timer("Progress"):
+                report_progress(progress, s3_bucket, items, results)
+        except Exception as ex:
+            print("Failed to publish the partial results:", ex)
+    metrics.emit()
+
+    if len(rejections) > 0:
+        # the earliest matching frame of the batch, read back by the consolidation Lambda
+        raise VideoRejected(json.dumps(min(rejections, key=lambda r: r["Timestamp"])))
+
+    return {
+        "Results": results,
+        "Failures": failures,
+        "RateLimiting": limiter.stats()
+    }
+
+def report_progress(progress, s3_bucket, items, results):
+    # Keep the labeled frames of the batch. The batch with a checkpoint frame (see merge-manifests)
+    # gathers the labels kept so far and publishes them: batches still running are not included.
+    s3 = get_client('s3', MAX_WORKERS)
+    labels_folder = f'{progress["s3_target_temp_folder"]}/{LABELS_FOLDER}'
+    labeled = [r for r in results if len(r["ModerationLabel"]) > 0]
+    if len(labeled) > 0:
+        s3.put_object(Body=json.dumps(labeled), Bucket=s3_bucket, Key=f'{labels_folder}/{items[0]["Timestamp"]}.json')
+    checkpoints = [item["Checkpoint"] for item in items if "Checkpoint" in item]
+    if len(checkpoints) == 0:
+        return
+
+    s3_keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_bucket, Prefix=labels_folder + '/'):
+        for c in page.get("Contents", []):
+            s3_keys.append(c["Key"])
+    labels = []
+    if len(s3_keys) > 0:
+        with ThreadPoolExecutor(max_workers=min(len(s3_keys), MAX_WORKERS)) as executor:
+            for j in executor.map(lambda k: json.loads(s3.get_object(Bucket=s3_bucket, Key=k)["Body"].read().decode()), s3_keys):
+                labels += j
+    labels.sort(key=lambda x: x["Timestamp"])
+
+    checkpoint = max(checkpoints)
+    message = partial_result(format_result({
+            "JobId": progress["JobId"],
+            "API": API_NAME,
+            "Video": progress["Video"],
+            "ModerationLabels": labels
+        }, progress.get("output_format"), progress.get("segment_gap")), checkpoint)
+    if progress.get("sns_topic_arn") is not None:
+        get_client('sns').publish(TopicArn=progress["sns_topic_arn"], Message=json.dumps(message))
+    else:
+        s3.put_object(Body=json.dumps(message), Bucket=s3_bucket, Key=progress_key(progress["s3_target_temp_folder"], checkpoint))
+    print(f"Progress {checkpoint}: {len(labels)} labeled frames")
@@ -0,0 +1,108 @@
+import math
+import os
+from sampling_core.cache import cache_key, fingerprint, open_cache
+from sampling_core.clients import get_client
+from sampling_core.frames import probe_duration
+from sampling_core.metrics import Metrics
+from sampling_core.params import InvalidParameter, bad_request, get_or_default, parse_video_options
+from sampling_core.prescreen import screen_confidence
+from sampling_core.sources import VideoSource, segment_input_mode
+
+DEFAULT_OUTPUT_FOLDER = 'screenshot'
+SAMPLE_FREQUENCY = 0.5 # 1 image every 2 seconds
+SEGMENT_DURATION = 300 # seconds of video extracted by one capture-frames invocation
+REKOGNITION_TPS = 50 # DetectModerationLabels calls per second for the video, shared by the moderation batches
+MODERATE_CONCURRENCY = int(os.environ.get('MODERATE_CONCURRENCY', 10)) # MaxConcurrency of the "Iterate images" Map
+
+def lambda_handler(event, context):
+    metrics = Metrics('plan-segments')
+    # -- Validate input parameters start --
+    try:
+        options = parse_video_options(event, SAMPLE_FREQUENCY, output_folder=DEFAULT_OUTPUT_FOLDER)
+    except InvalidParameter as ex:
+        return bad_request(ex)
+    sample_frequency = options["sample_frequency"]
+    segment_duration = get_or_default(event, "segment_duration", SEGMENT_DURATION)
+    input_mode = options["input_mode"]
+    s3_target_folder = options["s3_target_folder"]
+    # -- Validation end --
+
+    s3 = get_client('s3')
+    # Result cache: on a hit the state machine skips the moderation and consolidation publishes the cached result
+    result_cache_key = None
+    cache_hit = False
+    if options["result_cache"] is not None:
+        try:
+            with metrics.timer("Cache"):
+                result_cache_key = cache_key(fingerprint(s3, options["s3_source_bucket"], options["s3_source_key"]), options)
+                cache_hit = open_cache(options["result_cache"], s3).get(result_cache_key) is not None
+            metrics.count("CacheHits" if cache_hit else "CacheMisses")
+        except Exception as ex:
+            print("Failed to read the result cache:", ex)
+            result_cache_key = None
+
+    # Probe the video duration: ffmpeg only reads the container header, no need to download the video
+    duration = None
+    if not cache_hit:
+        with metrics.timer("Probe"):
+            source = VideoSource(s3, options["s3_source_bucket"], options["s3_source_key"], input_mode=segment_input_mode(input_mode))
+            duration = probe_duration(source.input, input_feeder=source.input_feeder)
+
+    # Segment boundaries on the sampling grid, so fixed rate timestamps are the same as for a single extraction
+    segment_duration = max(math.ceil(segment_duration * sample_frequency), 1) / sample_frequency
+
+    output = event
+    output["sample_frequency"] = sample_frequency
+    output["s3_target_folder"] = s3_target_folder
+    output["s3_target_bucket"] = options["s3_target_bucket"]
+    output["s3_target_temp_folder"] = f"{s3_target_folder}/{options['file_name'].lower()}"
+    # Always set so the moderation batch input can reference them
+    output["min_confidence"] = event.get("min_confidence")
+    # the video budget: densify runs alone, the Map runs up to MODERATE_CONCURRENCY batches at once
+    output["rekognition_tps"] = get_or_default(event, "rekognition_tps", REKOGNITION_TPS)
+    output["batch_rekognition_tps"] = output["rekognition_tps"] / MODERATE_CONCURRENCY
+    output["reject_labels"] = options["reject_labels"]
+    output["borderline_confidence"] = options["borderline_confidence"]
+    output["dense_sample_frequency"] = options["dense_sample_frequency"]
+    output["output_format"] = options["output_format"]
+    output["prescreen_grid"] = options["prescreen_grid"]
+    output["prescreen_confidence"] = None
+    if options["prescreen_grid"] is not None:
+        output["prescreen_confidence"] = screen_confidence(options["min_confidence"], options["prescreen_confidence"], options["borderline_confidence"])
+    output["segment_gap"] = options["segment_gap"]
+    output["reject_min_confidence"] = event.get("reject_min_confidence")
+    output["video_duration"] = duration
+    output["cache_key"] = result_cache_key
+    output["cache_hit"] = cache_hit
+    # Partial results published by the moderation batches, at the checkpoints marked by merge-manifests
+    output["progress"] = None
+    if options["progress_checkpoints"]:
+        output["progress"] = {
+            "checkpoints": options["progress_checkpoints"],
+            "sns_topic_arn": options["sns_topic_arn"],
+            "s3_target_temp_folder": output["s3_target_temp_folder"],
+            "output_format": options["output_format"],
+            "segment_gap": options["segment_gap"],
+            "JobId": options["job_id"],
+            "Video": {
+                "S3Bucket": options["s3_source_bucket"],
+                "S3ObjectName": options["s3_source_key"]
+            }
+        }
+
+    # One capture-frames invocation per time window. The whole video when the duration is unknown.
+    segments = []
+    if cache_hit:
+        print("Result cache hit:", result_cache_key)
+    elif duration is None:
+        segments.append({**event, "segment_start": 0, "segment_duration": None})
+    else:
+        for i in range(max(math.ceil(duration / segment_duration), 1)):
+            segments.append({**event, "segment_start": i * segment_duration, "segment_duration": segment_duration})
+    output["segments"] = segments
+    print(f"Video duration: {duration}s, {len(segments)} segment(s) of {segment_duration}s")
+    metrics.count("Segments", len(segments))
+    if duration is not None:
+        metrics.add("VideoSeconds", duration, 'Seconds')
+    metrics.emit()
+    return output
@@ -0,0 +1,38 @@
+import bisect
+from contextlib import closing
+from sampling_core.frames import EncodingProfile, sampling_filter, stream_frames
+
+DEFAULT_DENSE_WINDOW = 2 # seconds densified before and after a flagged or borderline frame
+DENSE_FILE_PREFIX = 'dense' # results of the dense pass in the Step Functions temp folder
+
+def dense_windows(results, window=DEFAULT_DENSE_WINDOW):
+    # (start, end) seconds around the flagged and borderline frames of the sparse pass,
+    # overlapping windows merged
+    windows = []
+    timestamps = sorted(r["Timestamp"] / 1000 for r in results if len(r["ModerationLabel"]) > 0 or r.get("Borderline"))
+    for t in timestamps:
+        start = max(t - window, 0)
+        if len(windows) > 0 and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], t + window)
+        else:
+            windows.append((start, t + window))
+    return windows
+
+def dense_frames(input_path, windows, dense_sample_frequency, moderated_timestamps, profile=EncodingProfile(), thumbnail_size=None, input_feeder=None):
+    # The dense pass: one seeked ffmpeg run per window, without the frames within half a dense
+    # interval of a frame the sparse pass already moderated
+    moderated = sorted(moderated_timestamps)
+    tolerance = 500 / dense_sample_frequency
+    for start, end in windows:
+        frames = stream_frames(input_path, sampling_filter(dense_sample_frequency),
+            profile=profile,
+            thumbnail_size=thumbnail_size,
+            input_feeder=input_feeder,
+            start=start,
+            duration=end - start)
+        with closing(frames):
+            for frame in frames:
+                i = bisect.bisect_left(moderated, frame.timestamp)
+                if any(abs(moderated[j] - frame.timestamp) < tolerance for j in (i - 1, i) if 0 <= j < len(moderated)):
+                    continue
+                yield frame
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from botocore.exceptions import ClientError
+
+CACHE_SCHEMES = ['s3://', 'sqlite://']
+DEFAULT_CACHE_TTL = 7 * 24 * 3600 # seconds a cached result is reused
+CACHE_VERSION = 1 # bump when the result format changes, to ignore the older entries
+
+def fingerprint(s3, s3_bucket, s3_key):
+    # Content fingerprint of the video: its SHA-256 checksum when it was uploaded with one, its ETag
+    # otherwise (the MD5 of the content, or of its parts for multipart uploads), and its size
+    response = s3.head_object(Bucket=s3_bucket, Key=s3_key, ChecksumMode='ENABLED')
+    return {
+        "Checksum": response.get("ChecksumSHA256") or response["ETag"].strip('"'),
+        "Size": response["ContentLength"]
+    }
+
+def cache_key(video_fingerprint, options):
+    # The fingerprint and the effective options that change the result
+    profile = options["profile"]
+    parameters = {
+        "version": CACHE_VERSION,
+        "video": video_fingerprint,
+        "sample_frequency": options["sample_frequency"],
+        "sampling_mode": options["sampling_mode"],
+        "scene_threshold": options["scene_threshold"],
+        "max_sample_gap": options["max_sample_gap"],
+        "extraction_strategy": options["extraction_strategy"],
+        "image_format": profile.image_format,
+        "image_quality": profile.quality,
+        "max_image_dimension": profile.max_dimension,
+        "min_confidence": options["min_confidence"],
+        "dedup_max_distance": options["dedup_max_distance"],
+        "reject_labels": options["reject_labels"],
+        "reject_min_confidence": options["reject_min_confidence"],
+        "dense_sample_frequency": options["dense_sample_frequency"],
+        "dense_window": options["dense_window"],
+        "borderline_confidence": options["borderline_confidence"],
+        "prescreen_grid": options["prescreen_grid"],
+        "prescreen_confidence": options["prescreen_confidence"]
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+def cacheable(result):
+    # what is stored: the result without what belongs to one job or describes one run
+    return {k: v for k, v in result.items() if k not in ["JobId", "Video", "Metrics", "Cache", "RateLimiting", "Deduplication", "Continuations"]}
+
+class S3Cache:
+    # One JSON object per key, under s3://bucket/prefix
+    def __init__(self, s3, s3_bucket, s3_prefix):
+        self.s3 = s3
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = s3_prefix.strip('/')
+
+    def s3_key(self, key):
+        return f'{self.s3_prefix}/{key}.json' if len(self.s3_prefix) > 0 else f'{key}.json'
+
+    def get(self, key):
+        try:
+            s3_get_response = self.s3.get_object(Bucket=self.s3_bucket, Key=self.s3_key(key))
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] in ['NoSuchKey', '404']:
+                return None
+            raise
+        entry = json.loads(s3_get_response["Body"].read().decode())
+        if entry["Expires"] < time.time():
+            return None
+        return entry["Result"]
+
+    def put(self, key, result, ttl=DEFAULT_CACHE_TTL):
+        entry = {"Expires": time.time() + ttl, "Result": cacheable(result)}
+        self.s3.put_object(Body=json.dumps(entry), Bucket=self.s3_bucket, Key=self.s3_key(key))
+
+class SQLiteCache:
+    # A local file, to run the handlers outside of AWS. On Lambda it only lives as long as the
+    # execution environment: use the S3 cache there.
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires REAL, result TEXT)')
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT expires, result FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return json.loads(row[1])
+
+    def put(self, key, result, ttl=DEFAULT_CACHE_TTL):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                (key, time.time() + ttl, json.dumps(cacheable(result))))
+
+def open_cache(location, s3):
+    # s3://bucket/prefix or sqlite:///path/to/file.db, None when the cache is off
+    if location is None:
+        return None
+    if location.startswith('s3://'):
+        s3_bucket, _, s3_prefix = location[len('s3://'):].partition('/')
+        return S3Cache(s3, s3_bucket, s3_prefix)
+    if location.startswith('sqlite://'):
+        return SQLiteCache(location[len('sqlite://'):])
+    raise ValueError(f'Unsupported result_cache: {location}. Supported: {", ".join(CACHE_SCHEMES)}')
@@ -0,0 +1,23 @@
+import threading
+import boto3
+from botocore.config import Config
+
+# Timeouts for Lambda: a stuck connection fails fast instead of holding the invocation for a minute
+CLIENT_CONFIG = Config(connect_timeout=5, read_timeout=30, retries={'mode': 'standard', 'max_attempts': 3})
+DEFAULT_POOL_SIZE = 10 # botocore default
+
+# (service name, pool size, retries) -> client
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(service_name, max_pool_connections=DEFAULT_POOL_SIZE, retries=None):
+    # Clients are created on first use, not at import time: each Lambda only pays for the
+    # clients it calls, and warm invocations reuse them with their open connections
+    key = (service_name, max_pool_connections, None if retries is None else tuple(sorted(retries.items())))
+    with clients_lock:
+        if key not in clients:
+            config = CLIENT_CONFIG.merge(Config(max_pool_connections=max_pool_connections))
+            if retries is not None:
+                config = config.merge(Config(retries=retries))
+            clients[key] = boto3.client(service_name, config=config)
+        return clients[key]
@@ -0,0 +1,26 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+def bounded_map(executor, fn, items, max_pending):
+    # Submit fn(item) to the executor for each item, keeping at most max_pending
+    # calls in flight so a streaming producer is not drained into memory.
+    # Results are yielded in completion order.
+    pending = set()
+    try:
+        for item in items:
+            pending.add(executor.submit(fn, item))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            else:
+                # hand back the finished calls right away, so the consumer can stop early
+                done = {future for future in pending if future.done()}
+                pending -= done
+            for future in done:
+                yield future.result()
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # the consumer stopped early or a call failed: drop the queued calls
+        for future in pending:
+            future.cancel()
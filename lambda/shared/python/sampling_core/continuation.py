@@ -0,0 +1,53 @@
+import bisect
+import json
+
+DEFAULT_TIME_MARGIN = 60 # seconds kept before the Lambda timeout to finish the frames in flight and save a checkpoint
+# invoke: the function invokes itself with the continuation token, return: the caller passes it back
+CONTINUATION_MODES = ['invoke', 'return']
+CHECKPOINT_FILE = 'checkpoint.json'
+
+class Deadline:
+    # Stops feeding frames when the invocation nears its timeout. Without a Lambda context
+    # (running locally) there is no deadline.
+    def __init__(self, context, margin=DEFAULT_TIME_MARGIN):
+        self.context = context
+        self.margin_millis = margin * 1000
+        self.reached = False
+
+    def near(self):
+        if self.context is None or not hasattr(self.context, 'get_remaining_time_in_millis'):
+            return False
+        return self.context.get_remaining_time_in_millis() < self.margin_millis
+
+    def frames(self, frames):
+        for frame in frames:
+            if self.near():
+                # the frames already handed out are still moderated
+                self.reached = True
+                return
+            yield frame
+
+def checkpoint_key(s3_folder):
+    return f'{s3_folder}/{CHECKPOINT_FILE}'
+
+def save_checkpoint(s3, s3_bucket, s3_key, checkpoint):
+    s3.put_object(Body=json.dumps(checkpoint), Bucket=s3_bucket, Key=s3_key)
+    # the continuation token: where the next invocation finds the checkpoint
+    return {"s3_bucket": s3_bucket, "s3_key": s3_key}
+
+def load_checkpoint(s3, continuation):
+    s3_get_response = s3.get_object(Bucket=continuation["s3_bucket"], Key=continuation["s3_key"])
+    return json.loads(s3_get_response["Body"].read().decode())
+
+def skip_moderated(frames, moderated_timestamps, after=None, tolerance=0):
+    # The frames of a resumed extraction that were not moderated by a previous invocation:
+    # the frames up to after (milliseconds, the seek position) and the frames within
+    # tolerance milliseconds of a moderated frame are skipped
+    moderated = sorted(moderated_timestamps)
+    for frame in frames:
+        if after is not None and frame.timestamp < after + tolerance:
+            continue
+        i = bisect.bisect_left(moderated, frame.timestamp)
+        if any(abs(moderated[j] - frame.timestamp) <= tolerance for j in (i - 1, i) if 0 <= j < len(moderated)):
+            continue
+        yield frame
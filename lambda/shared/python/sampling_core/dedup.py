@@ -0,0 +1,102 @@
+import numpy as np
+
+THUMBNAIL_SIZE = 32 # grayscale thumbnail used to hash a frame
+HASH_SIZE = 8 # low frequencies kept: 8x8 = 64 bits hash
+
+def dct_matrix(n):
+    # orthonormal DCT-II matrix, so a 2D DCT is two matrix products
+    k = np.arange(n).reshape(-1, 1)
+    i = np.arange(n).reshape(1, -1)
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+DCT = dct_matrix(THUMBNAIL_SIZE)
+
+def perceptual_hash(thumbnail):
+    # pHash: compare the low frequency DCT coefficients of the thumbnail to their median
+    pixels = np.frombuffer(thumbnail, dtype=np.uint8).reshape(THUMBNAIL_SIZE, THUMBNAIL_SIZE).astype(np.float64)
+    low_frequencies = (DCT @ pixels @ DCT.T)[0:HASH_SIZE, 0:HASH_SIZE].flatten()
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64)
+
+def hamming_distances(hashes, h):
+    # number of different bits between h and every hash in the array
+    return np.unpackbits((hashes ^ h).view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+class FrameDeduplicator:
+    # Remembers the hash of every moderated frame and flags frames that are
+    # within max_distance bits of one of them, so their labels can be reused
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        self.hashes = np.zeros(1024, dtype=np.uint64)
+        self.timestamps = []
+        self.frames_checked = 0
+        self.calls_saved = 0
+        # skipped frame timestamp -> timestamp of the moderated frame it duplicates
+        self.duplicates = {}
+
+    def find_duplicate(self, timestamp, thumbnail):
+        # Returns the timestamp of the moderated frame this frame duplicates,
+        # or None after recording the frame as one that needs moderation
+        self.frames_checked += 1
+        h = perceptual_hash(thumbnail)
+        count = len(self.timestamps)
+        if count > 0:
+            distances = hamming_distances(self.hashes[0:count], h)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.max_distance:
+                self.calls_saved += 1
+                return self.timestamps[nearest]
+        if count == len(self.hashes):
+            self.hashes = np.concatenate([self.hashes, np.zeros(count, dtype=np.uint64)])
+        self.hashes[count] = h
+        self.timestamps.append(timestamp)
+        return None
+
+    def unique_frames(self, frames):
+        # Yields the frames that need moderation and records the skipped ones
+        for frame in frames:
+            reference = self.find_duplicate(frame.timestamp, frame.thumbnail)
+            if reference is None:
+                yield frame
+            else:
+                self.duplicates[frame.timestamp] = reference
+
+    def reuse_labels(self, labels):
+        # Copies the labels of the moderated frames onto the frames skipped as their duplicates
+        labels_by_timestamp = {l["Timestamp"]: l for l in labels}
+        reused = []
+        for timestamp, reference in self.duplicates.items():
+            if reference in labels_by_timestamp:
+                reused.append({"Timestamp": timestamp, "ModerationLabel": labels_by_timestamp[reference]["ModerationLabel"]})
+        return labels + reused
+
+    def state(self, moderated_timestamps):
+        # kept in the all-in-one checkpoint. The frames recorded but not moderated when the
+        # invocation stopped are left out: the next invocation extracts them again
+        moderated = set(moderated_timestamps)
+        kept = [i for i, timestamp in enumerate(self.timestamps) if timestamp in moderated]
+        duplicates = [[timestamp, reference] for timestamp, reference in self.duplicates.items() if reference in moderated]
+        return {
+            "hashes": [int(self.hashes[i]) for i in kept],
+            "timestamps": [self.timestamps[i] for i in kept],
+            "duplicates": duplicates,
+            "frames_checked": len(kept) + len(duplicates),
+            "calls_saved": len(duplicates)
+        }
+
+    def restore(self, state):
+        self.timestamps = state["timestamps"]
+        self.hashes = np.zeros(max(len(self.timestamps), 1024), dtype=np.uint64)
+        self.hashes[0:len(self.timestamps)] = np.array(state["hashes"], dtype=np.uint64)
+        self.duplicates = {timestamp: reference for timestamp, reference in state["duplicates"]}
+        self.frames_checked = state["frames_checked"]
+        self.calls_saved = state["calls_saved"]
+
+    def stats(self):
+        return {
+            "FramesSampled": self.frames_checked,
+            "FramesModerated": self.frames_checked - self.calls_saved,
+            "CallsSaved": self.calls_saved
+        }
@@ -0,0 +1,334 @@
+import os
+import queue
+import re
+import subprocess
+import threading
+from collections import deque, namedtuple
+
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', '/opt/bin/ffmpeg') # ffmpeg Lambda layer, overridable to run locally
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_END_CHUNK = b'IEND'
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+JPEG_START_OF_SCAN = 0xDA
+READ_CHUNK_SIZE = 64 * 1024
+
+# image format -> (file extension, ffmpeg encoder)
+IMAGE_FORMATS = {
+    'png': ('.png', 'png'),
+    'jpeg': ('.jpg', 'mjpeg')
+}
+DEFAULT_IMAGE_FORMAT = 'png'
+DEFAULT_IMAGE_QUALITY = 90 # JPEG quality, 1-100
+REKOGNITION_MAX_IMAGE_BYTES = 5 * 1024 * 1024 # Rekognition limit for images passed as bytes (15 MB from S3)
+SHRINK_FACTOR = 0.75 # downscale applied to a frame, until it fits in the image size limit
+
+SAMPLING_MODES = ['fixed', 'scene']
+SLOT_EPSILON = 0.000001 # a frame at the start of a sampling slot stays in it despite the float rounding of t / interval
+DEFAULT_SCENE_THRESHOLD = 0.3 # scene change score (0-1) that triggers a sample
+DEFAULT_MAX_SAMPLE_GAP = 10 # seconds without a scene change before a frame is sampled anyway
+
+# full: decode every frame; keyframe: decode only the key frames (I-frames) when they are close enough
+EXTRACTION_STRATEGIES = ['full', 'keyframe']
+KEYFRAME_PROBE_SECONDS = 60 # beginning of the video inspected to measure the key frame interval
+
+# ffmpeg logs the duration of the input when opening it
+DURATION = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+# showinfo logs one line per frame going through the filter graph, with its presentation time
+SHOWINFO_PTS = re.compile(r'Parsed_showinfo.*\bn:\s*\d+\s+pts:\s*-?\d+\s+pts_time:\s*(-?[0-9.]+)')
+
+# How sampled frames are encoded: PNG or JPEG (with a 1-100 quality), downscaled to fit
+# in max_dimension x max_dimension pixels, and shrunk further when larger than max_bytes
+EncodingProfile = namedtuple('EncodingProfile', ['image_format', 'quality', 'max_dimension', 'max_bytes'],
+    defaults=[DEFAULT_IMAGE_FORMAT, DEFAULT_IMAGE_QUALITY, None, REKOGNITION_MAX_IMAGE_BYTES])
+
+def image_extension(profile):
+    return IMAGE_FORMATS[profile.image_format][0]
+
+def encoder_options(profile):
+    encoder = IMAGE_FORMATS[profile.image_format][1]
+    if encoder == 'mjpeg':
+        # map the 1-100 quality to the mjpeg quantizer scale: 31 (worst) - 2 (best)
+        qscale = round(31 - (min(max(profile.quality, 1), 100) - 1) * 29 / 99)
+        return ['-vcodec', 'mjpeg', '-q:v', str(qscale)]
+    return ['-vcodec', encoder]
+
+def scale_filter(max_dimension):
+    # fit in a max_dimension square, keeping the aspect ratio and never upscaling
+    return f"scale=w='min(iw,{max_dimension})':h='min(ih,{max_dimension})':force_original_aspect_ratio=decrease"
+
+# A sampled frame: time position in milliseconds, the encoded image bytes and,
+# when requested, a small grayscale thumbnail (raw 8 bits pixels) of the frame
+Frame = namedtuple('Frame', ['timestamp', 'data', 'thumbnail'], defaults=[None])
+
+def sampling_filter(sample_frequency, sampling_mode='fixed', scene_threshold=None, max_sample_gap=None):
+    # ffmpeg filter selecting the frames to sample
+    if sampling_mode == 'fixed':
+        # the first frame (key frame with the keyframe strategy) of every 1/sample_frequency seconds
+        # slot, so the frames keep their presentation time (fps= moves them onto its output grid,
+        # up to half an interval away) and the rate does not drift with the source frame rate
+        slot = f'floor(t/{1/sample_frequency}+{SLOT_EPSILON})'
+        return f"select='isnan(prev_selected_t)+gt({slot},{slot.replace('t/', 'prev_selected_t/')})'"
+    if sampling_mode == 'scene':
+        # first frame, every scene change and a frame at least every max_sample_gap seconds
+        if scene_threshold is None:
+            scene_threshold = DEFAULT_SCENE_THRESHOLD
+        if max_sample_gap is None:
+            max_sample_gap = DEFAULT_MAX_SAMPLE_GAP
+        return f"select='isnan(prev_selected_t)+gt(scene,{scene_threshold})+gte(t-prev_selected_t,{max_sample_gap})'"
+    raise ValueError(f'Unknown sampling mode: {sampling_mode}. Supported modes: {", ".join(SAMPLING_MODES)}')
+
+def plan_extraction(input_path, sample_frequency, sampling_mode='fixed', scene_threshold=None, max_sample_gap=None, extraction_strategy='full', input_feeder=None):
+    # Picks the ffmpeg filter and decode mode. The keyframe strategy falls back to a full
+    # decode when key frames are further apart than the largest gap allowed between samples.
+    plan = {"strategy": "full"}
+    if extraction_strategy == 'keyframe':
+        keyframe_interval = probe_keyframe_interval(input_path, input_feeder=input_feeder)
+        sample_gap = 1/sample_frequency if sampling_mode == 'fixed' else (max_sample_gap or DEFAULT_MAX_SAMPLE_GAP)
+        plan["keyframe_interval"] = keyframe_interval
+        if keyframe_interval is not None and keyframe_interval <= sample_gap:
+            plan["strategy"] = "keyframe"
+        else:
+            print(f"Key frame interval {keyframe_interval}s is larger than the sample gap {sample_gap}s: decoding all frames")
+    elif extraction_strategy != 'full':
+        raise ValueError(f'Unknown extraction strategy: {extraction_strategy}. Supported strategies: {", ".join(EXTRACTION_STRATEGIES)}')
+    plan["video_filter"] = sampling_filter(sample_frequency, sampling_mode, scene_threshold, max_sample_gap)
+    return plan
+
+def probe_keyframe_interval(input_path, input_feeder=None):
+    # Largest gap (seconds) between two key frames at the beginning of the video,
+    # None when there are not enough key frames to tell
+    cmd = [
+        FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'info',
+        '-skip_frame', 'nokey', '-t', str(KEYFRAME_PROBE_SECONDS), '-i', input_path,
+        '-an', '-fps_mode', 'passthrough', '-vf', 'showinfo', '-f', 'null', '-'
+    ]
+    process = start_ffmpeg(cmd, input_feeder, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    with process.stderr:
+        log = process.stderr.read().decode(errors='replace')
+    process.wait()
+    keyframes = [float(m.group(1)) for m in SHOWINFO_PTS.finditer(log)]
+    if len(keyframes) < 2:
+        return None
+    return max(b - a for a, b in zip(keyframes, keyframes[1:]))
+
+def probe_duration(input_path, input_feeder=None):
+    # Duration of the video in seconds, None when the container does not tell
+    cmd = [FFMPEG_PATH, '-nostdin', '-hide_banner', '-i', input_path]
+    process = start_ffmpeg(cmd, input_feeder, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    with process.stderr:
+        log = process.stderr.read().decode(errors='replace')
+    process.wait()
+    match = DURATION.search(log)
+    if match is None:
+        return None
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+def start_ffmpeg(cmd, input_feeder=None, **kwargs):
+    # Starts ffmpeg. input_feeder, when set, writes the input video to ffmpeg stdin from a background thread.
+    if input_feeder is None:
+        return subprocess.Popen(cmd, **kwargs)
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, **kwargs)
+    threading.Thread(target=input_feeder, args=(process.stdin,), daemon=True).start()
+    return process
+
+def stream_frames(input_path, video_filter, profile=EncodingProfile(), thumbnail_size=None, keyframes_only=False, input_feeder=None, start=None, duration=None):
+    # ffmpeg writes the sampled frames to stdout (image2pipe), so each frame can be
+    # uploaded and moderated while the rest of the video is still being decoded.
+    # Timestamps are the presentation times reported by ffmpeg (showinfo).
+    # start and duration (seconds) restrict the extraction to a window of the video.
+    cmd = [FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'info']
+    if keyframes_only:
+        # the decoder skips every frame that is not a key frame
+        cmd += ['-skip_frame', 'nokey']
+    if start is not None:
+        # input seeking: ffmpeg jumps to the key frame before start and timestamps restart at 0
+        cmd += ['-ss', str(start)]
+    if duration is not None:
+        cmd += ['-t', str(duration)]
+    cmd += ['-i', input_path]
+    if profile.max_dimension is not None:
+        # downscale inside the filter graph, before encoding
+        video_filter += ',' + scale_filter(profile.max_dimension)
+    thumbnail_reader = None
+    if thumbnail_size is None:
+        cmd += ['-vf', f'{video_filter},showinfo']
+    else:
+        # a second output with a thumbnail of every sampled frame, written to another pipe
+        thumbnail_read_fd, thumbnail_write_fd = os.pipe()
+        thumbnail_reader = ThumbnailReader(thumbnail_read_fd, thumbnail_size * thumbnail_size)
+        cmd += [
+            '-filter_complex',
+            f'[0:v]{video_filter},showinfo,split=2[frames][thumbnails];'
+            f'[thumbnails]scale={thumbnail_size}:{thumbnail_size},format=gray[gray]',
+            '-map', '[gray]', '-fps_mode', 'vfr', '-f', 'rawvideo', f'pipe:{thumbnail_write_fd}',
+            '-map', '[frames]'
+        ]
+    # -fps_mode is an output option: vfr on every output, or frames dropped by select are duplicated
+    cmd += ['-fps_mode', 'vfr', '-f', 'image2pipe'] + encoder_options(profile) + ['pipe:1']
+    read_images = read_jpeg_stream if profile.image_format == 'jpeg' else read_png_stream
+
+    if thumbnail_reader is None:
+        process = start_ffmpeg(cmd, input_feeder, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    else:
+        process = start_ffmpeg(cmd, input_feeder, stdout=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=[thumbnail_write_fd])
+        os.close(thumbnail_write_fd)
+        thumbnail_reader.start()
+    log_reader = LogReader(process.stderr)
+    log_reader.start()
+    try:
+        for data in read_images(process.stdout):
+            timestamp = log_reader.next_timestamp()
+            if start is not None:
+                timestamp = round(timestamp + start * 1000, 3)
+            thumbnail = thumbnail_reader.next() if thumbnail_reader is not None else None
+            if profile.max_bytes is not None and len(data) > profile.max_bytes:
+                data = shrink_image(data, profile)
+            yield Frame(timestamp, data, thumbnail)
+        if process.wait() != 0:
+            log_reader.join()
+            raise RuntimeError(f'ffmpeg failed: {log_reader.tail()}')
+    finally:
+        # stop ffmpeg if the consumer stopped early
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        log_reader.join()
+        if thumbnail_reader is not None:
+            thumbnail_reader.join()
+
+def shrink_image(data, profile):
+    # Re-encodes an image with the same profile, smaller and smaller, until it fits in profile.max_bytes
+    scale = 1
+    shrunk = data
+    while len(shrunk) > profile.max_bytes:
+        scale *= SHRINK_FACTOR
+        cmd = [
+            FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'error',
+            '-f', 'image2pipe', '-i', 'pipe:0',
+            '-vf', f'scale=w=trunc(iw*{scale}/2)*2:h=-2',
+            '-frames:v', '1', '-f', 'image2pipe'
+        ] + encoder_options(profile) + ['pipe:1']
+        p = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode != 0 or len(p.stdout) == 0:
+            raise RuntimeError(f'ffmpeg failed to shrink an image: {p.stderr.decode(errors="replace").strip()}')
+        shrunk = p.stdout
+    return shrunk
+
+class LogReader(threading.Thread):
+    # Drains ffmpeg stderr in the background: collects the frame timestamps logged
+    # by showinfo and keeps the last log lines to report errors
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.timestamps = queue.Queue()
+        self.lines = deque(maxlen=20)
+
+    def run(self):
+        with self.stream:
+            for line in self.stream:
+                line = line.decode(errors='replace').rstrip()
+                match = SHOWINFO_PTS.search(line)
+                if match is not None:
+                    # milliseconds
+                    self.timestamps.put(round(float(match.group(1)) * 1000, 3))
+                elif not line.startswith('[Parsed_showinfo'):
+                    self.lines.append(line)
+        self.timestamps.put(None)
+
+    def next_timestamp(self):
+        timestamp = self.timestamps.get()
+        if timestamp is None:
+            raise RuntimeError(f'ffmpeg did not report the timestamp of a frame: {self.tail()}')
+        return timestamp
+
+    def tail(self):
+        return '\n'.join(self.lines)
+
+class ThumbnailReader(threading.Thread):
+    # Drains the thumbnail pipe in the background so ffmpeg never blocks on it
+    def __init__(self, fd, thumbnail_bytes):
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.thumbnail_bytes = thumbnail_bytes
+        self.thumbnails = queue.Queue()
+
+    def run(self):
+        with os.fdopen(self.fd, 'rb') as stream:
+            while True:
+                thumbnail = stream.read(self.thumbnail_bytes)
+                if len(thumbnail) < self.thumbnail_bytes:
+                    break
+                self.thumbnails.put(thumbnail)
+        self.thumbnails.put(None)
+
+    def next(self):
+        thumbnail = self.thumbnails.get()
+        if thumbnail is None:
+            raise RuntimeError('ffmpeg produced fewer thumbnails than frames')
+        return thumbnail
+
+def read_jpeg_stream(stream):
+    # split a stream of concatenated JPEG images: walk the marker segments up to the
+    # start of scan, then look for the end of image marker (a 0xFF byte in the entropy
+    # coded data is always followed by 0x00 or a restart marker)
+    buffer = bytearray()
+    while True:
+        if not fill(stream, buffer, 2):
+            return
+        if buffer[0:2] != JPEG_START:
+            raise ValueError('Unexpected data in the ffmpeg image stream')
+        position = 2
+        while True:
+            if not fill(stream, buffer, position + 4):
+                raise ValueError('Truncated image in the ffmpeg image stream')
+            if buffer[position] != 0xFF:
+                raise ValueError('Unexpected data in the ffmpeg image stream')
+            marker = buffer[position + 1]
+            length = int.from_bytes(buffer[position + 2:position + 4], 'big')
+            position += 2 + length
+            if marker == JPEG_START_OF_SCAN:
+                break
+        end = buffer.find(JPEG_END, position)
+        while end < 0:
+            position = max(position, len(buffer) - 1)
+            if not fill(stream, buffer, len(buffer) + 1):
+                raise ValueError('Truncated image in the ffmpeg image stream')
+            end = buffer.find(JPEG_END, position)
+        end += len(JPEG_END)
+        yield bytes(buffer[0:end])
+        del buffer[0:end]
+
+def fill(stream, buffer, size):
+    # read from the stream until the buffer holds at least size bytes, False at the end of the stream
+    while len(buffer) < size:
+        chunk = stream.read1(READ_CHUNK_SIZE)
+        if len(chunk) == 0:
+            return False
+        buffer += chunk
+    return True
+
+def read_png_stream(stream):
+    # split a stream of concatenated PNG images by walking the PNG chunks
+    while True:
+        signature = stream.read(len(PNG_SIGNATURE))
+        if len(signature) == 0:
+            return
+        if signature != PNG_SIGNATURE:
+            raise ValueError('Unexpected data in the ffmpeg image stream')
+        image = bytearray(signature)
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                raise ValueError('Truncated image in the ffmpeg image stream')
+            # chunk data followed by a 4 bytes CRC
+            length = int.from_bytes(header[0:4], 'big')
+            body = stream.read(length + 4)
+            if len(body) < length + 4:
+                raise ValueError('Truncated image in the ffmpeg image stream')
+            image += header
+            image += body
+            if header[4:8] == PNG_END_CHUNK:
+                break
+        yield bytes(image)
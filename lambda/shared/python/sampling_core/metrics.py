@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = 'VideoModerationImageSampling'
+
+# True until the first invocation of this Lambda execution environment
+cold_start = True
+
+def process_age():
+    # seconds since this process started (Linux /proc), None when unknown
+    try:
+        with open('/proc/self/stat') as f:
+            # fields after the command name, starttime is field 22
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class Metrics:
+    # Stage durations and counters of one invocation, logged as a CloudWatch
+    # Embedded Metric Format line so CloudWatch extracts them as metrics
+    def __init__(self, function_name, namespace=METRICS_NAMESPACE):
+        self.function_name = function_name
+        self.namespace = namespace
+        # name -> [value, unit]
+        self.values = {}
+        self.lock = threading.Lock()
+        global cold_start
+        if cold_start:
+            # runtime start and imports, until the first invocation
+            cold_start = False
+            self.count("ColdStart")
+            init_seconds = process_age()
+            if init_seconds is not None:
+                self.add("InitSeconds", init_seconds, 'Seconds')
+
+    def add(self, name, value, unit='Count'):
+        # Accumulates: durations of calls made by worker threads add up
+        with self.lock:
+            if name in self.values:
+                self.values[name][0] += value
+            else:
+                self.values[name] = [value, unit]
+
+    def count(self, name, value=1):
+        self.add(name, value, 'Count')
+
+    def set(self, name, value, unit='Count'):
+        with self.lock:
+            self.values[name] = [value, unit]
+
+    @contextmanager
+    def timer(self, stage):
+        # with metrics.timer("Download"): ... records DownloadSeconds
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f'{stage}Seconds', time.perf_counter() - start, 'Seconds')
+
+    def get(self, name, default=0):
+        with self.lock:
+            return self.values[name][0] if name in self.values else default
+
+    def throughput(self, name, count_name, stage):
+        # count per second of the stage wall time, e.g. FramesPerSecond
+        seconds = self.get(f'{stage}Seconds')
+        if seconds > 0:
+            self.set(name, self.get(count_name) / seconds, 'Count/Second')
+
+    def summary(self):
+        with self.lock:
+            return {name: round(value, 3) if isinstance(value, float) else value for name, (value, unit) in self.values.items()}
+
+    def emit(self):
+        with self.lock:
+            metrics = [{"Name": name, "Unit": unit} for name, (value, unit) in self.values.items()]
+            log = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Function"]],
+                        "Metrics": metrics
+                    }]
+                },
+                "Function": self.function_name
+            }
+            for name, (value, unit) in self.values.items():
+                log[name] = value
+        print(json.dumps(log))
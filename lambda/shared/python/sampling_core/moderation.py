@@ -0,0 +1,53 @@
+DEFAULT_MIN_CONFIDENCE = 50
+
+def moderate_image(rekognition, image, timestamp, min_confidence=DEFAULT_MIN_CONFIDENCE, limiter=None, borderline_confidence=None):
+    # image: {'Bytes': ...} or {'S3Object': {'Bucket': ..., 'Name': ...}}
+    # borderline_confidence: labels between it and min_confidence are not returned, they only
+    # mark the result as "Borderline" (adaptive sampling densifies around it)
+    request_confidence = min_confidence
+    if borderline_confidence is not None:
+        request_confidence = min(min_confidence, borderline_confidence)
+    if limiter is not None:
+        detectModerationLabelsResponse = limiter.call(rekognition.detect_moderation_labels,
+            Image=image,
+            MinConfidence=request_confidence)
+    else:
+        detectModerationLabelsResponse = rekognition.detect_moderation_labels(
+            Image=image,
+            MinConfidence=request_confidence)
+    result = {"Timestamp": timestamp, "ModerationLabel": []}
+    for l in detectModerationLabelsResponse["ModerationLabels"]:
+        if l["Confidence"] < min_confidence:
+            result["Borderline"] = True
+            continue
+        result["ModerationLabel"].append(
+            {
+                "Confidence": l["Confidence"],
+                "Name": l["Name"],
+                "ParentName": l["ParentName"]
+            }
+        )
+    return result
+
+def rejection(moderation_result, reject_labels, reject_min_confidence):
+    # The first label matching the reject criteria: its name or its top level category
+    # (ParentName) is in reject_labels, with at least reject_min_confidence. None otherwise.
+    if not reject_labels:
+        return None
+    for l in moderation_result["ModerationLabel"]:
+        if (l["Name"] in reject_labels or l["ParentName"] in reject_labels) and l["Confidence"] >= reject_min_confidence:
+            return {"Timestamp": moderation_result["Timestamp"], "ModerationLabel": l}
+    return None
+
+def add_verdict(result, reject_labels, rejected):
+    # Reject fast mode: REJECT with the matching label, ACCEPT once the whole video is moderated,
+    # or INCOMPLETE when no label matched but some frames could not be moderated (FailedFrames)
+    if reject_labels:
+        if rejected is not None:
+            result["Verdict"] = "REJECT"
+            result["Rejection"] = rejected
+        elif len(result.get("FailedFrames", [])) > 0:
+            result["Verdict"] = "INCOMPLETE"
+        else:
+            result["Verdict"] = "ACCEPT"
+    return result
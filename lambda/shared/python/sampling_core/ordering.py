@@ -0,0 +1,47 @@
+import os
+from collections import deque
+from sampling_core.frames import Frame
+
+FRAME_ORDERS = ['timeline', 'coarse_to_fine']
+DEFAULT_COARSE_LEVELS = 4 # the first pass moderates 1 frame in 2^4
+
+def frame_level(index, levels=DEFAULT_COARSE_LEVELS):
+    # Binary subdivision of the timeline: level 0 is every 2^levels-th frame, each next
+    # level halves the gaps left by the previous ones, the odd frames come last
+    if index == 0:
+        return 0
+    trailing_zeros = (index & -index).bit_length() - 1
+    return max(levels - trailing_zeros, 0)
+
+def coarse_to_fine_order(items, levels=DEFAULT_COARSE_LEVELS):
+    # A timeline (list) sorted level by level, in timeline order within a level
+    order = sorted(range(len(items)), key=lambda i: (frame_level(i, levels), i))
+    return [items[i] for i in order]
+
+def coarse_to_fine(frames, spill_dir, levels=DEFAULT_COARSE_LEVELS):
+    # Streamed version: the level 0 frames are yielded as soon as ffmpeg decodes them, the finer
+    # frames wait in spill_dir until the whole video is decoded, then come level by level
+    os.makedirs(spill_dir, exist_ok=True)
+    waiting = []
+    try:
+        for index, frame in enumerate(frames):
+            level = frame_level(index, levels)
+            if level == 0:
+                yield frame
+                continue
+            path = os.path.join(spill_dir, f'{index}.frame')
+            with open(path, 'wb') as f:
+                f.write(frame.data)
+            waiting.append((level, index, frame.timestamp, frame.thumbnail, path))
+        waiting = deque(sorted(waiting, key=lambda w: (w[0], w[1])))
+        while len(waiting) > 0:
+            level, index, timestamp, thumbnail, path = waiting.popleft()
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.remove(path)
+            yield Frame(timestamp, data, thumbnail)
+    finally:
+        # stopped early: drop the frames left on disk
+        for level, index, timestamp, thumbnail, path in waiting:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,65 @@
+import json
+
+# frames: ModerationLabels, one entry per flagged frame. segments: ModerationSegments, the
+# consecutive flagged frames carrying the same label merged
+OUTPUT_FORMATS = ['frames', 'segments']
+SEGMENT_GAP_INTERVALS = 1.5 # default gap between two frames of a segment, in sampling intervals
+SNS_MAX_MESSAGE_BYTES = 256 * 1024
+RESULTS_FOLDER = 'results' # full results too large for an SNS message
+
+def label_segments(labels, max_gap):
+    # A frame extends the segment of its label when it comes at most max_gap milliseconds
+    # after the last frame of the segment, a new segment starts otherwise
+    last_segment = {}
+    segments = []
+    for frame in sorted(labels, key=lambda l: l["Timestamp"]):
+        timestamp = frame["Timestamp"]
+        for l in frame["ModerationLabel"]:
+            segment = last_segment.get((l["Name"], l["ParentName"]))
+            if segment is None or timestamp - segment["EndMs"] > max_gap:
+                segment = {
+                    "Name": l["Name"],
+                    "ParentName": l["ParentName"],
+                    "StartMs": timestamp,
+                    "EndMs": timestamp,
+                    "MaxConfidence": l["Confidence"],
+                    "FrameCount": 0
+                }
+                last_segment[(l["Name"], l["ParentName"])] = segment
+                segments.append(segment)
+            segment["EndMs"] = timestamp
+            segment["MaxConfidence"] = max(segment["MaxConfidence"], l["Confidence"])
+            segment["FrameCount"] += 1
+    segments.sort(key=lambda s: (s["StartMs"], s["Name"]))
+    return segments
+
+def format_result(result, output_format, segment_gap):
+    # segment_gap: seconds. ModerationSegments takes the place of ModerationLabels
+    if output_format != 'segments' or "ModerationLabels" not in result:
+        return result
+    formatted = {}
+    for k, v in result.items():
+        if k == "ModerationLabels":
+            formatted["ModerationSegments"] = label_segments(v, segment_gap * 1000)
+        else:
+            formatted[k] = v
+    return formatted
+
+def result_key(s3_folder, job_id):
+    return f'{s3_folder}/{RESULTS_FOLDER}/{job_id}.json'
+
+def offload(result, s3, s3_bucket, s3_key):
+    # A result over the SNS message limit is written to S3. The message is then a pointer:
+    # the result without its labels and failed frames, and the location of the full result
+    message = json.dumps(result)
+    if len(message.encode()) <= SNS_MAX_MESSAGE_BYTES:
+        return result
+    s3.put_object(Body=message, Bucket=s3_bucket, Key=s3_key)
+    pointer = {k: v for k, v in result.items() if k not in ["ModerationLabels", "ModerationSegments", "FailedFrames"]}
+    if "FailedFrames" in result:
+        pointer["FailedFrameCount"] = len(result["FailedFrames"])
+    pointer["ResultLocation"] = {
+        "S3Bucket": s3_bucket,
+        "S3ObjectName": s3_key
+    }
+    return pointer
@@ -0,0 +1,148 @@
+from sampling_core.adaptive import DEFAULT_DENSE_WINDOW
+from sampling_core.cache import CACHE_SCHEMES, DEFAULT_CACHE_TTL
+from sampling_core.frames import DEFAULT_IMAGE_FORMAT, DEFAULT_IMAGE_QUALITY, EXTRACTION_STRATEGIES, IMAGE_FORMATS, SAMPLING_MODES, EncodingProfile
+from sampling_core.moderation import DEFAULT_MIN_CONFIDENCE
+from sampling_core.ordering import DEFAULT_COARSE_LEVELS, FRAME_ORDERS
+from sampling_core.output import OUTPUT_FORMATS, SEGMENT_GAP_INTERVALS
+from sampling_core.sources import INPUT_MODES
+
+class InvalidParameter(ValueError):
+    pass
+
+def bad_request(ex):
+    return {
+        'statusCode': 400,
+        'body': str(ex)
+    }
+
+def get_or_default(event, name, default):
+    value = event.get(name)
+    return default if value is None else value
+
+def positive_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+def choice(event, name, choices, default, kind):
+    value = event.get(name, default)
+    if value not in choices:
+        raise InvalidParameter(f'Unsupported {name}: {value}. Supported {kind}: {", ".join(choices)}.')
+    return value
+
+def video_job_id(s3_source_bucket, s3_source_key, job_id=None):
+    # The job id of a video: built from its location, or from the batch job_id and its key in batch mode
+    prefix = job_id if job_id is not None and len(job_id) > 0 else s3_source_bucket
+    return f'{prefix}_{s3_source_key}'.replace('/','_').replace('.','_')
+
+def batch_video(event, s3_source_key):
+    # The options of one video of a batch: its key, its job id and, when the batch sets s3_target_folder,
+    # a sub folder per source folder, so that videos with the same file name under different prefixes
+    # do not share their images, checkpoint and temp files.
+    video = {
+        "s3_source_key": s3_source_key,
+        "job_id": video_job_id(event["s3_source_bucket"], s3_source_key, event.get("job_id"))
+    }
+    s3_target_folder = event.get("s3_target_folder")
+    if s3_target_folder is not None:
+        folders = [s3_target_folder.rstrip('/')] + s3_source_key.split('/')[0:-1]
+        video["s3_target_folder"] = '/'.join(f for f in folders if len(f) > 0)
+    return video
+
+def parse_video_options(event, sample_frequency, output_folder=None):
+    # The video and sampling options shared by the handlers, with their defaults.
+    # sample_frequency: the handler default. output_folder: sub folder of the video folder used
+    # when s3_target_folder is not set. Raises InvalidParameter.
+    if event is None or "s3_source_bucket" not in event or "s3_source_key" not in event:
+        raise InvalidParameter('Require parameters: s3_source_bucket and s3_source_key.')
+    s3_source_bucket = event["s3_source_bucket"]
+    s3_source_key = event["s3_source_key"]
+    file_name = s3_source_key.split('/')[-1]
+
+    # Encoding profile of the sampled images: png or jpeg, quality (jpeg), max width/height in pixels
+    profile = EncodingProfile(
+        image_format=event.get("image_format", DEFAULT_IMAGE_FORMAT),
+        quality=event.get("image_quality", DEFAULT_IMAGE_QUALITY),
+        max_dimension=event.get("max_image_dimension"))
+    if profile.image_format not in IMAGE_FORMATS:
+        raise InvalidParameter(f'Unsupported image_format: {profile.image_format}. Supported formats: {", ".join(IMAGE_FORMATS)}.')
+
+    s3_target_folder = event.get("s3_target_folder")
+    if s3_target_folder is None:
+        s3_target_folder = '/'.join(s3_source_key.split('/')[0:-1])
+        if output_folder is not None:
+            s3_target_folder = f"{s3_target_folder}/{output_folder}"
+    s3_target_folder = s3_target_folder.rstrip('/')
+
+    min_confidence = get_or_default(event, "min_confidence", DEFAULT_MIN_CONFIDENCE)
+    # reject fast mode: stop at the first label with one of these names or top level categories
+    reject_labels = event.get("reject_labels")
+    if reject_labels is not None and not isinstance(reject_labels, list):
+        raise InvalidParameter('reject_labels must be a list of label names or categories.')
+
+    # publish partial results once these fractions of the frames are moderated
+    progress_checkpoints = event.get("progress_checkpoints")
+    if progress_checkpoints is not None and (not isinstance(progress_checkpoints, list) or any(not 0 < c < 1 for c in progress_checkpoints)):
+        raise InvalidParameter('progress_checkpoints must be a list of fractions between 0 and 1.')
+
+    # contact sheet prescreen: grid x grid frames moderated as one mosaic image first
+    prescreen_grid = event.get("prescreen_grid")
+    if prescreen_grid is not None and (not isinstance(prescreen_grid, int) or prescreen_grid < 2):
+        raise InvalidParameter('prescreen_grid must be an integer of at least 2.')
+
+    # reuse the result of a video with the same content and options
+    result_cache = event.get("result_cache")
+    if result_cache is not None and not any(result_cache.startswith(scheme) for scheme in CACHE_SCHEMES):
+        raise InvalidParameter(f'Unsupported result_cache: {result_cache}. Supported: {", ".join(CACHE_SCHEMES)}')
+
+    job_id = event.get("job_id")
+    if job_id is None or len(job_id) == 0:
+        job_id = video_job_id(s3_source_bucket, s3_source_key)
+
+    sample_frequency = get_or_default(event, "sample_frequency", sample_frequency)
+    if not positive_number(sample_frequency):
+        raise InvalidParameter('sample_frequency must be a positive number.')
+    dense_sample_frequency = event.get("dense_sample_frequency")
+    if dense_sample_frequency is not None and not positive_number(dense_sample_frequency):
+        raise InvalidParameter('dense_sample_frequency must be a positive number.')
+    options = {
+        "s3_source_bucket": s3_source_bucket,
+        "s3_source_key": s3_source_key,
+        "file_name": file_name,
+        "s3_target_bucket": get_or_default(event, "s3_target_bucket", s3_source_bucket),
+        "s3_target_folder": s3_target_folder,
+        "sample_frequency": sample_frequency,
+        # frames: one entry per flagged frame, segments: consecutive flagged frames with the same label merged
+        "output_format": choice(event, "output_format", OUTPUT_FORMATS, "frames", "formats"),
+        # seconds between two frames of a segment, 1.5 sampling intervals by default
+        "segment_gap": get_or_default(event, "segment_gap", SEGMENT_GAP_INTERVALS / sample_frequency),
+        # fixed: sample_frequency images per second, scene: sample on scene changes
+        "sampling_mode": choice(event, "sampling_mode", SAMPLING_MODES, "fixed", "modes"),
+        "scene_threshold": event.get("scene_threshold"),
+        "max_sample_gap": event.get("max_sample_gap"),
+        "profile": profile,
+        # download: download the video first, url/pipe: ffmpeg reads the video from S3 while decoding
+        "input_mode": choice(event, "input_mode", INPUT_MODES, "download", "modes"),
+        # full: decode all frames, keyframe: decode only the key frames when they are close enough
+        "extraction_strategy": choice(event, "extraction_strategy", EXTRACTION_STRATEGIES, "full", "strategies"),
+        # timeline: moderate frames in video order, coarse_to_fine: a sparse pass over the whole video first
+        "frame_order": choice(event, "frame_order", FRAME_ORDERS, "timeline", "orders"),
+        "coarse_levels": get_or_default(event, "coarse_levels", DEFAULT_COARSE_LEVELS),
+        "progress_checkpoints": progress_checkpoints,
+        "min_confidence": min_confidence,
+        # adaptive sampling: moderate again at this frequency around the flagged and borderline frames
+        "dense_sample_frequency": dense_sample_frequency,
+        "dense_window": get_or_default(event, "dense_window", DEFAULT_DENSE_WINDOW),
+        "borderline_confidence": event.get("borderline_confidence"),
+        "reject_labels": reject_labels,
+        "reject_min_confidence": get_or_default(event, "reject_min_confidence", min_confidence),
+        "prescreen_grid": prescreen_grid,
+        "prescreen_confidence": event.get("prescreen_confidence"),
+        # skip frames within this Hamming distance of an already moderated frame (perceptual hash)
+        "dedup_max_distance": event.get("dedup_max_distance"),
+        "sns_topic_arn": event.get("sns_topic_arn"),
+        "result_cache": result_cache,
+        "cache_ttl": get_or_default(event, "cache_ttl", DEFAULT_CACHE_TTL),
+        "job_id": job_id,
+        # add the stage durations and counters to the result
+        "metrics_summary": event.get("metrics_summary", False)
+    }
+    return options
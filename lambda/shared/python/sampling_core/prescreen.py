@@ -0,0 +1,38 @@
+import subprocess
+from sampling_core.frames import FFMPEG_PATH
+
+MOSAIC_MAX_DIMENSION = 1920 # pixels, width and height of a contact sheet
+MOSAIC_QUALITY = 3 # mjpeg quantizer scale, 2 (best) - 31
+PRESCREEN_CONFIDENCE_FACTOR = 0.5 # default prescreen_confidence, a fraction of min_confidence
+
+def groups(items, size):
+    # consecutive items, size at a time: the frames of one contact sheet
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if len(group) > 0:
+        yield group
+
+def make_mosaic(images, grid, max_dimension=MOSAIC_MAX_DIMENSION):
+    # Tiles up to grid x grid images (PNG or JPEG bytes, all the same size) into one JPEG contact
+    # sheet, each image downscaled to fit in a max_dimension / grid square
+    tile = max_dimension // grid
+    cmd = [FFMPEG_PATH, '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-f', 'image2pipe', '-i', 'pipe:0',
+        '-vf', f"scale=w='min(iw,{tile})':h='min(ih,{tile})':force_original_aspect_ratio=decrease,tile={grid}x{grid}",
+        '-frames:v', '1', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-q:v', str(MOSAIC_QUALITY), 'pipe:1']
+    p = subprocess.run(cmd, input=b''.join(images), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0 or len(p.stdout) == 0:
+        raise RuntimeError(f'ffmpeg failed to tile {len(images)} images: {p.stderr.decode(errors="replace")}')
+    return p.stdout
+
+def screen_confidence(min_confidence, prescreen_confidence=None, borderline_confidence=None):
+    # Labels of a contact sheet with at least this confidence send its frames to individual
+    # moderation: downscaled frames score lower, and borderline frames must not be missed
+    confidence = prescreen_confidence if prescreen_confidence is not None else min_confidence * PRESCREEN_CONFIDENCE_FACTOR
+    if borderline_confidence is not None:
+        confidence = min(confidence, borderline_confidence)
+    return confidence
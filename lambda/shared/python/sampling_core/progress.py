@@ -0,0 +1,55 @@
+import math
+
+PROGRESS_FILE_PREFIX = 'progress'
+
+class Progress:
+    # Counts the sampled and the moderated frames and tells when a checkpoint, a fraction of
+    # the sampled frames moderated, is reached. The total is known once the video is decoded,
+    # until then the checkpoints count from the expected total, when there is one
+    def __init__(self, checkpoints=None, expected=None):
+        self.checkpoints = sorted(checkpoints or [])
+        self.sampled = 0
+        self.total = None
+        self.expected = expected
+        self.moderated = 0
+
+    def count(self, frames):
+        for frame in frames:
+            self.sampled += 1
+            yield frame
+        self.total = self.sampled
+
+    def frame_moderated(self):
+        # the last checkpoint reached with this frame, None if no new checkpoint
+        self.moderated += 1
+        reached = None
+        total = self.total if self.total is not None else self.expected
+        while total is not None and len(self.checkpoints) > 0 and self.moderated >= self.checkpoints[0] * total:
+            reached = self.checkpoints.pop(0)
+        return reached
+
+    def state(self):
+        # kept in the all-in-one checkpoint, the total is not known yet. The frames sampled
+        # but not moderated when the invocation stopped are sampled again by the next one
+        return {"moderated": self.moderated, "checkpoints": self.checkpoints}
+
+    def restore(self, state):
+        self.sampled = state["moderated"]
+        self.moderated = state["moderated"]
+        self.checkpoints = state["checkpoints"]
+
+def expected_frames(duration, sample_frequency):
+    # frames sampled at a fixed rate from a video of duration seconds, one per 1/sample_frequency slot
+    return max(math.ceil(duration * sample_frequency), 1)
+
+def checkpoint_ranks(total, checkpoints):
+    # rank (position in the moderation order) of the frame completing each checkpoint
+    return {max(math.ceil(c * total), 1) - 1: c for c in sorted(checkpoints or [])}
+
+def partial_result(result, progress):
+    # the result message, flagged as partial: the labels found in the first frames moderated
+    return {**result, "Partial": True, "Progress": progress}
+
+def progress_key(s3_folder, progress):
+    # where partial results are written when there is no SNS topic
+    return f'{s3_folder}/{PROGRESS_FILE_PREFIX}-{round(progress * 100)}.json'
@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+THROTTLING_ERRORS = ['ThrottlingException', 'ProvisionedThroughputExceededException']
+RETRYABLE_ERRORS = ['InternalServerError'] # retried without slowing down, as any 5xx error
+# connection errors, connect and read timeouts: botocore does not retry them with LIMITED_CLIENT_RETRIES
+RETRYABLE_EXCEPTIONS = (ConnectionError, HTTPClientError)
+MAX_RETRIES = 6
+MAX_TRANSIENT_RETRIES = 2 # retries of the errors that are not throttles, as botocore standard mode
+MIN_TPS = 0.5
+INCREASE_STEP = 1 # additive increase: TPS gained per second of calls without throttling
+DECREASE_FACTOR = 0.5 # multiplicative decrease on throttling
+DECREASE_COOLDOWN = 1 # seconds: the throttles of calls already in flight only count once
+
+# Botocore config for clients called through a RateLimiter: the limiter retries, so throttles are not hidden by botocore retries
+# (max_attempts 1 turns off every botocore retry, the limiter also retries the transient errors)
+LIMITED_CLIENT_RETRIES = {'mode': 'standard', 'max_attempts': 1}
+
+def server_error(ex):
+    code = ex.response.get("Error", {}).get("Code")
+    return code in RETRYABLE_ERRORS or ex.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+
+def backoff(attempt):
+    # jittered exponential backoff of the transient errors
+    time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+
+class RateLimiter:
+    # Token bucket shared by the threads calling an API. The rate starts at the TPS budget,
+    # is halved on throttling and grows back linearly (AIMD), never above the budget.
+    def __init__(self, tps, burst=1):
+        self.max_rate = tps
+        self.rate = tps
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.decreased = 0
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+        self.wait_seconds = 0
+
+    def acquire(self):
+        # Reserve a token, then sleep until it is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.wait_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.calls += 1
+            # rate calls per second: INCREASE_STEP TPS gained per second
+            self.rate = min(self.max_rate, self.rate + INCREASE_STEP / self.rate)
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self.decreased >= DECREASE_COOLDOWN:
+                self.decreased = now
+                self.rate = max(MIN_TPS, self.rate * DECREASE_FACTOR)
+
+    def call(self, fn, *args, **kwargs):
+        # fn(*args, **kwargs) paced by the bucket, retried on throttling and on transient errors
+        throttled = 0
+        failed = 0
+        while True:
+            self.acquire()
+            try:
+                response = fn(*args, **kwargs)
+            except ClientError as ex:
+                code = ex.response.get("Error", {}).get("Code")
+                if code in THROTTLING_ERRORS and throttled < MAX_RETRIES:
+                    # the bucket paces the throttled retries
+                    throttled += 1
+                    self.on_throttle()
+                    continue
+                if code in THROTTLING_ERRORS or not server_error(ex) or failed >= MAX_TRANSIENT_RETRIES:
+                    raise
+                failed += 1
+                backoff(failed)
+                continue
+            except RETRYABLE_EXCEPTIONS:
+                if failed >= MAX_TRANSIENT_RETRIES:
+                    raise
+                failed += 1
+                backoff(failed)
+                continue
+            self.on_success()
+            return response
+
+    def stats(self):
+        return {
+            "Calls": self.calls,
+            "Throttles": self.throttles,
+            "WaitSeconds": round(self.wait_seconds, 3),
+            "Tps": round(self.rate, 2)
+        }
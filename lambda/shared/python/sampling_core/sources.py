@@ -0,0 +1,78 @@
+import os
+
+# download: the whole video is downloaded to local disk before decoding starts
+# url: ffmpeg reads the video from a presigned URL, seeking with HTTP range requests
+# pipe: ranged GETs are written to ffmpeg stdin (the video must be streamable, e.g. MP4 with faststart)
+INPUT_MODES = ['download', 'url', 'pipe']
+PRESIGNED_URL_EXPIRATION = 3600 # seconds
+RANGE_SIZE = 8 * 1024 * 1024 # bytes requested per GET in pipe mode
+WRITE_CHUNK_SIZE = 1024 * 1024
+# keys moderated in batch mode, the other objects under the prefix (e.g. sampled images) are skipped
+VIDEO_EXTENSIONS = ['.mp4', '.mov', '.m4v', '.mkv', '.webm', '.avi', '.wmv', '.flv', '.mpg', '.mpeg', '.ts']
+
+def segment_input_mode(input_mode):
+    # a time window of the video: ffmpeg seeks in a presigned URL rather than each window
+    # downloading the whole video. pipe is kept when requested.
+    return 'pipe' if input_mode == 'pipe' else 'url'
+
+def is_video(s3_key):
+    return os.path.splitext(s3_key)[1].lower() in VIDEO_EXTENSIONS
+
+def list_videos(s3, s3_bucket, s3_prefix, start_after=''):
+    # The video files under the prefix, in key order
+    s3_keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_bucket, Prefix=s3_prefix, StartAfter=start_after):
+        s3_keys += [c["Key"] for c in page.get("Contents", []) if is_video(c["Key"])]
+    return s3_keys
+
+class VideoSource:
+    # The S3 video ffmpeg decodes, read according to the input mode
+    def __init__(self, s3, s3_bucket, s3_key, input_mode='download', local_dir='/tmp'):
+        if input_mode not in INPUT_MODES:
+            raise ValueError(f'Unknown input mode: {input_mode}. Supported modes: {", ".join(INPUT_MODES)}')
+        self.s3 = s3
+        self.s3_bucket = s3_bucket
+        self.s3_key = s3_key
+        self.input_mode = input_mode
+        self.local_file_path = None
+        self.input_feeder = None
+        if input_mode == 'download':
+            # Download video to local disk
+            self.local_file_path = f'{local_dir}/{s3_key.split("/")[-1]}'
+            s3.download_file(s3_bucket, s3_key, self.local_file_path)
+            self.input = self.local_file_path
+        elif input_mode == 'url':
+            self.input = s3.generate_presigned_url('get_object',
+                Params={'Bucket': s3_bucket, 'Key': s3_key},
+                ExpiresIn=PRESIGNED_URL_EXPIRATION)
+        else:
+            self.input = 'pipe:0'
+            self.input_feeder = self.write_ranges
+
+    def write_ranges(self, stdin):
+        # Writes the video to ffmpeg stdin, one ranged GET at a time, so decoding starts on the first bytes
+        position = 0
+        size = None
+        try:
+            while size is None or position < size:
+                response = self.s3.get_object(Bucket=self.s3_bucket, Key=self.s3_key,
+                    Range=f'bytes={position}-{position + RANGE_SIZE - 1}')
+                # Content-Range: bytes start-end/size
+                size = int(response["ContentRange"].split('/')[-1])
+                for chunk in response["Body"].iter_chunks(WRITE_CHUNK_SIZE):
+                    stdin.write(chunk)
+                    position += len(chunk)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg stopped reading: it has all it needs or it was stopped
+            pass
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def close(self):
+        # Delete local video file
+        if self.local_file_path is not None and os.path.exists(self.local_file_path):
+            os.remove(self.local_file_path)
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# the shared Lambda layer, on the path as /opt/python is on Lambda
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'shared', 'python'))
+
+import pytest
+
+from benchmark.fakes import FakeLambda, FakeRekognition, FakeS3, FakeSNS
+
+@pytest.fixture
+def fakes(tmp_path):
+    # in memory AWS services for the handlers loaded with benchmark.pipelines.load_handler
+    s3 = FakeS3(str(tmp_path))
+    return {"s3": s3, "rekognition": FakeRekognition(s3), "sns": FakeSNS(), "lambda": FakeLambda()}
@@ -0,0 +1,18 @@
+from sampling_core.adaptive import dense_windows
+
+def result(timestamp, flagged=False, borderline=False):
+    r = {"Timestamp": timestamp, "ModerationLabel": [{"Name": "Nudity"}] if flagged else []}
+    if borderline:
+        r["Borderline"] = True
+    return r
+
+def test_windows_around_flagged_and_borderline_frames():
+    results = [result(0), result(10000, flagged=True), result(20000), result(30000, borderline=True)]
+    assert dense_windows(results, 2) == [(8, 12), (28, 32)]
+
+def test_overlapping_windows_merge():
+    results = [result(4000, flagged=True), result(1000, flagged=True), result(6000, flagged=True)]
+    assert dense_windows(results, 2) == [(0, 8)]
+
+def test_no_window_without_flagged_frames():
+    assert dense_windows([result(0), result(1000)]) == []
@@ -0,0 +1,56 @@
+import shutil
+
+import pytest
+
+from benchmark.pipelines import load_handler
+from benchmark.videos import generate_video
+from sampling_core.frames import FFMPEG_PATH
+
+pytestmark = pytest.mark.skipif(shutil.which(FFMPEG_PATH) is None, reason='needs ffmpeg')
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    # 4 seconds, a red box from 2s to the end
+    return generate_video(4, '160x120', flagged_every=4, video_dir=str(tmp_path_factory.mktemp('videos')))
+
+def moderate(fakes, tmp_path, video, **options):
+    fakes['s3'].add_file('bucket', 'videos/intro.mp4', video)
+    fakes['rekognition'].label_images = True
+    handler = load_handler('all-in-one', fakes, str(tmp_path))
+    return handler.lambda_handler({"s3_source_bucket": "bucket", "s3_source_key": "videos/intro.mp4", "sample_frequency": 1, **options}, None)
+
+def test_frames_moderated_from_bytes(fakes, tmp_path, video):
+    response = moderate(fakes, tmp_path, video)
+    assert [l["Timestamp"] for l in response["body"]["ModerationLabels"]] == [2000, 3000]
+    assert fakes['rekognition'].api.calls['DetectModerationLabels'] == 4
+    # only the flagged frames are uploaded, as evidence
+    keys = fakes['s3'].list_keys('bucket', 'videos/intro.mp4/')
+    assert [float(k.split('/')[-1][:-len('.png')]) for k in keys] == [2000, 3000]
+
+def test_archive_frames_uploads_every_frame(fakes, tmp_path, video):
+    moderate(fakes, tmp_path, video, archive_frames=True)
+    assert len(fakes['s3'].list_keys('bucket', 'videos/intro.mp4/')) == 4
+
+def moderate_batch(fakes, tmp_path, video, **batch):
+    for key in ['in/a/intro.mp4', 'in/b/intro.mp4']:
+        fakes['s3'].add_file('bucket', key, video)
+    fakes['s3'].objects[('bucket', 'in/notes.txt')] = b''
+    fakes['rekognition'].label_images = True
+    handler = load_handler('all-in-one', fakes, str(tmp_path))
+    return handler.lambda_handler({"s3_source_bucket": "bucket", "sample_frequency": 1, "sns_topic_arn": "topic", **batch}, None)
+
+def test_batch_videos_with_their_own_folder(fakes, tmp_path, video):
+    response = moderate_batch(fakes, tmp_path, video, s3_source_prefix='in/', s3_target_folder='temp', job_id='backfill')
+    results = [r["body"] for r in response["body"]["Results"]]
+    assert [r["JobId"] for r in results] == ['backfill_in_a_intro_mp4', 'backfill_in_b_intro_mp4']
+    assert sorted(m["JobId"] for m in fakes['sns'].messages) == ['backfill_in_a_intro_mp4', 'backfill_in_b_intro_mp4']
+    # the same file name under two prefixes: the flagged frames are kept apart
+    assert len(fakes['s3'].list_keys('bucket', 'temp/in/a/intro.mp4/')) == 2
+    assert len(fakes['s3'].list_keys('bucket', 'temp/in/b/intro.mp4/')) == 2
+
+def test_batch_failed_video_is_published(fakes, tmp_path, video):
+    response = moderate_batch(fakes, tmp_path, video, s3_source_keys=['in/a/intro.mp4', 'in/missing.mp4'])
+    failed = response["body"]["Results"][1]
+    assert failed["statusCode"] == 500
+    assert failed["body"]["JobId"] == 'bucket_in_missing_mp4'
+    assert failed["body"] in fakes['sns'].messages
@@ -0,0 +1,38 @@
+import time
+
+from sampling_core import cache
+from sampling_core.cache import cache_key, cacheable, open_cache
+from sampling_core.params import parse_video_options
+
+FINGERPRINT = {"Checksum": "d41d8cd98f00b204e9800998ecf8427e", "Size": 1024}
+
+def options(**event):
+    return parse_video_options({"s3_source_bucket": "bucket", "s3_source_key": "videos/video.mp4", **event}, 1)
+
+def test_cache_key_is_stable():
+    assert cache_key(FINGERPRINT, options()) == cache_key(FINGERPRINT, options())
+
+def test_cache_key_changes_with_the_options():
+    assert cache_key(FINGERPRINT, options()) != cache_key(FINGERPRINT, options(min_confidence=80))
+    assert cache_key(FINGERPRINT, options()) != cache_key({**FINGERPRINT, "Size": 2048}, options())
+
+def test_cache_key_ignores_the_job():
+    # the same video under another key, another job id or topic reuses the result
+    assert cache_key(FINGERPRINT, options()) == cache_key(FINGERPRINT, options(s3_source_key="other/video.mp4", job_id="job", sns_topic_arn="arn:aws:sns:us-east-1:123456789012:topic"))
+
+def test_cacheable_keeps_only_the_result():
+    result = {"JobId": "job", "ModerationLabels": [], "Verdict": "ACCEPT", "Metrics": {}, "Cache": "MISS", "RateLimiting": {}, "Deduplication": {}, "Continuations": 2, "Video": {}}
+    assert cacheable(result) == {"ModerationLabels": [], "Verdict": "ACCEPT"}
+
+def test_sqlite_cache(tmp_path):
+    results = open_cache(f'sqlite://{tmp_path}/cache.db', None)
+    assert results.get('key') is None
+    results.put('key', {"JobId": "job", "ModerationLabels": []})
+    assert results.get('key') == {"ModerationLabels": []}
+
+def test_sqlite_cache_expires(tmp_path, monkeypatch):
+    results = open_cache(f'sqlite://{tmp_path}/cache.db', None)
+    results.put('key', {"ModerationLabels": []}, ttl=60)
+    now = time.time()
+    monkeypatch.setattr(cache.time, 'time', lambda: now + 61)
+    assert results.get('key') is None
@@ -0,0 +1,39 @@
+import json
+
+from benchmark.pipelines import load_handler
+
+PAYLOAD = {"s3_source_bucket": "bucket", "s3_source_key": "videos/intro.mp4", "s3_target_bucket": "bucket",
+    "s3_target_folder": "videos/screenshot", "job_id": "job"}
+
+def put_json(fakes, key, value):
+    fakes['s3'].objects[('bucket', key)] = json.dumps(value).encode()
+
+def test_lists_and_deletes_the_temp_files_by_pages(fakes, tmp_path):
+    for i in range(2500):
+        fakes['s3'].objects[('bucket', f'videos/screenshot/intro.mp4/{i}.png')] = b''
+    fakes['s3'].objects[('bucket', 'videos/intro.mp4')] = b''
+    handler = load_handler('consolidation', fakes, str(tmp_path))
+    response = handler.lambda_handler({"Payload": PAYLOAD}, None)
+    assert response["body"]["JobId"] == 'job'
+    # 1000 keys per listing page and per DeleteObjects request
+    assert fakes['s3'].api.calls['ListObjectsV2'] == 3
+    assert fakes['s3'].api.calls['DeleteObjects'] == 3
+    assert fakes['s3'].list_keys('bucket', 'videos/') == ['videos/intro.mp4']
+
+def test_reads_the_results_from_the_result_writer_manifest(fakes, tmp_path):
+    temp = 'videos/screenshot/intro.mp4'
+    outputs = [
+        {"Results": [{"Timestamp": 2000, "ModerationLabel": [{"Name": "Violence", "Confidence": 90}]},
+            {"Timestamp": 0, "ModerationLabel": []}], "Failures": []},
+        {"Results": [], "Failures": [{"Key": f'{temp}/1000.png', "Timestamp": 1000, "Error": "ClientError", "Cause": ""}]}
+    ]
+    put_json(fakes, f'{temp}/map-run/SUCCEEDED_0.json', [{"Output": json.dumps(o)} for o in outputs])
+    put_json(fakes, f'{temp}/map-run/manifest.json', {"DestinationBucket": "bucket",
+        "ResultFiles": {"SUCCEEDED": [{"Key": f'{temp}/map-run/SUCCEEDED_0.json'}], "FAILED": []}})
+    handler = load_handler('consolidation', fakes, str(tmp_path))
+    response = handler.lambda_handler({"Payload": PAYLOAD,
+        "MapRun": {"ResultWriterDetails": {"Bucket": "bucket", "Key": f'{temp}/map-run/manifest.json'}}}, None)
+    result = response["body"]
+    assert [l["Timestamp"] for l in result["ModerationLabels"]] == [2000]
+    assert result["FailedFrames"] == [{"Timestamp": 1000, "Error": "ClientError"}]
+    assert fakes['s3'].list_keys('bucket', temp) == []
@@ -0,0 +1,68 @@
+import io
+
+from sampling_core.continuation import Deadline, checkpoint_key, load_checkpoint, save_checkpoint, skip_moderated
+from sampling_core.frames import Frame
+
+def frames(timestamps):
+    return [Frame(t, b'', None) for t in timestamps]
+
+def timestamps(frames):
+    return [f.timestamp for f in frames]
+
+def test_resume_after_the_last_frame_done():
+    # the seek restarts at the last frame done, its neighbours within tolerance are skipped
+    resumed = skip_moderated(frames([2000, 2400, 3000, 4000]), [0, 1000, 2000], after=2000, tolerance=500)
+    assert timestamps(resumed) == [3000, 4000]
+
+def test_resume_keeps_a_frame_just_past_the_tolerance():
+    resumed = skip_moderated(frames([2000, 2500, 2501, 3000]), [2000], after=2000, tolerance=500)
+    assert timestamps(resumed) == [2501, 3000]
+
+def test_resume_skips_the_frames_done_anywhere():
+    # coarse to fine order: the whole video is extracted again, the moderated frames are skipped
+    resumed = skip_moderated(frames(range(0, 9000, 1000)), [0, 4000, 8000, 2000])
+    assert timestamps(resumed) == [1000, 3000, 5000, 6000, 7000]
+
+def test_resume_tolerance_around_moderated_frames():
+    resumed = skip_moderated(frames([999.5, 1000.5, 1002, 3000]), [1000], tolerance=1)
+    assert timestamps(resumed) == [1002, 3000]
+
+class Context:
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+def test_no_deadline_without_context():
+    deadline = Deadline(None)
+    assert timestamps(deadline.frames(frames([0, 1000]))) == [0, 1000]
+    assert not deadline.reached
+
+def test_deadline_stops_feeding_frames():
+    context = Context(120000)
+    deadline = Deadline(context, margin=60)
+    fed = []
+    for frame in deadline.frames(frames([0, 1000, 2000, 3000])):
+        fed.append(frame.timestamp)
+        if frame.timestamp == 1000:
+            context.remaining_millis = 59000
+    assert fed == [0, 1000]
+    assert deadline.reached
+
+class MemoryS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode()
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+def test_checkpoint_round_trip():
+    s3 = MemoryS3()
+    checkpoint = {"phase": "sparse", "moderated_timestamps": [0, 1000], "continuations": 1}
+    token = save_checkpoint(s3, 'bucket', checkpoint_key('videos/screenshots'), checkpoint)
+    assert token == {"s3_bucket": "bucket", "s3_key": "videos/screenshots/checkpoint.json"}
+    assert load_checkpoint(s3, token) == checkpoint
@@ -0,0 +1,50 @@
+import numpy as np
+
+from sampling_core.dedup import THUMBNAIL_SIZE, FrameDeduplicator
+from sampling_core.frames import Frame
+
+def thumbnail(seed):
+    # a random grayscale image, a duplicate of the same seed
+    return np.random.default_rng(seed).integers(0, 256, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), dtype=np.uint8).tobytes()
+
+def noisy(seed):
+    # the same image with a little noise, as after a new encoding
+    pixels = np.frombuffer(thumbnail(seed), dtype=np.uint8).astype(np.int16) + np.random.default_rng(100 + seed).integers(-2, 3, THUMBNAIL_SIZE * THUMBNAIL_SIZE)
+    return np.clip(pixels, 0, 255).astype(np.uint8).tobytes()
+
+def test_near_duplicates_are_skipped():
+    dedup = FrameDeduplicator(6)
+    frames = [Frame(0, b'', thumbnail(1)), Frame(500, b'', noisy(1)), Frame(1000, b'', thumbnail(2))]
+    assert [f.timestamp for f in dedup.unique_frames(frames)] == [0, 1000]
+    assert dedup.duplicates == {500: 0}
+    assert dedup.stats() == {"FramesSampled": 3, "FramesModerated": 2, "CallsSaved": 1}
+
+def test_labels_are_reused():
+    dedup = FrameDeduplicator(6)
+    list(dedup.unique_frames([Frame(0, b'', thumbnail(1)), Frame(500, b'', thumbnail(1))]))
+    labels = [{"Timestamp": 0, "ModerationLabel": [{"Name": "Nudity"}]}]
+    assert dedup.reuse_labels(labels)[1] == {"Timestamp": 500, "ModerationLabel": [{"Name": "Nudity"}]}
+
+def test_hashes_grow_past_their_initial_size():
+    dedup = FrameDeduplicator(0)
+    thumbnails = [thumbnail(seed) for seed in range(1025)]
+    assert all(dedup.find_duplicate(i, t) is None for i, t in enumerate(thumbnails))
+    assert dedup.find_duplicate(2000, thumbnails[1024]) == 1024
+
+def test_state_leaves_out_the_frames_not_moderated():
+    dedup = FrameDeduplicator(6)
+    list(dedup.unique_frames([Frame(0, b'', thumbnail(1)), Frame(500, b'', thumbnail(1)), Frame(1000, b'', thumbnail(2)), Frame(1500, b'', thumbnail(2))]))
+    # the invocation stopped before the frame at 1000 was moderated
+    state = dedup.state([0])
+    assert state["timestamps"] == [0]
+    assert state["duplicates"] == [[500, 0]]
+    assert (state["frames_checked"], state["calls_saved"]) == (2, 1)
+
+def test_restored_state_finds_the_duplicates():
+    dedup = FrameDeduplicator(6)
+    list(dedup.unique_frames([Frame(0, b'', thumbnail(1)), Frame(500, b'', thumbnail(1))]))
+    restored = FrameDeduplicator(6)
+    restored.restore(dedup.state([0]))
+    assert restored.find_duplicate(1000, noisy(1)) == 0
+    assert restored.find_duplicate(1500, thumbnail(2)) is None
+    assert restored.stats() == {"FramesSampled": 4, "FramesModerated": 2, "CallsSaved": 2}
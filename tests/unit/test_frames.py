@@ -0,0 +1,85 @@
+import io
+import pytest
+
+from sampling_core.frames import PNG_SIGNATURE, SHOWINFO_PTS, EncodingProfile, encoder_options, read_jpeg_stream, read_png_stream, sampling_filter
+
+class ChunkedStream:
+    # a pipe: read1 returns at most chunk_size bytes, whatever is asked
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.position = 0
+        self.chunk_size = chunk_size
+
+    def read1(self, size=-1):
+        chunk = self.data[self.position:self.position + min(size, self.chunk_size)]
+        self.position += len(chunk)
+        return chunk
+
+def segment(marker, payload):
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+def jpeg(seed):
+    # an APP0 segment holding an end of image marker, a start of scan and entropy coded data
+    # with stuffed 0xFF bytes and a restart marker, then the end of image
+    return (b'\xff\xd8'
+        + segment(0xE0, b'JFIF\x00\xff\xd9' + bytes([seed]))
+        + segment(0xDA, b'\x01\x02\x03')
+        + bytes([seed, 0xFF, 0x00, seed, 0xFF, 0xD0, seed, seed])
+        + b'\xff\xd9')
+
+def png(seed):
+    chunks = [(b'IHDR', bytes([seed]) * 13), (b'IDAT', b'\xff\xd9IEND' + bytes([seed])), (b'IEND', b'')]
+    return PNG_SIGNATURE + b''.join(len(data).to_bytes(4, 'big') + kind + data + b'\x00\x00\x00\x00' for kind, data in chunks)
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64 * 1024])
+def test_read_jpeg_stream_splits_at_any_chunk_boundary(chunk_size):
+    images = [jpeg(i) for i in range(5)]
+    assert list(read_jpeg_stream(ChunkedStream(b''.join(images), chunk_size))) == images
+
+def test_read_jpeg_stream_empty():
+    assert list(read_jpeg_stream(ChunkedStream(b'', 3))) == []
+
+def test_read_jpeg_stream_truncated():
+    with pytest.raises(ValueError):
+        list(read_jpeg_stream(ChunkedStream(jpeg(1) + jpeg(2)[:-1], 5)))
+
+def test_read_jpeg_stream_unexpected_data():
+    with pytest.raises(ValueError):
+        list(read_jpeg_stream(ChunkedStream(jpeg(1) + b'garbage', 5)))
+
+def test_read_png_stream():
+    images = [png(i) for i in range(3)]
+    assert list(read_png_stream(io.BytesIO(b''.join(images)))) == images
+
+def test_read_png_stream_empty():
+    assert list(read_png_stream(io.BytesIO(b''))) == []
+
+def test_read_png_stream_truncated():
+    with pytest.raises(ValueError):
+        list(read_png_stream(io.BytesIO(png(1)[:-3])))
+
+def test_read_png_stream_unexpected_data():
+    with pytest.raises(ValueError):
+        list(read_png_stream(io.BytesIO(png(1) + b'garbage')))
+
+def test_jpeg_quality_maps_to_the_quantizer_scale():
+    assert encoder_options(EncodingProfile('jpeg', 100)) == ['-vcodec', 'mjpeg', '-q:v', '2']
+    assert encoder_options(EncodingProfile('jpeg', 1)) == ['-vcodec', 'mjpeg', '-q:v', '31']
+    assert encoder_options(EncodingProfile('jpeg', 500)) == ['-vcodec', 'mjpeg', '-q:v', '2']
+
+def test_png_has_no_quality():
+    assert encoder_options(EncodingProfile('png', 50)) == ['-vcodec', 'png']
+
+def test_fixed_sampling_keeps_one_frame_per_slot():
+    assert sampling_filter(0.5) == "select='isnan(prev_selected_t)+gt(floor(t/2.0+1e-06),floor(prev_selected_t/2.0+1e-06))'"
+
+def test_scene_sampling_defaults():
+    assert sampling_filter(1, 'scene') == "select='isnan(prev_selected_t)+gt(scene,0.3)+gte(t-prev_selected_t,10)'"
+
+def test_unknown_sampling_mode():
+    with pytest.raises(ValueError):
+        sampling_filter(1, 'random')
+
+def test_showinfo_timestamp():
+    line = '[Parsed_showinfo_1 @ 0x7fb80c003140] n:  14 pts: 430080 pts_time:28.96   duration:    512 duration_time:0.0333333 fmt:yuv420p'
+    assert SHOWINFO_PTS.search(line).group(1) == '28.96'
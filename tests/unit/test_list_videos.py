@@ -0,0 +1,29 @@
+import json
+
+from benchmark.pipelines import load_handler
+
+def read_videos(fakes, response):
+    return json.loads(fakes['s3'].get('bucket', response["s3_manifest_key"]))
+
+def test_videos_under_the_prefix(fakes, tmp_path):
+    for key in ['in/a/intro.mp4', 'in/a/intro.mp4.json', 'in/b/intro.MOV', 'in/b/screenshot/0.png']:
+        fakes['s3'].objects[('bucket', key)] = b''
+    handler = load_handler('list-videos', fakes, str(tmp_path))
+    response = handler.lambda_handler({"s3_source_bucket": "bucket", "s3_source_prefix": "in/",
+        "options": {"job_id": "backfill", "s3_target_folder": "temp"}}, None)
+    assert response["videos"] == 2
+    assert read_videos(fakes, response) == [
+        {"s3_source_bucket": "bucket", "s3_source_key": "in/a/intro.mp4", "job_id": "backfill_in_a_intro_mp4", "s3_target_folder": "temp/in/a"},
+        {"s3_source_bucket": "bucket", "s3_source_key": "in/b/intro.MOV", "job_id": "backfill_in_b_intro_MOV", "s3_target_folder": "temp/in/b"}
+    ]
+
+def test_videos_of_the_key_list(fakes, tmp_path):
+    handler = load_handler('list-videos', fakes, str(tmp_path))
+    response = handler.lambda_handler({"s3_source_bucket": "bucket", "s3_source_keys": ["a.mp4", "notes.txt"]}, None)
+    # without options: the job id is built from the location, the target folder is left to the video state machine
+    assert read_videos(fakes, response) == [{"s3_source_bucket": "bucket", "s3_source_key": "a.mp4", "job_id": "bucket_a_mp4"}]
+
+def test_prefix_or_keys(fakes, tmp_path):
+    handler = load_handler('list-videos', fakes, str(tmp_path))
+    assert handler.lambda_handler({"s3_source_bucket": "bucket"}, None)["statusCode"] == 400
+    assert handler.lambda_handler({"s3_source_bucket": "bucket", "s3_source_prefix": "", "s3_source_keys": []}, None)["statusCode"] == 400
@@ -0,0 +1,26 @@
+import json
+
+from benchmark.pipelines import load_handler
+
+def merge(fakes, tmp_path, **payload):
+    # two segments, their manifests in the order the capture-frames invocations finished
+    segments = [[{"Key": f'temp/{t}.png', "Timestamp": t} for t in range(start, start + 4000, 1000)] for start in [4000, 0]]
+    for i, frames in enumerate(segments):
+        fakes['s3'].objects[('bucket', f'temp/frames-{i}.json')] = json.dumps(frames).encode()
+    handler = load_handler('merge-manifests', fakes, str(tmp_path))
+    response = handler.lambda_handler({"Payload": {"s3_target_bucket": "bucket", "s3_target_temp_folder": "temp", **payload},
+        "Segments": [{"s3_manifest_key": f'temp/frames-{i}.json'} for i in range(len(segments))]}, None)
+    assert response["frames"] == 8
+    return json.loads(fakes['s3'].get('bucket', response["s3_manifest_key"]))
+
+def test_frames_in_timeline_order(fakes, tmp_path):
+    assert [f["Timestamp"] for f in merge(fakes, tmp_path)] == list(range(0, 8000, 1000))
+
+def test_frames_in_coarse_to_fine_order(fakes, tmp_path):
+    frames = merge(fakes, tmp_path, frame_order='coarse_to_fine', coarse_levels=2)
+    assert [f["Timestamp"] // 1000 for f in frames] == [0, 4, 2, 6, 1, 3, 5, 7]
+
+def test_checkpoint_marked_on_the_frame_completing_it(fakes, tmp_path):
+    frames = merge(fakes, tmp_path, frame_order='coarse_to_fine', coarse_levels=2, progress={"checkpoints": [0.5, 0.25]})
+    # in the moderation order: the 2nd frame completes 25%, the 4th 50%
+    assert [(f["Timestamp"], f["Checkpoint"]) for f in frames if "Checkpoint" in f] == [(4000, 0.25), (6000, 0.5)]
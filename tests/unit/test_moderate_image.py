@@ -0,0 +1,20 @@
+from benchmark.pipelines import load_handler
+
+def batch(keys):
+    return {"Items": [{"Key": k, "Timestamp": i * 1000} for i, k in enumerate(keys)],
+        "BatchInput": {"s3_bucket": "bucket", "rekognition_tps": 1000}}
+
+def test_failed_images_are_reported_per_item(fakes, tmp_path):
+    fakes['s3'].objects[('bucket', 'temp/0.png')] = b''
+    fakes['s3'].objects[('bucket', 'temp/2.png')] = b''
+    handler = load_handler('moderate-image', fakes, str(tmp_path))
+    response = handler.lambda_handler(batch(['temp/0.png', 'temp/1.png', 'temp/2.png']), None)
+    # the missing image fails alone, the rest of the batch is moderated
+    assert sorted(r["Timestamp"] for r in response["Results"]) == [0, 2000]
+    assert len(response["Failures"]) == 1
+    failure = response["Failures"][0]
+    assert (failure["Key"], failure["Timestamp"], failure["Error"]) == ('temp/1.png', 1000, 'ClientError')
+
+def test_missing_batch_input(fakes, tmp_path):
+    handler = load_handler('moderate-image', fakes, str(tmp_path))
+    assert handler.lambda_handler({"Items": []}, None)["statusCode"] == 400
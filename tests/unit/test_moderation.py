@@ -0,0 +1,21 @@
+from sampling_core.moderation import add_verdict
+
+REJECTED = {"Timestamp": 1000, "ModerationLabel": {"Name": "Nudity", "ParentName": "Explicit Nudity", "Confidence": 90.0}}
+
+def test_rejected():
+    result = add_verdict({"ModerationLabels": []}, ["Explicit Nudity"], REJECTED)
+    assert (result["Verdict"], result["Rejection"]) == ("REJECT", REJECTED)
+
+def test_accepted_once_every_frame_is_moderated():
+    assert add_verdict({"ModerationLabels": []}, ["Explicit Nudity"], None)["Verdict"] == "ACCEPT"
+
+def test_incomplete_when_frames_failed():
+    result = {"ModerationLabels": [], "FailedFrames": [{"Timestamp": 0, "Error": "ClientError"}]}
+    assert add_verdict(result, ["Explicit Nudity"], None)["Verdict"] == "INCOMPLETE"
+
+def test_a_rejection_stands_despite_failed_frames():
+    result = {"ModerationLabels": [], "FailedFrames": [{"Timestamp": 0, "Error": "ClientError"}]}
+    assert add_verdict(result, ["Explicit Nudity"], REJECTED)["Verdict"] == "REJECT"
+
+def test_no_verdict_without_reject_labels():
+    assert "Verdict" not in add_verdict({"ModerationLabels": []}, None, None)
@@ -0,0 +1,40 @@
+import os
+
+from sampling_core.frames import Frame
+from sampling_core.ordering import coarse_to_fine, coarse_to_fine_order, frame_level
+
+def test_frame_level():
+    assert [frame_level(i, 2) for i in range(9)] == [0, 2, 1, 2, 0, 2, 1, 2, 0]
+
+def test_frame_level_past_the_coarsest_level():
+    assert frame_level(32, 2) == 0
+
+def test_coarse_to_fine_order():
+    assert coarse_to_fine_order(list(range(9)), 2) == [0, 4, 8, 2, 6, 1, 3, 5, 7]
+
+def frames(count):
+    return [Frame(i * 500, bytes([i]), None) for i in range(count)]
+
+def test_streamed_order_matches(tmp_path):
+    ordered = list(coarse_to_fine(iter(frames(11)), str(tmp_path), 2))
+    assert ordered == coarse_to_fine_order(frames(11), 2)
+    assert os.listdir(tmp_path) == []
+
+def test_coarse_frames_come_before_the_video_is_decoded(tmp_path):
+    decoded = []
+
+    def decode():
+        for frame in frames(9):
+            decoded.append(frame.timestamp)
+            yield frame
+
+    ordered = coarse_to_fine(decode(), str(tmp_path), 2)
+    assert next(ordered).timestamp == 0
+    assert next(ordered).timestamp == 2000
+    assert decoded == [0, 500, 1000, 1500, 2000]
+
+def test_stopped_early_removes_the_spilled_frames(tmp_path):
+    ordered = coarse_to_fine(iter(frames(9)), str(tmp_path), 2)
+    assert [next(ordered).timestamp for _ in range(4)] == [0, 2000, 4000, 1000]
+    ordered.close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,57 @@
+import json
+
+from sampling_core.output import SNS_MAX_MESSAGE_BYTES, format_result, label_segments, offload
+
+def frame(timestamp, *labels):
+    return {"Timestamp": timestamp, "ModerationLabel": [{"Name": name, "ParentName": parent, "Confidence": confidence} for name, parent, confidence in labels]}
+
+VIOLENCE = ("Graphic Violence Or Gore", "Violence", 90.0)
+NUDITY = ("Nudity", "Explicit Nudity", 80.0)
+
+def test_consecutive_frames_merge():
+    segments = label_segments([frame(0, VIOLENCE), frame(1000, ("Graphic Violence Or Gore", "Violence", 95.0)), frame(2000, VIOLENCE)], 1500)
+    assert segments == [{"Name": "Graphic Violence Or Gore", "ParentName": "Violence", "StartMs": 0, "EndMs": 2000, "MaxConfidence": 95.0, "FrameCount": 3}]
+
+def test_gap_splits_a_segment():
+    segments = label_segments([frame(0, VIOLENCE), frame(1000, VIOLENCE), frame(5000, VIOLENCE)], 1500)
+    assert [(s["StartMs"], s["EndMs"], s["FrameCount"]) for s in segments] == [(0, 1000, 2), (5000, 5000, 1)]
+
+def test_gap_equal_to_max_gap_merges():
+    segments = label_segments([frame(0, VIOLENCE), frame(1500, VIOLENCE)], 1500)
+    assert len(segments) == 1
+
+def test_labels_have_their_own_segments():
+    # unsorted frames, a frame with two labels
+    segments = label_segments([frame(2000, NUDITY), frame(0, VIOLENCE, NUDITY), frame(1000, VIOLENCE)], 1500)
+    assert [(s["Name"], s["StartMs"], s["EndMs"]) for s in segments] == [("Graphic Violence Or Gore", 0, 1000), ("Nudity", 0, 0), ("Nudity", 2000, 2000)]
+
+def test_format_frames_keeps_the_result():
+    result = {"JobId": "job", "ModerationLabels": [frame(0, VIOLENCE)]}
+    assert format_result(result, 'frames', 3) is result
+
+def test_format_segments_replaces_the_labels_in_place():
+    result = {"JobId": "job", "ModerationLabels": [frame(0, VIOLENCE), frame(2000, VIOLENCE)], "Verdict": "ACCEPT"}
+    formatted = format_result(result, 'segments', 3)
+    assert list(formatted) == ["JobId", "ModerationSegments", "Verdict"]
+    assert formatted["ModerationSegments"][0]["EndMs"] == 2000
+
+class RecordingS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+def test_small_result_is_not_offloaded():
+    s3 = RecordingS3()
+    result = {"JobId": "job", "ModerationLabels": [frame(0, VIOLENCE)]}
+    assert offload(result, s3, 'bucket', 'results/job.json') is result
+    assert s3.objects == {}
+
+def test_large_result_is_offloaded():
+    s3 = RecordingS3()
+    labels = [frame(i * 500, VIOLENCE) for i in range(SNS_MAX_MESSAGE_BYTES // 100)]
+    result = {"JobId": "job", "ModerationLabels": labels, "FailedFrames": [{"Timestamp": 0, "Error": "ClientError"}]}
+    pointer = offload(result, s3, 'bucket', 'results/job.json')
+    assert pointer == {"JobId": "job", "FailedFrameCount": 1, "ResultLocation": {"S3Bucket": "bucket", "S3ObjectName": "results/job.json"}}
+    assert json.loads(s3.objects[('bucket', 'results/job.json')]) == result
@@ -0,0 +1,40 @@
+import pytest
+
+from sampling_core.params import InvalidParameter, bad_request, batch_video, parse_video_options
+
+VIDEO = {"s3_source_bucket": "bucket", "s3_source_key": "videos/intro.mp4"}
+
+def test_defaults():
+    options = parse_video_options(VIDEO, 0.5)
+    assert options["sample_frequency"] == 0.5
+    assert options["segment_gap"] == 3
+    assert options["s3_target_folder"] == 'videos'
+    assert options["job_id"] == 'bucket_videos_intro_mp4'
+
+def test_missing_video():
+    with pytest.raises(InvalidParameter):
+        parse_video_options({"s3_source_bucket": "bucket"}, 1)
+
+@pytest.mark.parametrize('sample_frequency', [0, -1, "2", True])
+def test_sample_frequency_is_a_positive_number(sample_frequency):
+    with pytest.raises(InvalidParameter) as ex:
+        parse_video_options({**VIDEO, "sample_frequency": sample_frequency}, 1)
+    assert bad_request(ex.value) == {'statusCode': 400, 'body': 'sample_frequency must be a positive number.'}
+
+def test_dense_sample_frequency_is_a_positive_number():
+    with pytest.raises(InvalidParameter):
+        parse_video_options({**VIDEO, "dense_sample_frequency": 0}, 1)
+
+def test_unsupported_choice():
+    with pytest.raises(InvalidParameter):
+        parse_video_options({**VIDEO, "sampling_mode": "random"}, 1)
+
+def test_batch_video_job_id():
+    assert batch_video({"s3_source_bucket": "bucket"}, "a/intro.mp4") == {"s3_source_key": "a/intro.mp4", "job_id": "bucket_a_intro_mp4"}
+    assert batch_video({"s3_source_bucket": "bucket", "job_id": "backfill"}, "a/intro.mp4")["job_id"] == "backfill_a_intro_mp4"
+
+def test_batch_video_target_folder_per_source_folder():
+    event = {"s3_source_bucket": "bucket", "s3_target_folder": "temp/"}
+    assert batch_video(event, "a/intro.mp4")["s3_target_folder"] == "temp/a"
+    assert batch_video(event, "b/intro.mp4")["s3_target_folder"] == "temp/b"
+    assert batch_video(event, "intro.mp4")["s3_target_folder"] == "temp"
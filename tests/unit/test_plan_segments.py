@@ -0,0 +1,27 @@
+import pytest
+
+from benchmark.pipelines import load_handler
+
+VIDEO = {"s3_source_bucket": "bucket", "s3_source_key": "videos/intro.mp4"}
+
+def plan(fakes, tmp_path, duration, **options):
+    fakes['s3'].objects[('bucket', 'videos/intro.mp4')] = b''
+    handler = load_handler('plan-segments', fakes, str(tmp_path))
+    # no ffmpeg run: the duration found in the container header
+    handler.probe_duration = lambda input_path, input_feeder=None: duration
+    return handler.lambda_handler({**VIDEO, **options}, None)
+
+@pytest.mark.parametrize('duration, starts', [(604, [0, 302]), (604.5, [0, 302, 604]), (1, [0])])
+def test_segment_boundaries_on_the_sampling_grid(fakes, tmp_path, duration, starts):
+    # 301 seconds at 0.5 images per second: rounded up to 151 sampling intervals
+    output = plan(fakes, tmp_path, duration, sample_frequency=0.5, segment_duration=301)
+    assert [s["segment_start"] for s in output["segments"]] == starts
+    assert all(s["segment_duration"] == 302 for s in output["segments"])
+
+def test_whole_video_when_the_duration_is_unknown(fakes, tmp_path):
+    output = plan(fakes, tmp_path, None)
+    assert [(s["segment_start"], s["segment_duration"]) for s in output["segments"]] == [(0, None)]
+
+def test_rekognition_budget_shared_by_the_moderation_batches(fakes, tmp_path):
+    output = plan(fakes, tmp_path, 60, rekognition_tps=20)
+    assert output["batch_rekognition_tps"] == 20 / 10
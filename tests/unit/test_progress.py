@@ -0,0 +1,40 @@
+from sampling_core.progress import Progress, checkpoint_ranks, expected_frames
+
+def test_checkpoints_wait_for_the_total():
+    progress = Progress([0.5])
+    frames = progress.count(iter(range(4)))
+    next(frames)
+    assert progress.frame_moderated() is None
+    list(frames)
+    assert progress.frame_moderated() == 0.5
+
+def test_checkpoints_count_from_the_expected_total():
+    progress = Progress([0.25, 0.5], expected=4)
+    assert [progress.frame_moderated() for _ in range(3)] == [0.25, 0.5, None]
+
+def test_the_total_replaces_the_expected_total():
+    progress = Progress([0.5], expected=10)
+    list(progress.count(iter(range(2))))
+    assert progress.frame_moderated() == 0.5
+
+def test_several_checkpoints_reached_by_one_frame():
+    progress = Progress([0.1, 0.2])
+    list(progress.count(iter(range(2))))
+    assert progress.frame_moderated() == 0.2
+
+def test_restore_continues_the_count():
+    # one frame moderated before the total was known
+    progress = Progress([0.25, 0.75])
+    progress.frame_moderated()
+    restored = Progress()
+    restored.restore(progress.state())
+    # the next invocation samples the 3 frames left
+    list(restored.count(iter(range(3))))
+    assert [restored.frame_moderated() for _ in range(3)] == [0.25, 0.75, None]
+
+def test_expected_frames():
+    assert expected_frames(10.5, 2) == 21
+    assert expected_frames(0.1, 0.5) == 1
+
+def test_checkpoint_ranks():
+    assert checkpoint_ranks(10, [0.5, 0.25]) == {2: 0.25, 4: 0.5}
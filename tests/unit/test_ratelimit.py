@@ -0,0 +1,107 @@
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from sampling_core import ratelimit
+from sampling_core.ratelimit import DECREASE_COOLDOWN, MAX_RETRIES, MAX_TRANSIENT_RETRIES, MIN_TPS, RateLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(ratelimit.time, 'sleep', lambda seconds: None)
+    return clock
+
+def client_error(code, status=400):
+    return ClientError({"Error": {"Code": code, "Message": ""}, "ResponseMetadata": {"HTTPStatusCode": status}}, 'DetectModerationLabels')
+
+def failing(errors):
+    # raises the errors one after the other, then returns 'ok'
+    calls = []
+
+    def fn():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return 'ok'
+    return fn, calls
+
+def test_throttle_halves_the_rate_once_per_cooldown(clock):
+    limiter = RateLimiter(40)
+    limiter.on_throttle()
+    assert limiter.rate == 20
+    # the throttles of the calls already in flight
+    clock.now += DECREASE_COOLDOWN / 2
+    limiter.on_throttle()
+    assert limiter.rate == 20
+    clock.now += DECREASE_COOLDOWN
+    limiter.on_throttle()
+    assert limiter.rate == 10
+    assert limiter.throttles == 3
+
+def test_rate_never_below_the_minimum(clock):
+    limiter = RateLimiter(1)
+    for _ in range(5):
+        clock.now += DECREASE_COOLDOWN
+        limiter.on_throttle()
+    assert limiter.rate == MIN_TPS
+
+def test_rate_grows_back_up_to_the_budget(clock):
+    limiter = RateLimiter(10)
+    limiter.on_throttle()
+    # one TPS per second of calls at the current rate
+    for _ in range(5):
+        limiter.on_success()
+    assert limiter.rate == pytest.approx(6, abs=0.1)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 10
+
+def test_throttled_calls_are_retried(clock):
+    fn, calls = failing([client_error('ThrottlingException')] * 2)
+    limiter = RateLimiter(10)
+    assert limiter.call(fn) == 'ok'
+    assert len(calls) == 3
+    assert limiter.stats()["Throttles"] == 2
+
+def test_throttled_too_many_times(clock):
+    fn, calls = failing([client_error('ThrottlingException')] * (MAX_RETRIES + 1))
+    with pytest.raises(ClientError):
+        RateLimiter(10).call(fn)
+    assert len(calls) == MAX_RETRIES + 1
+
+@pytest.mark.parametrize('error', [
+    ReadTimeoutError(endpoint_url='https://rekognition.us-east-1.amazonaws.com'),
+    EndpointConnectionError(endpoint_url='https://rekognition.us-east-1.amazonaws.com'),
+    client_error('InternalServerError', 500),
+    client_error('ServiceUnavailableException', 503)
+])
+def test_transient_errors_are_retried(clock, error):
+    fn, calls = failing([error] * MAX_TRANSIENT_RETRIES)
+    limiter = RateLimiter(10)
+    assert limiter.call(fn) == 'ok'
+    assert len(calls) == MAX_TRANSIENT_RETRIES + 1
+    # transient errors do not slow down the calls
+    assert limiter.rate == 10
+
+def test_transient_errors_too_many_times(clock):
+    error = ReadTimeoutError(endpoint_url='https://rekognition.us-east-1.amazonaws.com')
+    fn, calls = failing([error] * (MAX_TRANSIENT_RETRIES + 1))
+    with pytest.raises(ReadTimeoutError):
+        RateLimiter(10).call(fn)
+
+def test_throttles_and_transient_errors_are_counted_apart(clock):
+    fn, calls = failing([client_error('ThrottlingException')] * 3 + [client_error('InternalServerError', 500)] * MAX_TRANSIENT_RETRIES)
+    assert RateLimiter(10).call(fn) == 'ok'
+
+def test_client_errors_are_not_retried(clock):
+    fn, calls = failing([client_error('InvalidImageFormatException')])
+    with pytest.raises(ClientError):
+        RateLimiter(10).call(fn)
+    assert len(calls) == 1
@@ -3,6 +3,7 @@ from aws_cdk import (
     Stack,
     aws_lambda as _lambda,
     RemovalPolicy,
+    BundlingOptions,
     CfnOutput
 )
 from constructs import Construct
@@ -29,6 +30,18 @@ class LambdaStack(Stack):
                                      removal_policy=RemovalPolicy.DESTROY
                                      )
 
+        # create Lambda layer with the code shared by the Lambda functions and its dependencies (numpy)
+        shared_layer = _lambda.LayerVersion(self, 'shared_layer',
+                                     code=_lambda.Code.from_asset(os.path.join("./", "lambda/shared"),
+                                        bundling=BundlingOptions(
+                                            image=_lambda.Runtime.PYTHON_3_9.bundling_image,
+                                            command=["bash", "-c", "pip install -r requirements.txt -t /asset-output/python && cp -r python/. /asset-output/python"]
+                                        )),
+                                     description='Shared frame sampling code',
+                                     compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+                                     removal_policy=RemovalPolicy.DESTROY
+                                     )
+
         # Lambda: rek-video-image-sampling
         lambda_all_in_one = _lambda.Function(self, 
             id='all-in-one', 
@@ -39,7 +52,7 @@ class LambdaStack(Stack):
             timeout=Duration.seconds(900), # max timeout 15 minutes
             role=create_lambda_all_in_one_role(self, self.region, self.account_id),
             memory_size=10240,
-            layers=[ffmpeg_layer]
+            layers=[ffmpeg_layer, shared_layer]
         )
         
         CfnOutput(self, id="LambdaFunctionName", value=f"rek-video-image-sampling-{self.instance_hash}", export_name="LambdaFunctionName")
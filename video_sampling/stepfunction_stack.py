@@ -3,25 +3,39 @@ from aws_cdk import (
     Stack,
     aws_lambda as _lambda,
     RemovalPolicy,
+    BundlingOptions,
     aws_stepfunctions as _aws_stepfunctions,
     CfnOutput
 )
 from constructs import Construct
 import os
 from iam_role.lambda_all_in_one import create_role as create_lambda_all_in_one_role
+from iam_role.lambda_plan_segments import create_role as create_lambda_plan_segments_role
+from iam_role.lambda_merge_manifests import create_role as create_lambda_merge_manifests_role
 from iam_role.lambda_capture_video_frame import create_role as create_lambda_capture_video_frame_role
 from iam_role.lambda_moderate_image import create_role as create_lambda_moderate_image_role
+from iam_role.lambda_densify import create_role as create_lambda_densify_role
 from iam_role.lambda_consolidate import create_role as create_lambda_consolidate_role
+from iam_role.lambda_list_videos import create_role as create_lambda_list_videos_role
 from iam_role.lambda_step_functions import create_role as create_step_function_role
 
 class StepFunctionsStack(Stack):
     account_id = None
     region = None
     instance_hash = None
+    moderate_batch_size = None
+    video_concurrency = None
+    moderate_concurrency = None
 
-    def __init__(self, scope: Construct, construct_id: str, instance_hash_code: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, instance_hash_code: str, moderate_batch_size: int = 20, video_concurrency: int = 5, moderate_concurrency: int = 10, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
         self.instance_hash = instance_hash_code
+        # Number of images moderated by one moderate-image invocation
+        self.moderate_batch_size = moderate_batch_size
+        # Number of videos moderated at the same time by the batch state machine
+        self.video_concurrency = video_concurrency
+        # Number of moderate-image invocations running at the same time for one video
+        self.moderate_concurrency = moderate_concurrency
 
         self.account_id=os.environ.get("CDK_DEPLOY_ACCOUNT", os.environ["CDK_DEFAULT_ACCOUNT"])
         self.region=os.environ.get("CDK_DEPLOY_REGION", os.environ["CDK_DEFAULT_REGION"])
@@ -33,7 +47,34 @@ class StepFunctionsStack(Stack):
                                      compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
                                      removal_policy=RemovalPolicy.DESTROY
                                      )
+
+        # create Lambda layer with the code shared by the Lambda functions and its dependencies (numpy)
+        shared_layer = _lambda.LayerVersion(self, 'shared_layer',
+                                     code=_lambda.Code.from_asset(os.path.join("./", "lambda/shared"),
+                                        bundling=BundlingOptions(
+                                            image=_lambda.Runtime.PYTHON_3_9.bundling_image,
+                                            command=["bash", "-c", "pip install -r requirements.txt -t /asset-output/python && cp -r python/. /asset-output/python"]
+                                        )),
+                                     description='Shared frame sampling code',
+                                     compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+                                     removal_policy=RemovalPolicy.DESTROY
+                                     )
         # Create Lambdas
+        # Lambda: rek-video-image-sampling-plan-segments
+        lambda_plan_segments = _lambda.Function(self, 
+            id='plan-segments', 
+            function_name=f"rek-video-image-sampling-plan-segments-{self.instance_hash}", 
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler='rek-video-image-sampling-plan-segments.lambda_handler',
+            code=_lambda.Code.from_asset(os.path.join("./", "lambda/plan-segments")),
+            timeout=Duration.seconds(60),
+            role=create_lambda_plan_segments_role(self, self.region, self.account_id),
+            memory_size=1024,
+            layers=[ffmpeg_layer, shared_layer],
+            # shares the rekognition_tps budget of a video between the moderation batches running at once
+            environment={"MODERATE_CONCURRENCY": str(self.moderate_concurrency)}
+        )
+
         # Lambda: rek-video-image-sampling-capture-frames
         lambda_capture_video_frames = _lambda.Function(self, 
             id='capture-frames', 
@@ -44,7 +85,20 @@ class StepFunctionsStack(Stack):
             timeout=Duration.seconds(900), # max timeout 15 minutes
             role=create_lambda_capture_video_frame_role(self, self.region, self.account_id),
             memory_size=10240,
-            layers=[ffmpeg_layer]
+            layers=[ffmpeg_layer, shared_layer]
+        )
+
+        # Lambda: rek-video-image-sampling-merge-manifests
+        lambda_merge_manifests = _lambda.Function(self, 
+            id='merge-manifests', 
+            function_name=f"rek-video-image-sampling-merge-manifests-{self.instance_hash}", 
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler='rek-video-image-sampling-merge-manifests.lambda_handler',
+            code=_lambda.Code.from_asset(os.path.join("./", "lambda/merge-manifests")),
+            timeout=Duration.seconds(300),
+            role=create_lambda_merge_manifests_role(self, self.region, self.account_id),
+            memory_size=1024,
+            layers=[shared_layer]
         )
 
         # Lambda: rek-video-image-sampling-moderate-image
@@ -54,9 +108,23 @@ class StepFunctionsStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_9,
             handler='rek-video-image-sampling-moderate-image.lambda_handler',
             code=_lambda.Code.from_asset(os.path.join("./", "lambda/moderate-image")),
-            timeout=Duration.seconds(10), # max timeout 15 minutes
+            timeout=Duration.seconds(60), # a batch of images per invocation
             role=create_lambda_moderate_image_role(self, self.region, self.account_id),
             memory_size=1024,
+            layers=[ffmpeg_layer, shared_layer] # ffmpeg tiles the prescreen contact sheets
+        )
+
+        # Lambda: rek-video-image-sampling-densify
+        lambda_densify = _lambda.Function(self, 
+            id='densify', 
+            function_name=f"rek-video-image-sampling-densify-{self.instance_hash}", 
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler='rek-video-image-sampling-densify.lambda_handler',
+            code=_lambda.Code.from_asset(os.path.join("./", "lambda/densify")),
+            timeout=Duration.seconds(900), # max timeout 15 minutes
+            role=create_lambda_densify_role(self, self.region, self.account_id),
+            memory_size=10240,
+            layers=[ffmpeg_layer, shared_layer]
         )
 
         # Lambda: rek-video-image-sampling-consolidate
@@ -69,7 +137,21 @@ class StepFunctionsStack(Stack):
             timeout=Duration.seconds(900), # max timeout 15 minutes
             role=create_lambda_consolidate_role(self, self.region, self.account_id),
             memory_size=10240,
+            layers=[shared_layer]
         )        
+
+        # Lambda: rek-video-image-sampling-list-videos
+        lambda_list_videos = _lambda.Function(self, 
+            id='list-videos', 
+            function_name=f"rek-video-image-sampling-list-videos-{self.instance_hash}", 
+            runtime=_lambda.Runtime.PYTHON_3_9,
+            handler='rek-video-image-sampling-list-videos.lambda_handler',
+            code=_lambda.Code.from_asset(os.path.join("./", "lambda/list-videos")),
+            timeout=Duration.seconds(900), # max timeout 15 minutes, large prefixes are listed 1000 keys per call
+            role=create_lambda_list_videos_role(self, self.region, self.account_id),
+            memory_size=1024,
+            layers=[shared_layer]
+        )
         
         # StepFunctions StateMachine
         sm_json = None
@@ -77,13 +159,38 @@ class StepFunctionsStack(Stack):
             sm_json = str(f.read())
 
         if sm_json is not None:
+            sm_json = sm_json.replace("##LAMBDA_PLAN_SEGMENTS##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-plan-segments-{self.instance_hash}")
             sm_json = sm_json.replace("##LAMBDA_CAPTURE_VIDEO_FRAMES##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-capture-frames-{self.instance_hash}")
+            sm_json = sm_json.replace("##LAMBDA_MERGE_MANIFESTS##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-merge-manifests-{self.instance_hash}")
             sm_json = sm_json.replace("##LAMBDA_MODERATE_IMAGE##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-moderate-image-{self.instance_hash}")
+            sm_json = sm_json.replace("##LAMBDA_DENSIFY##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-densify-{self.instance_hash}")
             sm_json = sm_json.replace("##LAMBDA_CONSOLIDATION##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-consolidate-{self.instance_hash}")
+            # MaxItemsPerBatch is a number: replace the quoted placeholder
+            sm_json = sm_json.replace('"##MODERATE_BATCH_SIZE##"', str(self.moderate_batch_size))
+            sm_json = sm_json.replace('"##MODERATE_CONCURRENCY##"', str(self.moderate_concurrency))
             
+        step_function_role = create_step_function_role(self, self.region, self.account_id)
         cfn_state_machine = _aws_stepfunctions.CfnStateMachine(self, f'rek-video-sampling-workload-{self.instance_hash}',
             state_machine_name=f'rek-video-sampling-workload-{self.instance_hash}', 
-            role_arn=create_step_function_role(self, self.region, self.account_id).role_arn,
+            role_arn=step_function_role.role_arn,
             definition_string=sm_json)
 
+        # StepFunctions StateMachine: batch of videos, one execution of the state machine above per video
+        batch_sm_json = None
+        with open('./stepfunctions/rek-video-moderation-image-sampling-batch.json', "r") as f:
+            batch_sm_json = str(f.read())
+
+        if batch_sm_json is not None:
+            batch_sm_json = batch_sm_json.replace("##LAMBDA_LIST_VIDEOS##", f"arn:aws:lambda:{self.region}:{self.account_id}:function:rek-video-image-sampling-list-videos-{self.instance_hash}")
+            batch_sm_json = batch_sm_json.replace("##STATE_MACHINE_VIDEO##", f"arn:aws:states:{self.region}:{self.account_id}:stateMachine:rek-video-sampling-workload-{self.instance_hash}")
+            # MaxConcurrency is a number: replace the quoted placeholder
+            batch_sm_json = batch_sm_json.replace('"##VIDEO_CONCURRENCY##"', str(self.video_concurrency))
+
+        cfn_batch_state_machine = _aws_stepfunctions.CfnStateMachine(self, f'rek-video-sampling-batch-{self.instance_hash}',
+            state_machine_name=f'rek-video-sampling-batch-{self.instance_hash}', 
+            role_arn=step_function_role.role_arn,
+            definition_string=batch_sm_json)
+        cfn_batch_state_machine.add_dependency(cfn_state_machine)
+
         CfnOutput(self, id="StepFunctionsStateMachineName", value=f'rek-video-sampling-workload-{self.instance_hash}', export_name="StepFunctionsStateMachineName")
+        CfnOutput(self, id="StepFunctionsBatchStateMachineName", value=f'rek-video-sampling-batch-{self.instance_hash}', export_name="StepFunctionsBatchStateMachineName")